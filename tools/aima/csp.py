@@ -1,14 +1,15 @@
 """CSP (Constraint Satisfaction Problems) problems and solvers. (Chapter 6)."""
 
-from utils import argmin_random_tie, count, first
+from utils import argmin_random_tie, count, first, print_table
 import search
 
 from collections import defaultdict
-from functools import reduce
+from functools import partial, reduce
 
 import itertools
 import re
 import random
+import time
 
 
 class CSP(search.Problem):
@@ -46,6 +47,15 @@ class CSP(search.Problem):
     The following are just for debugging purposes:
         nassigns                Slot: tracks the number of assignments made
         display(a)              Print a human-readable representation
+    Setting the slot bitset_domains to True before solving makes
+    curr_domains hold BitsetDomains instead of lists. Then supports are
+    bitmasks too (see support_bits), and forward_checking and mac test a
+    value, or prune a whole domain, with one integer operation. The
+    constraints function must then always give the same answer for the
+    same arguments.
+    While trail is a list (backtracking_search makes it one), prune and
+    suppose also push undo records onto it, so a search can save the trail
+    height with checkpoint() and put the domains back with undo(height).
     """
 
     def __init__(self, variables, domains, neighbors, constraints):
@@ -59,6 +69,10 @@ class CSP(search.Problem):
         self.initial = ()
         self.curr_domains = None
         self.nassigns = 0
+        self.bitset_domains = False
+        self.supports = {}  # Cache for support_bits
+        self.residues = {}  # Last support found for each (Xi, x, Xj) by AC3rm
+        self.trail = None
 
     def assign(self, var, val, assignment):
         """Add {var: val} to assignment; Discard the old value if any."""
@@ -116,21 +130,58 @@ class CSP(search.Problem):
         """Make sure we can prune values from domains. (We want to pay
         for this only if we use it.)"""
         if self.curr_domains is None:
-            self.curr_domains = {v: list(self.domains[v]) for v in self.variables}
+            if self.bitset_domains:
+                self.curr_domains = {v: BitsetDomain(self.domains[v])
+                                     for v in self.variables}
+            else:
+                self.curr_domains = {v: list(self.domains[v]) for v in self.variables}
 
     def suppose(self, var, value):
-        """Start accumulating inferences from assuming var=value."""
+        """Start accumulating inferences from assuming var=value.
+        With a trail the supposition is recorded there, and None is
+        returned instead of a list of removals."""
         self.support_pruning()
-        removals = [(var, a) for a in self.curr_domains[var] if a != value]
-        self.curr_domains[var] = [value]
+        domain = self.curr_domains[var]
+        if self.trail is not None:
+            if isinstance(domain, BitsetDomain):
+                self.trail.append((var, None, domain.bits))
+                domain.keep_only(value)
+            else:
+                self.trail.append((var, None, domain))
+                self.curr_domains[var] = [value]
+            return None
+        removals = [(var, a) for a in domain if a != value]
+        if isinstance(domain, BitsetDomain):
+            domain.keep_only(value)
+        else:
+            self.curr_domains[var] = [value]
         return removals
 
     def prune(self, var, value, removals):
         """Rule out var=value."""
-        self.curr_domains[var].remove(value)
+        domain = self.curr_domains[var]
+        if self.trail is None:
+            domain.remove(value)
+        elif isinstance(domain, BitsetDomain):
+            self.trail.append((var, None, domain.bits))
+            domain.remove(value)
+        else:
+            i = domain.index(value)
+            self.trail.append((var, i, value))
+            del domain[i]
         if removals is not None:
             removals.append((var, value))
 
+    def restrict(self, var, mask, removals):
+        """Rule out every value of var whose bit is not set in mask. The
+        domain of var must be a BitsetDomain."""
+        domain = self.curr_domains[var]
+        if self.trail is not None:
+            self.trail.append((var, None, domain.bits))
+        dead = domain.restrict(mask)
+        if removals is not None:
+            removals.extend((var, domain.values[i]) for i in set_bits(dead))
+
     def choices(self, var):
         """Return all values for var that aren't currently ruled out."""
         return (self.curr_domains or self.domains)[var]
@@ -146,6 +197,44 @@ class CSP(search.Problem):
         for B, b in removals:
             self.curr_domains[B].append(b)
 
+    def checkpoint(self):
+        """Return the height of the trail, to pass to undo later."""
+        return len(self.trail)
+
+    def undo(self, height):
+        """Undo the suppositions and prunings recorded on the trail since it
+        had the given height. Each record is (var, i, value): value was
+        removed from position i of the list domain of var, or if i is None,
+        value is the previous domain of var (a list, or a BitsetDomain's
+        bits). The domains get back their values in their old order."""
+        trail, domains = self.trail, self.curr_domains
+        while len(trail) > height:
+            var, i, value = trail.pop()
+            if i is not None:
+                domains[var].insert(i, value)
+            elif isinstance(value, list):
+                domains[var] = value
+            else:
+                domains[var].bits = value
+
+    def support_bits(self, A, i, B):
+        """Return a bitmask of the values of B consistent with A taking its
+        ith value: bit j is set when the constraint holds for the jth value
+        of B. Positions are those of the BitsetDomains in curr_domains.
+        Each mask is computed on first use, then cached in self.supports."""
+        table = self.supports.get((A, B))
+        if table is None:
+            table = self.supports[A, B] = [None] * len(self.curr_domains[A].values)
+        bits = table[i]
+        if bits is None:
+            a = self.curr_domains[A].values[i]
+            bits = 0
+            for (j, b) in enumerate(self.curr_domains[B].values):
+                if self.constraints(A, a, B, b):
+                    bits |= 1 << j
+            table[i] = bits
+        return bits
+
     # This is for min_conflicts search
 
     def conflicted_vars(self, current):
@@ -153,6 +242,91 @@ class CSP(search.Problem):
         return [var for var in self.variables
                 if self.nconflicts(var, current[var], current) > 0]
 
+    def conflict_counts(self, current):
+        """Return a ConflictCounts that tracks the conflicted variables of
+        current as min_conflicts changes it."""
+        return ConflictCounts(self, current)
+
+# ______________________________________________________________________________
+# Bitset domains
+
+
+try:
+    popcount = int.bit_count
+except AttributeError:  # Python < 3.10
+    def popcount(bits):
+        """Return the number of 1 bits of a nonnegative int."""
+        return bin(bits).count('1')
+
+
+def set_bits(bits):
+    """Yield the indices of the 1 bits of a nonnegative int, lowest first."""
+    while bits:
+        lowest = bits & -bits
+        yield lowest.bit_length() - 1
+        bits ^= lowest
+
+
+class BitsetDomain:
+    """The remaining values of a variable, kept as the bits of an int: bit i
+    is set while the ith value of the variable's full domain is still
+    possible. It supports the list operations the CSP code uses on
+    curr_domains (iteration, len, in, [i], remove, append), so it can stand
+    in for a list; iteration always follows the order of the full domain.
+    >>> d = BitsetDomain('RGB'); d.remove('G'); d
+    ['R', 'B']
+    """
+
+    __slots__ = ('values', 'index', 'bits')
+
+    def __init__(self, values):
+        self.values = tuple(values)
+        self.index = {value: i for (i, value) in enumerate(self.values)}
+        self.bits = (1 << len(self.values)) - 1
+
+    def __iter__(self):
+        values = self.values
+        return (values[i] for i in set_bits(self.bits))
+
+    def __len__(self):
+        return popcount(self.bits)
+
+    def __bool__(self):
+        return self.bits != 0
+
+    def __contains__(self, value):
+        i = self.index.get(value)
+        return i is not None and self.bits >> i & 1 == 1
+
+    def __getitem__(self, i):
+        return list(self)[i]
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __repr__(self):
+        return repr(list(self))
+
+    def remove(self, value):
+        bit = 1 << self.index[value]
+        if not self.bits & bit:
+            raise ValueError('BitsetDomain.remove(x): x not in domain')
+        self.bits ^= bit
+
+    def append(self, value):
+        self.bits |= 1 << self.index[value]
+
+    def keep_only(self, value):
+        """Remove every value but the given one."""
+        self.bits = 1 << self.index[value]
+
+    def restrict(self, mask):
+        """Keep only the values whose bits are set in mask, and return the
+        bits of the values removed."""
+        dead = self.bits & ~mask
+        self.bits &= mask
+        return dead
+
 # ______________________________________________________________________________
 # Constraint Propagation with AC-3
 
@@ -183,6 +357,55 @@ def revise(csp, Xi, Xj, removals):
             revised = True
     return revised
 
+
+def AC3rm(csp, queue=None, removals=None):
+    """AC-3 with residual supports (AC-3rm): it removes the same values as
+    AC3, with fewer constraint checks, by remembering for each (Xi, x, Xj)
+    the last value of Xj found to support Xi=x. That value is tried first
+    the next time the arc is revised."""
+    if queue is None:
+        queue = [(Xi, Xk) for Xi in csp.variables for Xk in csp.neighbors[Xi]]
+    csp.support_pruning()
+    while queue:
+        (Xi, Xj) = queue.pop()
+        if revise_rm(csp, Xi, Xj, removals):
+            if not csp.curr_domains[Xi]:
+                return False
+            for Xk in csp.neighbors[Xi]:
+                if Xk != Xj:
+                    queue.append((Xk, Xi))
+    return True
+
+
+def revise_rm(csp, Xi, Xj, removals):
+    """Return true if we remove a value. Like revise, but a value x of Xi
+    is kept at once if its residue (last known support) is still in Xj's
+    domain (a set of it is made first, so that test is O(1) with list
+    domains too). With bitset domains the support test is a single AND."""
+    Dj = csp.curr_domains[Xj]
+    if isinstance(Dj, BitsetDomain):
+        Di, live = csp.curr_domains[Xi], Dj.bits
+        dead = 0
+        for i in set_bits(Di.bits):
+            if not csp.support_bits(Xi, i, Xj) & live:
+                dead |= 1 << i
+        if dead:
+            csp.restrict(Xi, ~dead, removals)
+        return dead != 0
+    revised = False
+    residues, live = csp.residues, set(Dj)
+    for x in csp.curr_domains[Xi][:]:
+        if (Xi, x, Xj) in residues and residues[Xi, x, Xj] in live:
+            continue
+        for y in Dj:
+            if csp.constraints(Xi, x, Xj, y):
+                residues[Xi, x, Xj] = y
+                break
+        else:
+            csp.prune(Xi, x, removals)
+            revised = True
+    return revised
+
 # ______________________________________________________________________________
 # CSP Backtracking Search
 
@@ -233,9 +456,14 @@ def forward_checking(csp, var, value, assignment, removals):
     csp.support_pruning()
     for B in csp.neighbors[var]:
         if B not in assignment:
-            for b in csp.curr_domains[B][:]:
-                if not csp.constraints(var, value, B, b):
-                    csp.prune(B, b, removals)
+            domain = csp.curr_domains[B]
+            if isinstance(domain, BitsetDomain):
+                i = csp.curr_domains[var].index[value]
+                csp.restrict(B, csp.support_bits(var, i, B), removals)
+            else:
+                for b in domain[:]:
+                    if not csp.constraints(var, value, B, b):
+                        csp.prune(B, b, removals)
             if not csp.curr_domains[B]:
                 return False
     return True
@@ -243,7 +471,7 @@ def forward_checking(csp, var, value, assignment, removals):
 
 def mac(csp, var, value, assignment, removals):
     """Maintain arc consistency."""
-    return AC3(csp, [(X, var) for X in csp.neighbors[var]], removals)
+    return AC3rm(csp, [(X, var) for X in csp.neighbors[var]], removals)
 
 # The search, proper
 
@@ -252,7 +480,10 @@ def backtracking_search(csp,
                         select_unassigned_variable=first_unassigned_variable,
                         order_domain_values=unordered_domain_values,
                         inference=no_inference):
-    """[Figure 6.5]"""
+    """[Figure 6.5]
+    Inferences are undone through the trail of csp (see CSP.undo): each
+    level of the search remembers the trail height before its supposition,
+    so no removals lists are built."""
 
     def backtrack(assignment):
         if len(assignment) == len(csp.variables):
@@ -261,16 +492,22 @@ def backtracking_search(csp,
         for value in order_domain_values(var, assignment, csp):
             if 0 == csp.nconflicts(var, value, assignment):
                 csp.assign(var, value, assignment)
-                removals = csp.suppose(var, value)
-                if inference(csp, var, value, assignment, removals):
+                height = csp.checkpoint()
+                csp.suppose(var, value)
+                if inference(csp, var, value, assignment, None):
                     result = backtrack(assignment)
                     if result is not None:
                         return result
-                csp.restore(removals)
+                csp.undo(height)
         csp.unassign(var, assignment)
         return None
 
-    result = backtrack({})
+    csp.support_pruning()
+    csp.trail = []
+    try:
+        result = backtrack({})
+    finally:
+        csp.trail = None
     assert result is None or csp.goal_test(result)
     return result
 
@@ -286,22 +523,81 @@ def min_conflicts(csp, max_steps=100000):
         val = min_conflicts_value(csp, var, current)
         csp.assign(var, val, current)
     # Now repeatedly choose a random conflicted variable and change it
+    counts = csp.conflict_counts(current)
     for i in range(max_steps):
-        conflicted = csp.conflicted_vars(current)
-        if not conflicted:
+        if not counts.conflicted:
             return current
-        var = random.choice(conflicted)
+        var = random.choice(counts.conflicted)
         val = min_conflicts_value(csp, var, current)
-        csp.assign(var, val, current)
+        counts.assign(var, val)
     return None
 
 
 def min_conflicts_value(csp, var, current):
     """Return the value that will give var the least number of conflicts.
-    If there is a tie, choose at random."""
+    If there is a tie, choose at random. A CSP can supply a faster way
+    to find such a value as a min_conflicts_value method."""
+    if hasattr(csp, 'min_conflicts_value'):
+        return csp.min_conflicts_value(var, current)
     return argmin_random_tie(csp.domains[var],
                              key=lambda val: csp.nconflicts(var, val, current))
 
+
+class ConflictCounts:
+    """Keep track of the conflicts in a complete assignment for
+    min_conflicts, so that a step does not have to look at every variable:
+        counts[var]     The number of neighbors that var conflicts with
+        conflicted      A list of the variables with counts[var] > 0, in
+                        no particular order (so random.choice works on it)
+    Changing var through assign only looks at the neighbors of var, so a
+    step costs O(deg) rather than O(V * deg)."""
+
+    def __init__(self, csp, assignment):
+        self.csp = csp
+        self.assignment = assignment
+        self.conflicted = []
+        self.position = {}  # Index of each conflicted variable in conflicted
+        self.counts = {}
+        for var in csp.variables:
+            self.set_count(var, csp.nconflicts(var, assignment[var], assignment))
+
+    def set_count(self, var, count):
+        """Record that var has count conflicts, adding it to or removing it
+        from the conflicted list as needed."""
+        self.counts[var] = count
+        self.set_conflicted(var, count > 0)
+
+    def set_conflicted(self, var, conflicted):
+        """Add var to, or remove it from, the conflicted list."""
+        if conflicted and var not in self.position:
+            self.position[var] = len(self.conflicted)
+            self.conflicted.append(var)
+        elif not conflicted and var in self.position:
+            # Move the last variable into the hole left by var
+            i = self.position.pop(var)
+            last = self.conflicted.pop()
+            if last != var:
+                self.conflicted[i] = last
+                self.position[last] = i
+
+    def assign(self, var, val):
+        """Assign var=val, updating the counts of var and its neighbors."""
+        csp, assignment, counts = self.csp, self.assignment, self.counts
+        old = assignment.get(var, None)
+        if val == old:
+            return
+        count = 0
+        for B in csp.neighbors[var]:
+            if B != var and B in assignment:
+                b = assignment[B]
+                now = not csp.constraints(var, val, B, b)
+                before = old is not None and not csp.constraints(var, old, B, b)
+                if now != before:
+                    self.set_count(B, counts[B] + now - before)
+                count += now
+        self.set_count(var, count)
+        csp.assign(var, val, assignment)
+
 # ______________________________________________________________________________
 
 
@@ -478,6 +774,15 @@ def queen_constraint(A, a, B, b):
     return A == B or (a != b and A + a != B + b and A - a != B - b)
 
 
+def flip_bit(bitboards, i, count, delta):
+    """Keep bitboards[k-1], the set of lines holding at least k queens, up
+    to date for k = 1, 2 after the count of line i changed by delta (+1/-1)
+    to count."""
+    k = count if delta > 0 else count + 1  # The count that was crossed
+    if k <= 2:
+        bitboards[k - 1] ^= 1 << i
+
+
 class NQueensCSP(CSP):
     """Make a CSP for the nQueens problem for search with min_conflicts.
     Suitable for large n, it uses only data structures of size O(n).
@@ -490,10 +795,18 @@ class NQueensCSP(CSP):
         ups[i]       Number of queens in the / diagonal
                      such that their (x, y) coordinates have x-y+n-1 = i
     We increment/decrement these counts each time a queen is placed/moved from
-    a row/diagonal. So moving is O(1), as is nconflicts.  But choosing
-    a variable, and a best value for the variable, are each O(n).
-    If you want, you can keep track of conflicted variables, then variable
-    selection will also be O(1).
+    a row/diagonal. So moving is O(1), as is nconflicts.  Alongside the
+    counts we keep bitboards (ints used as bit sets) per direction; the
+    first has a bit set for each line holding at least one queen, the
+    second for each line holding at least two:
+        row_bits     bit y for rows[y] > 0, rows[y] > 1
+        down_bits    bit x+y for downs[x+y] > 0, downs[x+y] > 1
+        up_bits      bit y-x+n-1 for ups[x-y+n-1] > 0, ups[x-y+n-1] > 1
+                     (mirrored, so that shifting right by n-1-x lines the
+                     bits of column x up with row_bits)
+    Combining these gives every row of a column with no conflicts (or with
+    just one) at once, so choosing a best value usually takes a few big-int
+    operations instead of n calls to nconflicts.
     >>> len(backtracking_search(NQueensCSP(8)))
     8
     """
@@ -506,6 +819,13 @@ class NQueensCSP(CSP):
         self.rows = [0]*n
         self.ups = [0]*(2*n - 1)
         self.downs = [0]*(2*n - 1)
+        self.row_bits, self.down_bits, self.up_bits = [0, 0], [0, 0], [0, 0]
+        self.all_rows = (1 << n) - 1
+        # XOR of the columns of the queens on each line; when a line holds
+        # just one queen, this is its column
+        self.row_xors = [0]*n
+        self.up_xors = [0]*(2*n - 1)
+        self.down_xors = [0]*(2*n - 1)
 
     def nconflicts(self, var, val, assignment):
         """The number of conflicts, as recorded with each assignment.
@@ -538,6 +858,102 @@ class NQueensCSP(CSP):
         self.rows[val] += delta
         self.downs[var + val] += delta
         self.ups[var - val + n - 1] += delta
+        flip_bit(self.row_bits, val, self.rows[val], delta)
+        flip_bit(self.down_bits, var + val, self.downs[var + val], delta)
+        flip_bit(self.up_bits, val - var + n - 1, self.ups[var - val + n - 1],
+                 delta)
+        self.row_xors[val] ^= var
+        self.down_xors[var + val] ^= var
+        self.up_xors[var - val + n - 1] ^= var
+
+    def values_with_conflicts(self, var, assignment, k=0):
+        """Return a bitmask of the values val with
+        nconflicts(var, val, assignment) == k, for k = 0 or 1."""
+        n = len(self.variables)
+        (r1, r2), (d1, d2), (u1, u2) = self.row_bits, self.down_bits, self.up_bits
+        d1, d2, u1, u2 = d1 >> var, d2 >> var, u1 >> (n - 1 - var), u2 >> (n - 1 - var)
+        if k == 0:
+            values = ~(r1 | d1 | u1)
+        else:  # Exactly one line with a queen, and that line has just one
+            values = (r1 ^ d1 ^ u1) & ~(r1 & d1 & u1) & ~(r2 | d2 | u2)
+        values &= self.all_rows
+        # The lines of var's own queen only cross column var at its own row
+        val = assignment.get(var, None)
+        if val is not None:
+            if self.nconflicts(var, val, assignment) == k:
+                values |= 1 << val
+            else:
+                values &= ~(1 << val)
+        return values
+
+    def min_conflicts_value(self, var, current, probes=4):
+        """Return a value with the least number of conflicts for var. Try a
+        few random rows first, as on a sparse board one is likely free; then
+        pick a random row with no conflicts, or else with one, from the
+        bitboards; only if there is none count the conflicts of every row."""
+        n = len(self.variables)
+        for _ in range(probes):
+            val = random.randrange(n)
+            if self.nconflicts(var, val, current) == 0:
+                return val
+        for k in (0, 1):
+            values = self.values_with_conflicts(var, current, k)
+            if values:
+                # Take the first such row at or above a random start, wrapping
+                start = random.randrange(n)
+                above = values >> start
+                if above:
+                    return start + (above & -above).bit_length() - 1
+                return (values & -values).bit_length() - 1
+        return argmin_random_tie(range(n),
+                                 key=lambda val: self.nconflicts(var, val, current))
+
+    def conflicted_vars(self, current):
+        """Return a list of variables in current assignment that are in
+        conflict, reading the counts directly rather than through
+        nconflicts (a queen counts itself once on each of its 3 lines)."""
+        n = len(self.variables)
+        rows, downs, ups = self.rows, self.downs, self.ups
+        return [var for var, val in current.items()
+                if rows[val] + downs[var + val] + ups[var - val + n - 1] > 3]
+
+    def conflict_counts(self, current):
+        return QueensConflictCounts(self, current)
+
+    def bitboards(self, assignment):
+        """Return the (row_bits, down_bits, up_bits) bitboards of the queens
+        in assignment, which need not have been made through assign."""
+        n = len(self.variables)
+        rows = downs = ups = 0
+        for var, val in assignment.items():
+            rows |= 1 << val
+            downs |= 1 << (var + val)
+            ups |= 1 << (val - var + n - 1)
+        return rows, downs, ups
+
+    # The tree and graph-search interface builds states without calling
+    # assign, so it cannot rely on the counts and works from bitboards.
+
+    def actions(self, state):
+        """Return the conflict-free placements of a queen in the first empty
+        column."""
+        n = len(self.variables)
+        if len(state) == n:
+            return []
+        assignment = dict(state)
+        var = first([v for v in self.variables if v not in assignment])
+        rows, downs, ups = self.bitboards(assignment)
+        attacked = rows | (downs >> var) | (ups >> (n - 1 - var))
+        return [(var, val) for val in set_bits(~attacked & self.all_rows)]
+
+    def goal_test(self, state):
+        """The goal is a queen in every column, none sharing a line; then
+        each bitboard has n bits set."""
+        assignment = dict(state)
+        n = len(self.variables)
+        return (len(assignment) == n and
+                all(bin(bits).count('1') == n
+                    for bits in self.bitboards(assignment)))
 
     def display(self, assignment):
         """Print the queens and the nconflicts values (for debugging)."""
@@ -560,6 +976,66 @@ class NQueensCSP(CSP):
                 print(str(self.nconflicts(var, val, assignment)) + ch, end=' ')
             print()
 
+
+class QueensConflictCounts(ConflictCounts):
+    """ConflictCounts for NQueensCSP, where every queen is a neighbor of
+    every other. The count of a queen is read from the line counters of
+    the CSP, and moving a queen can only change whether another queen is
+    in conflict when one of the six lines it leaves or joins goes between
+    one and two queens; the other queen on such a line is found from the
+    line's XOR of columns. So a step is O(1) instead of O(n). Only whether
+    each queen is in conflict is kept: counts is a QueenCounts, which works
+    out a queen's count when asked, in O(1), from the line counters."""
+
+    def __init__(self, csp, assignment):
+        self.csp = csp
+        self.assignment = assignment
+        self.conflicted = []
+        self.position = {}
+        self.counts = QueenCounts(csp, assignment)
+        for var in csp.variables:
+            self.update(var)
+
+    def update(self, var):
+        """Recheck whether the queen in column var is in conflict."""
+        self.set_conflicted(var, self.counts[var] > 0)
+
+    def assign(self, var, val):
+        csp, assignment = self.csp, self.assignment
+        old = assignment.get(var, None)
+        if val == old:
+            return
+        csp.assign(var, val, assignment)
+        for (counts, xors, i) in self.lines(var, val):
+            if counts[i] == 2:  # Joined a queen that was alone on the line
+                self.update(xors[i] ^ var)
+        if old is not None:
+            for (counts, xors, i) in self.lines(var, old):
+                if counts[i] == 1:  # Left a queen alone on the line
+                    self.update(xors[i])
+        self.update(var)
+
+    def lines(self, var, val):
+        """The (counts, xors, index) of the row and diagonals through
+        (var, val)."""
+        csp = self.csp
+        n = len(csp.variables)
+        return [(csp.rows, csp.row_xors, val),
+                (csp.downs, csp.down_xors, var + val),
+                (csp.ups, csp.up_xors, var - val + n - 1)]
+
+
+class QueenCounts:
+    """The current number of conflicts of each queen of an NQueensCSP
+    assignment, indexed by column, as ConflictCounts.counts is."""
+
+    def __init__(self, csp, assignment):
+        self.csp = csp
+        self.assignment = assignment
+
+    def __getitem__(self, var):
+        return self.csp.nconflicts(var, self.assignment[var], self.assignment)
+
 # ______________________________________________________________________________
 # Sudoku
 
@@ -570,6 +1046,9 @@ def flatten(seqs):
 
 easy1 = '..3.2.6..9..3.5..1..18.64....81.29..7.......8..67.82....26.95..8..2.3..9..5.1.3..'
 harder1 = '4173698.5.3..........7......2.....6.....8.4......1.......6.3.7.5..2.....1.4......'
+hardest = ['4.....8.5.3..........7......2.....6.....8.4......1.......6.3.7.5..2.....1.4......',
+           '1....7.9..3..2...8..96..5....53..9...1..8...26....4...3......1..4......7..7...3..',
+           '8..........36......7..9.2...5...7.......457.....1...3...1....68..85...1..9....4..']
 
 _R3 = list(range(3))
 _CELL = itertools.count().__next__
@@ -729,3 +1208,48 @@ def solve_zebra(algorithm=min_conflicts, **args):
                 print(var, end=' ')
         print()
     return ans['Zebra'], ans['Water'], z.nassigns, ans
+
+# ______________________________________________________________________________
+# Benchmarking backtracking search
+
+
+def csp_benchmark_problems(n_queens=30):
+    """Return (name, factory) pairs for benchmark_backtracking: the harder
+    Sudoku puzzles, the Zebra puzzle and n-queens. Each factory builds a
+    fresh CSP, since solving one leaves state behind."""
+    problems = [('Sudoku harder1', partial(Sudoku, harder1))]
+    problems += [('Sudoku hardest[{}]'.format(i), partial(Sudoku, grid))
+                 for (i, grid) in enumerate(hardest)]
+    problems += [('Zebra', Zebra),
+                 ('{}-queens'.format(n_queens), partial(NQueensCSP, n_queens))]
+    return problems
+
+
+def benchmark_backtracking(problems=None,
+                           inferences=[forward_checking, mac],
+                           bitset_domains=[False, True],
+                           select_unassigned_variable=mrv):
+    """Solve each problem with backtracking_search for each inference and
+    domain representation, and print a table of the number of assignments
+    made, the time taken and the assignments (search nodes) per second.
+    problems is a list of (name, factory) pairs; the default is
+    csp_benchmark_problems()."""
+    if problems is None:
+        problems = csp_benchmark_problems()
+    table = []
+    for (name, factory) in problems:
+        for inference in inferences:
+            for bitset in bitset_domains:
+                csp = factory()
+                csp.bitset_domains = bitset
+                start = time.perf_counter()
+                result = backtracking_search(
+                    csp, select_unassigned_variable=select_unassigned_variable,
+                    inference=inference)
+                elapsed = time.perf_counter() - start
+                table.append([name, inference.__name__,
+                              'bitset' if bitset else 'list',
+                              'solved' if result else 'failed', csp.nassigns,
+                              round(elapsed, 3), round(csp.nassigns / elapsed)])
+    print_table(table, ['Problem', 'Inference', 'Domains', 'Result',
+                        'nassigns', 'Seconds', 'Nodes/sec'])
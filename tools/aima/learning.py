@@ -8,13 +8,20 @@ from utils import (
     tanh, tanh_derivative, leaky_relu, leaky_relu_derivative, elu, elu_derivative
 )
 
+import contextlib
 import copy
+import functools
 import heapq
+import json
 import math
+import os
 import random
 
+import numpy as np
+
 from statistics import mean, stdev
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 
 # ______________________________________________________________________________
 
@@ -58,6 +65,8 @@ class DataSet:
     """A data set for a machine learning problem. It has the following fields:
 
     d.examples   A list of examples. Each one is a list of attribute values.
+                 With columnar=True, a ColumnarExamples instead, which holds
+                 a NumPy array per attribute but indexes the same way.
     d.attrs      A list of integers to index into an example, so example[attr]
                  gives a value. Normally the same as range(len(d.examples[0])).
     d.attrnames  Optional list of mnemonic names for corresponding attrs.
@@ -81,12 +90,14 @@ class DataSet:
 
     def __init__(self, examples=None, attrs=None, attrnames=None, target=-1,
                  inputs=None, values=None, distance=mean_boolean_error,
-                 name='', source='', exclude=()):
+                 name='', source='', exclude=(), columnar=False):
         """Accepts any of DataSet's fields. Examples can also be a
         string or file from which to parse examples using parse_csv.
         Optional parameter: exclude, as documented in .setproblem().
         >>> DataSet(examples='1, 2, 3')
         <DataSet(): 1 examples, 3 attributes>
+        >>> DataSet(examples='1, a, 3 \\n 2, b, 3', columnar=True).examples[1]
+        [2, 'b', 3]
         """
         self.name = name
         self.source = source
@@ -97,10 +108,15 @@ class DataSet:
         # Initialize .examples from string or list or data directory
         if isinstance(examples, str):
             self.examples = parse_csv(examples)
+        elif examples is None and columnar:
+            with open_data(name + '.csv') as file:
+                self.examples = read_csv_columns(file, cache=file.name + '.columns')
         elif examples is None:
             self.examples = parse_csv(open_data(name + '.csv').read())
         else:
             self.examples = examples
+        if columnar and not isinstance(self.examples, ColumnarExamples):
+            self.examples = ColumnarExamples(self.examples)
 
         # Attrs are the indices of examples, unless otherwise stated.   
         if self.examples is not None and attrs is None:
@@ -164,8 +180,17 @@ class DataSet:
         else:
             return attr
 
+    @property
+    def columnar(self):
+        """Are the examples stored as columns?"""
+        return isinstance(self.examples, ColumnarExamples)
+
     def update_values(self):
-        self.values = list(map(unique, zip(*self.examples)))
+        if self.columnar:
+            self.values = [self.examples.distinct_values(a)
+                           for a in range(len(self.examples.columns))]
+        else:
+            self.values = list(map(unique, zip(*self.examples)))
 
     def sanitize(self, example):
         """Return a copy of example, with non-input attributes replaced by None."""
@@ -177,12 +202,24 @@ class DataSet:
         if not classes:
             # If classes were not given, extract them from values
             classes = sorted(self.values[self.target])
+        if self.columnar:
+            codes = self.examples.value_codes(self.target, classes)
+            if (codes < 0).any():
+                raise ValueError('Class missing from {}'.format(classes))
+            self.examples.columns[self.target] = codes.astype(np.int64)
+            self.examples.categories[self.target] = None
+            self.examples.integers[self.target] = None
+            return
         for item in self.examples:
             item[self.target] = classes.index(item[self.target])
 
     def remove_examples(self, value=""):
         """Remove examples that contain given value."""
-        self.examples = [x for x in self.examples if value not in x]
+        if self.columnar:
+            has_value = self.examples.equal_to(value)
+            self.examples = self.examples[np.flatnonzero(~has_value.any(axis=0))]
+        else:
+            self.examples = [x for x in self.examples if value not in x]
         self.update_values()
 
     def split_values_by_classes(self):
@@ -205,6 +242,10 @@ class DataSet:
         target_names = self.values[self.target]
         feature_numbers = len(self.inputs)
 
+        if self.columnar:
+            return self.examples.means_and_deviations(self.target, target_names,
+                                                      self.inputs)
+
         item_buckets = self.split_values_by_classes()
 
         means = defaultdict(lambda: [0] * feature_numbers)
@@ -228,6 +269,217 @@ class DataSet:
         return '<DataSet({}): {:d} examples, {:d} attributes>'.format(
             self.name, len(self.examples), len(self.attrs))
 
+
+class ColumnarExamples:
+    """The examples of a DataSet held a column at a time, in far less
+    memory than a list of lists. It has the following fields:
+
+    c.columns     A list with a 1-D NumPy array for each attribute.
+    c.categories  A list with, for each attribute, None if its values are
+                  all bools or all numbers, and the column holds them as a
+                  bool, int64 or float64 array; otherwise a list of the
+                  values, and the column holds integer codes into it.
+    c.integers    A list with, for each attribute, None, or (for a float64
+                  column holding some ints) a bool array saying which of
+                  its values are ints, so they come back as ints.
+
+    It indexes like a list of examples: c[i] is example i as a list, and
+    iterating gives each example in turn. A slice c[i:j] is a
+    ColumnarExamples whose columns are views of these, so it costs no
+    copying (and writes go through, as with NumPy views); indexing with
+    a sequence of ints copies those rows.
+    >>> c = ColumnarExamples([[1, 'a', 2.5], [2, 'b', 3.0], [3, 'a', 0.5]])
+    >>> c.columns[1], c.categories[1]
+    (array([0, 1, 0], dtype=uint8), ['a', 'b'])
+    >>> list(c[1:])
+    [[2, 'b', 3.0], [3, 'a', 0.5]]
+    >>> ColumnarExamples([[1], [2.5]]).column_values(0)
+    [1, 2.5]
+    """
+
+    def __init__(self, examples=(), columns=None, categories=None, integers=None):
+        if columns is None:
+            columns, categories, integers = [], [], []
+            for values in zip(*examples):
+                column, cats, ints = encode_column(values)
+                columns.append(column)
+                categories.append(cats)
+                integers.append(ints)
+        self.columns = columns
+        self.categories = categories
+        self.integers = integers if integers is not None else [None] * len(columns)
+
+    def __len__(self):
+        return len(self.columns[0]) if self.columns else 0
+
+    def __getitem__(self, i):
+        if isinstance(i, (int, np.integer)):
+            return [self.value(attr, i) for attr in range(len(self.columns))]
+        return ColumnarExamples(columns=[column[i] for column in self.columns],
+                                categories=self.categories,
+                                integers=[ints if ints is None else ints[i]
+                                          for ints in self.integers])
+
+    def __iter__(self, chunk=4096):
+        for start in range(0, len(self), chunk):
+            rows = slice(start, start + chunk)
+            yield from map(list, zip(*(self.column_values(attr, rows)
+                                       for attr in range(len(self.columns)))))
+
+    def __setitem__(self, i, example):
+        for attr, value in enumerate(example):
+            column, cats = self.columns[attr], self.categories[attr]
+            if cats is not None:
+                if value not in cats:
+                    cats.append(value)
+                code = cats.index(value)
+                if code > np.iinfo(column.dtype).max:
+                    column = self.columns[attr] = column.astype(np.min_scalar_type(code))
+                column[i] = code
+            elif column_accepts(column, value):
+                column[i] = value
+                is_int = column.dtype.kind == 'f' and isinstance(value, int)
+                if is_int and self.integers[attr] is None:
+                    self.integers[attr] = np.zeros(len(column), dtype=bool)
+                if self.integers[attr] is not None:
+                    self.integers[attr][i] = is_int
+            else:
+                values = self.column_values(attr)
+                values[i] = value
+                (self.columns[attr], self.categories[attr],
+                 self.integers[attr]) = encode_column(values)
+
+    def __add__(self, other):
+        if (isinstance(other, ColumnarExamples) and
+                all(a is b for a, b in zip(self.categories, other.categories))):
+            return ColumnarExamples(columns=[np.concatenate(pair) for pair in
+                                             zip(self.columns, other.columns)],
+                                    categories=self.categories,
+                                    integers=[concatenate_integers(a, b, len(self), len(other))
+                                              for a, b in zip(self.integers, other.integers)])
+        return ColumnarExamples(list(self) + list(other))
+
+    def append(self, example):
+        """Add example at the end (copying every column)."""
+        if not self.columns:
+            first = ColumnarExamples([example])
+            self.columns, self.categories = first.columns, first.categories
+            self.integers = first.integers
+            return
+        self.columns = [np.concatenate([column, column[:1]]) for column in self.columns]
+        self.integers = [ints if ints is None else np.append(ints, False)
+                         for ints in self.integers]
+        self[len(self) - 1] = example
+
+    def value(self, attr, i):
+        """The value of attr in example i."""
+        x = self.columns[attr][i]
+        cats, ints = self.categories[attr], self.integers[attr]
+        if cats is not None:
+            return cats[x]
+        return int(x) if ints is not None and ints[i] else x.item()
+
+    def column_values(self, attr, rows=slice(None)):
+        """A list of the values of attr in the given rows (by default all)."""
+        column = self.columns[attr][rows].tolist()
+        cats, ints = self.categories[attr], self.integers[attr]
+        if cats is not None:
+            return [cats[x] for x in column]
+        if ints is not None:
+            return [int(x) if is_int else x for x, is_int in zip(column, ints[rows].tolist())]
+        return column
+
+    def distinct_values(self, attr):
+        """The list of the different values attr takes."""
+        if self.categories[attr] is not None:
+            return list(self.categories[attr])
+        column, ints = self.columns[attr], self.integers[attr]
+        if ints is not None:
+            whole = np.unique(column[ints])
+            return [int(x) for x in whole] + np.setdiff1d(column[~ints], whole).tolist()
+        return np.unique(column).tolist()
+
+    def value_codes(self, attr, values, rows=None):
+        """Return an array giving, for each example (or each of the given
+        rows), the index in values of its value of attr, or -1 if it is
+        not there."""
+        column = self.columns[attr] if rows is None else self.columns[attr][rows]
+        index = {}
+        for k, v in enumerate(values):
+            index.setdefault(v, k)
+        cats = self.categories[attr]
+        if cats is None:
+            cats, column = np.unique(column, return_inverse=True)
+            cats = cats.tolist()
+        lookup = np.array([index.get(c, -1) for c in cats], dtype=np.intp)
+        return lookup[column]
+
+    def matches(self, attr, value):
+        """Return a boolean array saying which examples have attr == value."""
+        column, cats = self.columns[attr], self.categories[attr]
+        if cats is not None:
+            if value in cats:
+                return column == cats.index(value)
+        elif isinstance(value, (int, float)):
+            return column == value
+        return np.zeros(len(self), dtype=bool)
+
+    def equal_to(self, value):
+        """Return a boolean array, one row per attribute, saying where the
+        examples have the given value."""
+        return np.array([self.matches(attr, value) for attr in range(len(self.columns))])
+
+    def means_and_deviations(self, target, target_names, inputs):
+        """DataSet.find_means_and_deviations, a column at a time."""
+        classes = self.value_codes(target, target_names)
+        means = defaultdict(lambda: [0] * len(inputs))
+        deviations = defaultdict(lambda: [0] * len(inputs))
+        for k, t in enumerate(target_names):
+            rows = classes == k
+            for i, attr in enumerate(inputs):
+                features = self.columns[attr][rows].astype(float)
+                means[t][i] = features.mean().item()
+                deviations[t][i] = features.std(ddof=1).item()
+        return means, deviations
+
+
+def encode_column(values):
+    """Return (column, categories, integers) for a sequence of attribute
+    values, as ColumnarExamples stores them."""
+    if all(isinstance(x, bool) for x in values):
+        return np.array(values, dtype=bool), None, None
+    if all(isinstance(x, (int, float)) and not isinstance(x, bool) for x in values):
+        ints = np.array([isinstance(x, int) for x in values], dtype=bool)
+        if ints.all() and all(-2**63 <= x < 2**63 for x in values):
+            return np.array(values, dtype=np.int64), None, None
+        return np.array(values, dtype=np.float64), None, (ints if ints.any() else None)
+    index = {}
+    codes = [index.setdefault(x, len(index)) for x in values]
+    return np.array(codes, dtype=np.min_scalar_type(len(index))), list(index), None
+
+
+def concatenate_integers(a, b, len_a, len_b):
+    """Join two ColumnarExamples.integers entries, for columns of lengths
+    len_a and len_b."""
+    if a is None and b is None:
+        return None
+    if a is None:
+        a = np.zeros(len_a, dtype=bool)
+    if b is None:
+        b = np.zeros(len_b, dtype=bool)
+    return np.concatenate([a, b])
+
+
+def column_accepts(column, value):
+    """Can value be stored as it is in a column of bools or numbers?"""
+    if isinstance(value, bool):
+        return column.dtype.kind == 'b'
+    if isinstance(value, int):
+        return column.dtype.kind in 'if' and -2**63 <= value < 2**63
+    if isinstance(value, float):
+        return column.dtype.kind == 'f'
+    return False
+
 # ______________________________________________________________________________
 
 
@@ -241,6 +493,174 @@ def parse_csv(input, delim=','):
     lines = [line for line in input.splitlines() if line.strip()]
     return [list(map(num_or_str, line.split(delim))) for line in lines]
 
+
+def parse_csv_chunks(input, chunk_size=4096, delim=','):
+    r"""Like parse_csv, but input is a file (or any iterable of lines), and
+    the examples come out in lists of up to chunk_size, so that only one
+    chunk is ever in memory.
+    >>> list(parse_csv_chunks(['1, 2, 3', '', '0, 2, na', '4, 5, 6'], 2))
+    [[[1, 2, 3], [0, 2, 'na']], [[4, 5, 6]]]"""
+    for cells in csv_cell_chunks(input, chunk_size, delim):
+        yield [list(map(num_or_str, row)) for row in cells]
+
+
+def csv_cell_chunks(input, chunk_size, delim):
+    """Yield lists of up to chunk_size rows of unparsed cells from input."""
+    chunk = []
+    for line in input:
+        if line.strip():
+            chunk.append(line.rstrip('\r\n').split(delim))
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+
+def read_csv_columns(file, chunk_size=65536, delim=',', cache=None):
+    """Read a CSV file (a filename or an open file) straight into a
+    ColumnarExamples, a chunk of lines at a time, with each value as
+    parse_csv would give it. Each column is taken to be of the type of its
+    values so far, starting from the first chunk: whole chunks of numbers
+    are converted by NumPy, and a column only turns into dictionary-encoded
+    categories when something that is not a number turns up.
+    If cache is a directory name, the columns are saved there, and later
+    calls on the same (unchanged) file read them back memory-mapped
+    (copy-on-write) instead of parsing the file again."""
+    if isinstance(file, str):
+        with open(file) as f:
+            return read_csv_columns(f, chunk_size, delim, cache)
+    stamp = None
+    if cache is not None and hasattr(file, 'fileno'):
+        info = os.fstat(file.fileno())
+        stamp = [info.st_size, info.st_mtime_ns, delim]
+        examples = load_cached_columns(cache, stamp)
+        if examples is not None:
+            return examples
+    parts, ints, indexes, kinds, seen = None, None, None, None, None
+    for cells in csv_cell_chunks(file, chunk_size, delim):
+        if parts is None:
+            n = len(cells[0])
+            parts, ints = [[] for _ in range(n)], [[] for _ in range(n)]
+            indexes, kinds = [None] * n, [np.int64] * n
+            seen = [{} for _ in range(n)]
+        for attr, values in enumerate(zip(*cells)):
+            index = indexes[attr]
+            if index is None:
+                column, is_int = parse_numbers(values, kinds[attr])
+                if column is not None:
+                    parts[attr].append(column)
+                    ints[attr].append(is_int)
+                    kinds[attr] = column.dtype.type
+                    continue
+                # Not all numbers: turn the column into categories
+                index = indexes[attr] = {}
+                so_far = np.concatenate(parts[attr]).tolist() if parts[attr] else []
+                is_int = integer_mask(parts[attr], ints[attr])
+                if is_int is not None:
+                    so_far = [int(x) if i else x for x, i in zip(so_far, is_int.tolist())]
+                parts[attr] = [encode_values(so_far, index)]
+            parts[attr].append(encode_cells(values, index, seen[attr]))
+    examples = ColumnarExamples(columns=[], categories=[], integers=[])
+    for part, is_int, index in zip(parts or [], ints or [], indexes or []):
+        column = np.concatenate(part)
+        if index is not None:
+            column = column.astype(np.min_scalar_type(len(index)))
+            index = list(index)
+        examples.columns.append(column)
+        examples.categories.append(index)
+        examples.integers.append(integer_mask(part, is_int) if index is None else None)
+    if stamp is not None:
+        try:
+            save_cached_columns(cache, stamp, examples)
+        except OSError:
+            pass  # Just not cached
+    return examples
+
+
+def parse_numbers(values, dtype=np.int64):
+    """Return (array, ints) for the numbers in the strings values. The array
+    holds ints if dtype is np.int64 and they all are, else floats; then ints
+    is a bool array saying which strings were written as ints (as parse_csv
+    would read them), or None if none were. The array is None if they are
+    not all numbers."""
+    strings = np.array(values)
+    if dtype is np.int64:
+        try:
+            return strings.astype(np.int64), None
+        except (ValueError, OverflowError):
+            pass
+    try:
+        column = strings.astype(np.float64)
+    except (ValueError, OverflowError):
+        return None, None
+    digits = np.char.lstrip(np.char.strip(strings), '+-')
+    ints = np.char.isdigit(digits) & (np.char.str_len(np.char.strip(strings)) -
+                                      np.char.str_len(digits) <= 1)
+    return column, (ints if ints.any() else None)
+
+
+def integer_mask(parts, ints):
+    """Join the ints of parse_numbers for each array in parts into one
+    ColumnarExamples.integers entry (None if the arrays are not floats, or
+    hold no ints)."""
+    if not parts or parts[-1].dtype.kind != 'f':
+        return None
+    if all(is_int is None and part.dtype.kind == 'f' for part, is_int in zip(parts, ints)):
+        return None
+    return np.concatenate([np.ones(len(part), dtype=bool) if part.dtype.kind == 'i' else
+                           is_int if is_int is not None else np.zeros(len(part), dtype=bool)
+                           for part, is_int in zip(parts, ints)])
+
+
+def encode_values(values, index):
+    """Return an array of the codes of values, adding new values to the
+    dict index, which maps each value to its code."""
+    return np.array([index.setdefault(x, len(index)) for x in values], dtype=np.uint32)
+
+
+def encode_cells(cells, index, seen):
+    """Return an array of the codes of the values parsed from the strings
+    cells, as encode_values; seen maps each string met so far to its code,
+    so each distinct string is only parsed once."""
+    codes = []
+    for cell in cells:
+        code = seen.get(cell)
+        if code is None:
+            code = seen[cell] = index.setdefault(num_or_str(cell), len(index))
+        codes.append(code)
+    return np.array(codes, dtype=np.uint32)
+
+
+def save_cached_columns(cache, stamp, examples):
+    os.makedirs(cache, exist_ok=True)
+    for attr, column in enumerate(examples.columns):
+        np.save(os.path.join(cache, '{}.npy'.format(attr)), column)
+        if examples.integers[attr] is not None:
+            np.save(os.path.join(cache, '{}.ints.npy'.format(attr)), examples.integers[attr])
+    with open(os.path.join(cache, 'columns.json'), 'w') as f:
+        json.dump({'stamp': stamp, 'categories': examples.categories,
+                   'integers': [ints is not None for ints in examples.integers]}, f)
+
+
+def load_cached_columns(cache, stamp):
+    """Return the ColumnarExamples saved in cache for a file with the given
+    stamp, or None if there is none."""
+    try:
+        with open(os.path.join(cache, 'columns.json')) as f:
+            saved = json.load(f)
+        if saved['stamp'] != stamp:
+            return None
+        columns = [np.load(os.path.join(cache, '{}.npy'.format(attr)), mmap_mode='c')
+                   for attr in range(len(saved['categories']))]
+        integers = [np.load(os.path.join(cache, '{}.ints.npy'.format(attr)), mmap_mode='c')
+                    if saved_ints else None
+                    for attr, saved_ints in enumerate(saved['integers'])]
+    except (OSError, ValueError, KeyError):
+        return None
+    return ColumnarExamples(columns=columns, categories=saved['categories'],
+                            integers=integers)
+
 # ______________________________________________________________________________
 
 
@@ -266,11 +686,11 @@ class CountingProbDist:
         for o in observations:
             self.add(o)
 
-    def add(self, o):
-        """Add an observation o to the distribution."""
+    def add(self, o, n=1):
+        """Add an observation o (or n of them) to the distribution."""
         self.smooth_for(o)
-        self.dictionary[o] += 1
-        self.n_obs += 1
+        self.dictionary[o] += n
+        self.n_obs += n
         self.sampler = None
 
     def smooth_for(self, o):
@@ -315,13 +735,15 @@ def PluralityLearner(dataset):
 # ______________________________________________________________________________
 
 
-def NaiveBayesLearner(dataset, continuous=True, simple=False):
+def NaiveBayesLearner(dataset, continuous=True, simple=False, weights=None):
+    """weights, if given, is a weight for each example, by which it
+    counts (as AdaBoost needs)."""
     if simple:
         return NaiveBayesSimple(dataset)
     if continuous:
-        return NaiveBayesContinuous(dataset)
+        return NaiveBayesContinuous(dataset, weights)
     else:
-        return NaiveBayesDiscrete(dataset)
+        return NaiveBayesDiscrete(dataset, weights)
 
 
 def NaiveBayesSimple(distribution):
@@ -344,21 +766,43 @@ def NaiveBayesSimple(distribution):
     return predict
 
 
-def NaiveBayesDiscrete(dataset):
+def NaiveBayesDiscrete(dataset, weights=None):
     """Just count how many times each value of each input attribute
     occurs, conditional on the target value. Count the different
-    target values too."""
+    target values too. With weights, each example counts as its weight
+    over the mean weight, so equal weights change nothing."""
 
     target_vals = dataset.values[dataset.target]
+    if weights is not None:
+        weights = np.asarray(weights, dtype=float)
+        weights = weights * (len(weights) / weights.sum())
     target_dist = CountingProbDist(target_vals)
     attr_dists = {(gv, attr): CountingProbDist(dataset.values[attr])
                   for gv in target_vals
                   for attr in dataset.inputs}
-    for example in dataset.examples:
-        targetval = example[dataset.target]
-        target_dist.add(targetval)
+    if dataset.columnar:
+        # Count every (target value, attribute value) pair at once
+        examples = dataset.examples
+        classes = examples.value_codes(dataset.target, target_vals)
+        for gv, n in zip(target_vals, np.bincount(classes, weights,
+                                                  minlength=len(target_vals)).tolist()):
+            target_dist.add(gv, n)
         for attr in dataset.inputs:
-            attr_dists[targetval, attr].add(example[attr])
+            attr_vals = dataset.values[attr]
+            codes = examples.value_codes(attr, attr_vals)
+            counts = np.bincount(classes * len(attr_vals) + codes, weights,
+                                 minlength=len(target_vals) * len(attr_vals))
+            for gv, row in zip(target_vals, counts.reshape(-1, len(attr_vals)).tolist()):
+                for v, n in zip(attr_vals, row):
+                    attr_dists[gv, attr].add(v, n)
+    else:
+        if weights is None:
+            weights = [1] * len(dataset.examples)
+        for example, weight in zip(dataset.examples, weights):
+            targetval = example[dataset.target]
+            target_dist.add(targetval, weight)
+            for attr in dataset.inputs:
+                attr_dists[targetval, attr].add(example[attr], weight)
 
     def predict(example):
         """Predict the target value for example. Consider each possible value,
@@ -369,16 +813,34 @@ def NaiveBayesDiscrete(dataset):
                             for attr in dataset.inputs))
         return argmax(target_vals, key=class_probability)
 
+    def predict_all(examples):
+        """Predict the target value for every one of a ColumnarExamples,
+        looking up the probabilities of all of them an attribute at a time."""
+        likelihood = np.ones((len(examples), len(target_vals)))
+        for attr in dataset.inputs:
+            attr_vals = dataset.values[attr]
+            # An unknown value (code -1) picks the final, zero, probability
+            table = np.array([[attr_dists[gv, attr][v] for v in attr_vals] + [0]
+                              for gv in target_vals])
+            likelihood *= table[:, examples.value_codes(attr, attr_vals)].T
+        prior = np.array([target_dist[gv] for gv in target_vals])
+        return [target_vals[k] for k in np.argmax(prior * likelihood, axis=1).tolist()]
+
+    predict.predict_all = predict_all
     return predict
 
 
-def NaiveBayesContinuous(dataset):
+def NaiveBayesContinuous(dataset, weights=None):
     """Count how many times each target value occurs.
-    Also, find the means and deviations of input attribute values for each target value."""
-    means, deviations = dataset.find_means_and_deviations()
-
+    Also, find the means and deviations of input attribute values for each target value.
+    With weights, these are the weighted counts, means and deviations, each
+    example counting as its weight over the mean weight."""
     target_vals = dataset.values[dataset.target]
-    target_dist = CountingProbDist(target_vals)
+    if weights is None:
+        means, deviations = dataset.find_means_and_deviations()
+        target_dist = CountingProbDist(target_vals)
+    else:
+        means, deviations, target_dist = weighted_means_and_deviations(dataset, weights)
 
     def predict(example):
         """Predict the target value for example. Consider each possible value,
@@ -393,18 +855,334 @@ def NaiveBayesContinuous(dataset):
 
     return predict
 
+
+def weighted_means_and_deviations(dataset, weights):
+    """Return the weighted means and standard deviations of the inputs for
+    each target value, as find_means_and_deviations does, and a
+    CountingProbDist of the total weight of each target value. The weights
+    are scaled to sum to the number of examples and taken as frequencies,
+    so the deviations (like stdev's) divide by the total weight less one."""
+    target_vals = dataset.values[dataset.target]
+    X = examples_array(dataset.examples, dataset.inputs)
+    if dataset.columnar:
+        classes = dataset.examples.value_codes(dataset.target, target_vals)
+    else:
+        index = {v: k for k, v in enumerate(target_vals)}
+        classes = np.array([index[e[dataset.target]] for e in dataset.examples], dtype=np.intp)
+    weights = np.asarray(weights, dtype=float)
+    weights = weights * (len(weights) / weights.sum())
+    means, deviations = {}, {}
+    target_dist = CountingProbDist()
+    for k, t in enumerate(target_vals):
+        w = np.where(classes == k, weights, 0)
+        total = w.sum()
+        target_dist.add(t, total.item())
+        m = w @ X / total if total > 0 else np.zeros(len(dataset.inputs))
+        variance = w @ (X - m) ** 2 / (total - 1) if total > 1 else np.ones(len(dataset.inputs))
+        means[t], deviations[t] = m.tolist(), np.sqrt(variance).tolist()
+    return means, deviations, target_dist
+
+
+def StreamingNaiveBayesLearner(chunks, target=-1, inputs=None):
+    """NaiveBayesDiscrete, counting chunks of examples (as parse_csv_chunks
+    yields them) as they come, so that only the counts and one chunk are
+    ever held in memory. target is the attribute to predict, by default
+    the last, and inputs the attributes to predict it from, by default all
+    the others. Values are only known once seen, so unlike
+    NaiveBayesDiscrete each target value is counted just as often as it
+    occurs."""
+    target_dist = CountingProbDist()
+    attr_dists = defaultdict(CountingProbDist)
+    for chunk in chunks:
+        for example in chunk:
+            if inputs is None:
+                target = target % len(example)
+                inputs = [attr for attr in range(len(example)) if attr != target]
+            targetval = example[target]
+            target_dist.add(targetval)
+            for attr in inputs:
+                attr_dists[targetval, attr].add(example[attr])
+
+    def predict(example):
+        """Predict the target value for example. Consider each possible value,
+        and pick the most likely by looking at each attribute independently."""
+        def class_probability(targetval):
+            return (target_dist[targetval] *
+                    product(attr_dists[targetval, attr][example[attr]]
+                            for attr in inputs))
+        return argmax(list(target_dist.dictionary), key=class_probability)
+
+    return predict
+
 # ______________________________________________________________________________
 
 
-def NearestNeighborLearner(dataset, k=1):
-    """k-NearestNeighbor: the k nearest neighbors vote."""
+def NearestNeighborLearner(dataset, k=1, index=None):
+    """k-NearestNeighbor: the k nearest neighbors vote.
+    By default (index=None, or 'scan') each prediction loops over all the
+    examples calling dataset.distance on each. Otherwise the neighbors are
+    found with an index of the inputs of the examples, built once, here:
+    index='kd' is a KDTree, for euclidean_distance or manhattan_distance on
+    numeric inputs; 'vp' a VPTree, for any distance (a metric); 'brute'
+    compares with all the examples at once in NumPy, for those two
+    distances or hamming_distance or mean_boolean_error; and 'auto' is a
+    KDTree where it can be used, else 'brute' if that can, else 'scan'.
+    The indexes compare only the inputs, and may break ties between equally
+    distant examples differently from the scan. With an index the predictor
+    has a predict_all, to classify a whole set of examples (a
+    ColumnarExamples or a list) in turn."""
+    if index in (None, 'scan'):
+        def predict(example):
+            """Find the k closest items, and have them vote for the best."""
+            best = heapq.nsmallest(k, ((dataset.distance(e, example), e)
+                                       for e in dataset.examples))
+            return mode(e[dataset.target] for (d, e) in best)
+        return predict
+
+    p = minkowski_p.get(dataset.distance)
+    examples = dataset.examples if dataset.columnar else ColumnarExamples(dataset.examples)
+    numeric = all(examples.categories[attr] is None for attr in dataset.inputs)
+    if index == 'auto':
+        index = ('kd' if p in (1, 2) and numeric else
+                 'brute' if p == 0 or (p is not None and numeric) else 'scan')
+        if index == 'scan':
+            return NearestNeighborLearner(dataset, k)
+
+    if p is None:
+        # Any other distance can only be used, a pair at a time, by a VPTree
+        if index != 'vp':
+            raise ValueError('Only a VPTree can index {}'.format(dataset.distance))
+        points = list(examples)
+        neighbors = VPTree(points, lambda rows, q: np.array([dataset.distance(points[i], q)
+                                                             for i in rows]))
+
+        def encode(examples):
+            return list(examples)
+    else:
+        points = neighbor_points(dataset, examples, p)
+        if index == 'kd':
+            if p == 0:
+                raise ValueError('A KDTree cannot index {}'.format(dataset.distance.__name__))
+            neighbors = KDTree(points, p)
+        elif index == 'vp':
+            neighbors = VPTree(points, lambda rows, q: minkowski_distances(points[rows], q, p))
+        else:
+            neighbors = BruteForceIndex(points, lambda rows, q: minkowski_distances(points[rows], q, p))
+
+        def encode(examples):
+            return neighbor_points(dataset, examples, p)
+    targets = examples.column_values(dataset.target)
+
+    def vote(q):
+        return mode(targets[i] for i in neighbors.query(q, k)[1].tolist())
+
     def predict(example):
         """Find the k closest items, and have them vote for the best."""
-        best = heapq.nsmallest(k, ((dataset.distance(e, example), e)
-                                   for e in dataset.examples))
-        return mode(e[dataset.target] for (d, e) in best)
+        return vote(encode([example])[0])
+
+    def predict_all(examples):
+        return [vote(q) for q in encode(examples)]
+
+    predict.predict_all = predict_all
     return predict
 
+
+# The p of the Minkowski distance each distance function is (with p = 0
+# counting the attributes that differ)
+minkowski_p = {euclidean_distance: 2, manhattan_distance: 1,
+               hamming_distance: 0, mean_boolean_error: 0}
+
+
+def minkowski_distances(points, q, p):
+    """The distance of each row of points from q, for p = 0, 1 or 2."""
+    diff = points - q
+    if p == 0:
+        return np.count_nonzero(diff, axis=1)
+    elif p == 1:
+        return np.abs(diff).sum(axis=1)
+    return np.sqrt((diff * diff).sum(axis=1))
+
+
+def neighbor_points(dataset, examples, p):
+    """Return an array with a row of the dataset.inputs of each of examples
+    (a ColumnarExamples or a list), for a neighbor index: the values, as
+    floats, for p = 1 or 2; their codes (index in dataset.values, or -1)
+    for p = 0, where all that matters is which values are equal."""
+    if not isinstance(examples, ColumnarExamples):
+        examples = ColumnarExamples(examples)
+    if p == 0:
+        columns = [examples.value_codes(attr, dataset.values[attr]) for attr in dataset.inputs]
+    else:
+        if not all(examples.categories[attr] is None for attr in dataset.inputs):
+            raise ValueError('{} needs numeric inputs'.format(dataset.distance.__name__))
+        columns = [examples.columns[attr] for attr in dataset.inputs]
+    return np.column_stack(columns).astype(float if p else np.intp)
+
+
+class KDTree:
+    """A k-d tree of the rows of an array of points, to find the k nearest
+    to a query point by Euclidean (p=2) or Manhattan (p=1) distance. Each
+    node splits its points at the median of the dimension they spread
+    most in, down to leaves of at most leaf_size points, which are
+    compared with the query all at once. The nodes are kept in flat lists,
+    and the points in the order of the leaves.
+    >>> tree = KDTree([[0, 0], [1, 1], [2, 2], [3, 3], [0, 3]], leaf_size=1)
+    >>> tree.query([2.8, 2.9], k=2)[1]
+    array([3, 2])
+    """
+
+    def __init__(self, points, p=2, leaf_size=32):
+        points = np.asarray(points, dtype=float)
+        self.p = p
+        self.order = np.arange(len(points))
+        self.start, self.end, self.dim, self.split, self.children = [], [], [], [], []
+        self.build(points, 0, len(points), leaf_size)
+        self.points = points[self.order]
+
+    def build(self, points, start, end, leaf_size):
+        """Add the node for self.order[start:end] (and those below it)."""
+        node = len(self.start)
+        self.start.append(start)
+        self.end.append(end)
+        self.dim.append(-1)
+        self.split.append(0.0)
+        self.children.append(None)
+        rows = self.order[start:end]
+        if end - start > leaf_size:
+            spread = np.ptp(points[rows], axis=0)
+            dim = int(np.argmax(spread))
+            if spread[dim] > 0:
+                middle = (end - start) // 2
+                self.order[start:end] = rows[np.argpartition(points[rows, dim], middle)]
+                self.dim[node] = dim
+                self.split[node] = points[self.order[start + middle], dim].item()
+                self.children[node] = (self.build(points, start, start + middle, leaf_size),
+                                       self.build(points, start + middle, end, leaf_size))
+        return node
+
+    def query(self, q, k=1):
+        """Return (distances, rows): the k points nearest q, nearest first,
+        and their row numbers in the original array."""
+        q = np.asarray(q, dtype=float)
+        best = []  # A heap of (-distance, row), so the farthest is first
+        self.search(0, q, k, best)
+        return sorted_neighbors(best, self.p)
+
+    def search(self, node, q, k, best):
+        dim = self.dim[node]
+        if dim < 0:
+            start, end = self.start[node], self.end[node]
+            diff = self.points[start:end] - q
+            d = (diff * diff).sum(axis=1) if self.p == 2 else np.abs(diff).sum(axis=1)
+            add_neighbors(best, k, d, self.order[start:end])
+            return
+        diff = q[dim] - self.split[node]
+        near, far = self.children[node] if diff <= 0 else reversed(self.children[node])
+        self.search(near, q, k, best)
+        bound = diff * diff if self.p == 2 else abs(diff)
+        if len(best) < k or bound <= -best[0][0]:
+            self.search(far, q, k, best)
+
+
+class VPTree:
+    """A vantage-point tree, to find the k nearest of some points to a query
+    by any metric. distances(rows, q) must return the array of distances
+    from each of the points with the given row numbers to q, where q may
+    be one of the points. Each node picks a point at random and puts the
+    points nearer to it than the median distance on one side, the rest on
+    the other, down to leaves of at most leaf_size points. A search skips
+    a side when the triangle inequality shows nothing there is near enough."""
+
+    def __init__(self, points, distances, leaf_size=32, seed=0):
+        self.points, self.distances = points, distances
+        self.vantage, self.radius, self.children, self.rows = [], [], [], []
+        self.rng = np.random.default_rng(seed)
+        self.build(np.arange(len(points)), leaf_size)
+
+    def build(self, rows, leaf_size):
+        node = len(self.vantage)
+        self.vantage.append(None)
+        self.radius.append(0)
+        self.children.append(None)
+        self.rows.append(rows)
+        if len(rows) > leaf_size:
+            k = self.rng.integers(len(rows))
+            vantage, rest = rows[k], np.delete(rows, k)
+            d = self.distances(rest, self.points[vantage])
+            radius = np.median(d)
+            inside = d < radius
+            if not inside.any():
+                inside = d <= radius
+            if inside.any() and not inside.all():
+                self.vantage[node], self.radius[node], self.rows[node] = vantage, radius, None
+                self.children[node] = (self.build(rest[inside], leaf_size),
+                                       self.build(rest[~inside], leaf_size))
+        return node
+
+    def query(self, q, k=1):
+        """Return (distances, rows): the k points nearest q, nearest first."""
+        best = []
+        self.search(0, q, k, best)
+        return sorted_neighbors(best)
+
+    def search(self, node, q, k, best):
+        if self.children[node] is None:
+            rows = self.rows[node]
+            add_neighbors(best, k, self.distances(rows, q), rows)
+            return
+        vantage, radius = self.vantage[node], self.radius[node]
+        d = self.distances(np.array([vantage]), q)[0]
+        add_neighbors(best, k, np.array([d]), np.array([vantage]))
+        inside, outside = self.children[node]
+        for child in ((inside, outside) if d < radius else (outside, inside)):
+            # Points inside are within radius of the vantage point, and
+            # points outside beyond it, so they are at least this far off
+            gap = d - radius if child == inside else radius - d
+            if len(best) < k or gap <= -best[0][0]:
+                self.search(child, q, k, best)
+
+
+class BruteForceIndex:
+    """Finds the k nearest points to a query by working out the distance to
+    every one of them at once; distances is as for VPTree."""
+
+    def __init__(self, points, distances):
+        self.points, self.distances = points, distances
+
+    def query(self, q, k=1):
+        """Return (distances, rows): the k points nearest q, nearest first."""
+        d = self.distances(slice(None), q)
+        return k_nearest(d, np.arange(len(d)), k)
+
+
+def k_nearest(d, rows, k):
+    """Return (distances, rows) for the k rows at the least distances d,
+    nearest first, breaking ties by row number."""
+    if len(d) > k:
+        near = d <= np.partition(d, k - 1)[k - 1]
+        d, rows = d[near], rows[near]
+    nearest = np.lexsort((rows, d))[:k]
+    return d[nearest], rows[nearest]
+
+
+def add_neighbors(best, k, d, rows):
+    """Add the rows, at distances d, to the heap best of the k nearest."""
+    d, rows = k_nearest(d, rows, k)
+    for dist, row in zip(d.tolist(), rows.tolist()):
+        if len(best) < k:
+            heapq.heappush(best, (-dist, -row))
+        elif (-dist, -row) > best[0]:
+            heapq.heapreplace(best, (-dist, -row))
+
+
+def sorted_neighbors(best, p=None):
+    """Return (distances, rows) from a heap of add_neighbors, nearest first;
+    squared distances are square-rooted for p = 2."""
+    pairs = sorted((-d, -row) for d, row in best)
+    d = np.array([d for d, _ in pairs])
+    rows = np.array([row for _, row in pairs], dtype=np.intp)
+    return (np.sqrt(d) if p == 2 else d), rows
+
 # ______________________________________________________________________________
 
 
@@ -470,18 +1248,25 @@ def truncated_svd(X, num_val=2, max_iter=1000):
 
 class DecisionFork:
     """A fork of a decision tree holds an attribute to test, and a dict
-    of branches, one for each of the attribute's values."""
+    of branches, one for each of the attribute's values. Or, if it has a
+    threshold, the branches are for True and False: whether the (numeric)
+    value of the attribute is <= threshold."""
 
-    def __init__(self, attr, attrname=None, default_child=None, branches=None):
+    def __init__(self, attr, attrname=None, default_child=None, branches=None,
+                 threshold=None):
         """Initialize by saying what attribute this node tests."""
         self.attr = attr
         self.attrname = attrname or attr
         self.default_child = default_child
         self.branches = branches or {}
+        self.threshold = threshold
 
     def __call__(self, example):
         """Given an example, classify it using the attribute and the branches."""
         attrvalue = example[self.attr]
+        if self.threshold is not None:
+            attrvalue = (attrvalue <= self.threshold
+                         if isinstance(attrvalue, (int, float)) else None)
         if attrvalue in self.branches:
             return self.branches[attrvalue](example)
         else:
@@ -492,15 +1277,47 @@ class DecisionFork:
         """Add a branch.  If self.attr = val, go to the given subtree."""
         self.branches[val] = subtree
 
+    def predict_all(self, examples):
+        """Classify every one of a ColumnarExamples, returning a list."""
+        results = [None] * len(examples)
+        self.classify_rows(examples, np.arange(len(examples)), results)
+        return results
+
+    def classify_rows(self, examples, rows, results):
+        """Put the classification of each of the given rows of examples into
+        results, sending all of the rows with each value down its branch."""
+        if self.threshold is not None:
+            if examples.categories[self.attr] is not None:
+                # Not all numbers, so test them one at a time
+                for i in rows.tolist():
+                    results[i] = self(examples[i])
+                return
+            below = examples.columns[self.attr][rows] <= self.threshold
+            for val, rows_val in ((True, rows[below]), (False, rows[~below])):
+                classify_rows(self.branches.get(val, self.default_child),
+                              examples, rows_val, results)
+            return
+        codes = examples.value_codes(self.attr, list(self.branches), rows)
+        for k, subtree in enumerate(self.branches.values()):
+            classify_rows(subtree, examples, rows[codes == k], results)
+        classify_rows(self.default_child, examples, rows[codes < 0], results)
+
     def display(self, indent=0):
         name = self.attrname
         print('Test', name)
         for (val, subtree) in self.branches.items():
-            print(' ' * 4 * indent, name, '=', val, '==>', end=' ')
+            if self.threshold is not None:
+                print(' ' * 4 * indent, name, '<=' if val else '>', self.threshold,
+                      '==>', end=' ')
+            else:
+                print(' ' * 4 * indent, name, '=', val, '==>', end=' ')
             subtree.display(indent + 1)
         print()   # newline
 
     def __repr__(self):
+        if self.threshold is not None:
+            return ('DecisionFork({0!r}, {1!r}, {2!r}, threshold={3!r})'
+                    .format(self.attr, self.attrname, self.branches, self.threshold))
         return ('DecisionFork({0!r}, {1!r}, {2!r})'
                 .format(self.attr, self.attrname, self.branches))
 
@@ -514,17 +1331,44 @@ class DecisionLeaf:
     def __call__(self, example):
         return self.result
 
+    def predict_all(self, examples):
+        return [self.result] * len(examples)
+
+    def classify_rows(self, examples, rows, results):
+        for i in rows.tolist():
+            results[i] = self.result
+
     def display(self, indent=0):
         print('RESULT =', self.result)
 
     def __repr__(self):
         return repr(self.result)
 
+
+def classify_rows(tree, examples, rows, results):
+    """Classify the given rows of examples by tree, which may be any
+    function of an example rather than a DecisionFork or DecisionLeaf."""
+    if hasattr(tree, 'classify_rows'):
+        tree.classify_rows(examples, rows, results)
+    else:
+        for i in rows.tolist():
+            results[i] = tree(examples[i])
+
 # ______________________________________________________________________________
 
 
-def DecisionTreeLearner(dataset):
-    """[Figure 18.5]"""
+def DecisionTreeLearner(dataset, max_bins=None, max_depth=None, weights=None):
+    """[Figure 18.5]
+    A columnar dataset, or any dataset given max_bins, max_depth or
+    weights, is learned by a DecisionTreeGrower, which splits numeric
+    attributes with more than max_bins values on thresholds, stops
+    splitting max_depth forks down, and counts each example as its weight."""
+
+    if dataset.columnar or max_bins or max_depth or weights is not None:
+        examples = (dataset.examples if dataset.columnar
+                    else ColumnarExamples(dataset.examples))
+        return DecisionTreeGrower(dataset, examples, max_bins).grow(max_depth=max_depth,
+                                                                    weights=weights)
 
     target, values = dataset.target, dataset.values
 
@@ -583,6 +1427,183 @@ def DecisionTreeLearner(dataset):
     return decision_tree_learning(dataset.examples, dataset.inputs)
 
 
+def DecisionStumpLearner(dataset, weights=None):
+    """A decision tree of one fork, the usual weak learner for AdaBoost."""
+    return DecisionTreeLearner(dataset, max_depth=1, weights=weights)
+
+
+def weighted_tree_trainer(dataset, examples, max_bins=None, max_depth=None):
+    """Return a function that learns a tree from a weight for each of
+    examples (a ColumnarExamples of dataset's examples), all with one
+    DecisionTreeGrower; AdaBoost uses it to train a learner's weighted_trainer."""
+    grower = DecisionTreeGrower(dataset, examples, max_bins)
+    return lambda weights: grower.grow(max_depth=max_depth, weights=weights)
+
+
+DecisionTreeLearner.weighted_trainer = weighted_tree_trainer
+DecisionStumpLearner.weighted_trainer = functools.partial(weighted_tree_trainer, max_depth=1)
+# The smallest max_bins, for cross_validation_wrapper
+DecisionTreeLearner.min_size = 2
+
+
+class DecisionTreeGrower:
+    """Grows decision trees, as DecisionTreeLearner does, on a
+    ColumnarExamples. The examples at each node are an array of row
+    numbers, and the counts that information gain needs all come from one
+    np.bincount of (attribute value, target value) codes, rather than a
+    pass over the examples per value.
+    With max_bins, each numeric input with more than max_bins values is
+    cut once, up front, into at most max_bins bins of about equal numbers
+    of examples; a fork on it splits the examples two ways, at the bin edge
+    that gains the most (found from cumulative counts over the bins), and
+    the attribute can be split on again further down.
+    The codes are worked out once, so one grower can grow many trees, from
+    different rows (with repeats, as in a bootstrap sample) and inputs.
+    Given weights, a tree's counts are instead sums of the examples' weights,
+    so one grower can also grow a tree for each round of AdaBoost."""
+
+    def __init__(self, dataset, examples, max_bins=None):
+        if max_bins and max_bins < 2:
+            raise ValueError('max_bins must be at least 2 (or None), not {!r}'.format(max_bins))
+        self.target, self.values = dataset.target, dataset.values
+        self.weights = None
+        self.inputs, self.attrnames = dataset.inputs, dataset.attrnames
+        self.n_examples = len(examples)
+        self.codes, self.edges = {}, {}
+        for attr in self.inputs + [self.target]:
+            column = examples.columns[attr]
+            if (max_bins and attr != self.target and examples.categories[attr] is None and
+                    column.dtype.kind in 'iuf' and len(self.values[attr]) > max_bins):
+                quantiles = np.linspace(0, 1, max_bins + 1)[1:-1]
+                self.edges[attr] = np.unique(np.quantile(column, quantiles, method='lower'))
+                bins = np.searchsorted(self.edges[attr], column)
+                self.codes[attr] = bins.astype(np.min_scalar_type(len(self.edges[attr])))
+            else:
+                n_values = len(self.values[attr])
+                codes = examples.value_codes(attr, self.values[attr])
+                unknown = np.flatnonzero(codes < 0)
+                if len(unknown):
+                    raise ValueError('Value {!r} of attribute {!r} is not in dataset.values'
+                                     .format(examples.value(attr, unknown[0].item()),
+                                             self.attrnames[attr]))
+                self.codes[attr] = codes.astype(
+                    np.min_scalar_type(n_values) if n_values else np.intp)
+        self.n_classes = len(self.values[self.target])
+
+    def grow(self, rows=None, inputs=None, max_depth=None, weights=None):
+        """Return a tree learned from the given rows (by default all of
+        them) using the given inputs (by default the dataset's), with no
+        more than max_depth forks on any path, weighting the examples
+        by weights (one for each example, or None)."""
+        self.weights = None if weights is None else np.asarray(weights, dtype=float)
+        if rows is None:
+            rows = np.arange(self.n_examples)
+        return self.decision_tree_learning(rows, list(inputs or self.inputs),
+                                           max_depth=max_depth)
+
+    def decision_tree_learning(self, examples, attrs, parent_examples=(), max_depth=None):
+        target, values, codes = self.target, self.values, self.codes
+        if len(examples) == 0:
+            return self.plurality_value(parent_examples)
+        elif self.all_same_class(examples):
+            return DecisionLeaf(values[target][codes[target][examples[0]]])
+        elif len(attrs) == 0 or max_depth == 0:
+            return self.plurality_value(examples)
+        if max_depth is not None:
+            max_depth -= 1
+        A, edge = self.choose_attribute(attrs, examples)
+        if A in self.edges:
+            if edge is None:  # No binned attribute can split these examples
+                return self.plurality_value(examples)
+            tree = DecisionFork(A, self.attrnames[A], self.plurality_value(examples),
+                                threshold=self.edges[A][edge].item())
+            below = codes[A][examples] <= edge
+            tree.add(True, self.decision_tree_learning(examples[below], attrs, examples,
+                                                       max_depth))
+            tree.add(False, self.decision_tree_learning(examples[~below], attrs, examples,
+                                                        max_depth))
+            return tree
+        tree = DecisionFork(A, self.attrnames[A], self.plurality_value(examples))
+        for (v_k, exs) in self.split_by(A, examples):
+            subtree = self.decision_tree_learning(
+                exs, removeall(A, attrs), examples, max_depth)
+            tree.add(v_k, subtree)
+        return tree
+
+    def example_weights(self, examples):
+        return None if self.weights is None else self.weights[examples]
+
+    def class_counts(self, examples):
+        examples = np.asarray(examples, dtype=np.intp)
+        return np.bincount(self.codes[self.target][examples], self.example_weights(examples),
+                           minlength=self.n_classes).tolist()
+
+    def plurality_value(self, examples):
+        counts = self.class_counts(examples)
+        popular = argmax_random_tie(range(self.n_classes), key=counts.__getitem__)
+        return DecisionLeaf(self.values[self.target][popular])
+
+    def all_same_class(self, examples):
+        classes = self.codes[self.target][examples]
+        return (classes == classes[0]).all()
+
+    def choose_attribute(self, attrs, examples):
+        """Return the attribute with the highest information gain, and for
+        a binned one the number of the bin edge to split at."""
+        classes = self.codes[self.target][examples].astype(np.intp)
+        gains = {a: (self.binned_information_gain if a in self.edges
+                     else self.information_gain)(a, examples, classes) for a in attrs}
+        A = argmax_random_tie(attrs, key=lambda a: gains[a][0])
+        return A, gains[A][1]
+
+    def joint_counts(self, attr, examples, classes, n_values):
+        """The counts of each target value for each value of attr."""
+        n_classes = self.n_classes
+        return np.bincount(self.codes[attr][examples].astype(np.intp) * n_classes + classes,
+                           self.example_weights(examples),
+                           minlength=n_values * n_classes).reshape(n_values, n_classes)
+
+    def information_gain(self, attr, examples, classes):
+        joint = self.joint_counts(attr, examples, classes, len(self.values[attr]))
+        N = joint.sum().item() or 1
+        remainder = sum((sum(counts)/N) * information_content(counts)
+                        for counts in joint.tolist())
+        return information_content(self.class_counts(examples)) - remainder, None
+
+    def binned_information_gain(self, attr, examples, classes):
+        """The gain of the best split of attr's bins into those up to some
+        edge and those after it, and the number of that edge; the gain is
+        -inf (and the edge None) if all the examples are in one bin."""
+        if len(self.edges[attr]) == 0:
+            return -math.inf, None
+        joint = self.joint_counts(attr, examples, classes, len(self.edges[attr]) + 1)
+        below = np.cumsum(joint, axis=0)[:-1]
+        above = below[-1] + joint[-1] - below
+        n_below, n_above = below.sum(axis=1), above.sum(axis=1)
+        N = joint.sum() or 1
+        remainder = (n_below * entropies(below) + n_above * entropies(above)) / N
+        remainder[(n_below == 0) | (n_above == 0)] = math.inf
+        if np.isinf(remainder.min()):
+            return -math.inf, None
+        edge = int(np.argmin(remainder))
+        return information_content(self.class_counts(examples)) - remainder[edge].item(), edge
+
+    def split_by(self, attr, examples):
+        """Return a list of (val, examples) pairs for each val of attr."""
+        attr_codes = self.codes[attr][examples]
+        examples = examples[np.argsort(attr_codes, kind='stable')]
+        ends = np.cumsum(np.bincount(attr_codes, minlength=len(self.values[attr]))).tolist()
+        return [(v, examples[start:end])
+                for v, start, end in zip(self.values[attr], [0] + ends, ends)]
+
+
+def entropies(counts):
+    """The information_content of each row of a 2-D array of counts."""
+    totals = counts.sum(axis=1, keepdims=True)
+    p = counts / np.where(totals > 0, totals, 1)
+    return -(p * np.log2(np.where(p > 0, p, 1))).sum(axis=1)
+
+
 def information_content(values):
     """Number of bits to represent the probability distribution in values."""
     probabilities = normalize(removeall(0, values))
@@ -591,30 +1612,76 @@ def information_content(values):
 # ______________________________________________________________________________
 
 
-def RandomForest(dataset, n=5):
-    """An ensemble of Decision Trees trained using bagging and feature bagging."""
-
-    def data_bagging(dataset, m=0):
-        """Sample m examples with replacement"""
-        n = len(dataset.examples)
-        return weighted_sample_with_replacement(m or n, dataset.examples, [1]*n)
+def RandomForest(dataset, n=5, max_bins=None, processes=1, seed=None):
+    """An ensemble of Decision Trees trained using bagging and feature bagging.
+    All the trees are grown by one DecisionTreeGrower, each from a bootstrap
+    sample given as an array of row numbers, so the examples are never
+    copied. Unless processes is 1 the trees are grown on a pool of
+    processes (None means one per core); each process gets one copy of the
+    grower, or where processes are forked, shares the parent's. The
+    predictor has a predict_all, which classifies a whole set of examples
+    with each tree and counts the votes with NumPy."""
+    examples = dataset.examples if dataset.columnar else ColumnarExamples(dataset.examples)
+    grower = DecisionTreeGrower(dataset, examples, max_bins)
+    master = random.Random(seed)
+    seeds = [master.getrandbits(64) for _ in range(n)]
+    if processes == 1:
+        predictors = [grow_bagged_tree(grower, s) for s in seeds]
+    else:
+        with ProcessPoolExecutor(processes, initializer=set_forest_grower,
+                                 initargs=(grower,)) as executor:
+            predictors = list(executor.map(grow_forest_tree, seeds))
 
-    def feature_bagging(dataset, p=0.7):
-        """Feature bagging with probability p to retain an attribute"""
-        inputs = [i for i in dataset.inputs if probability(p)]
-        return inputs or dataset.inputs
+    target_vals = dataset.values[dataset.target]
+    index = {v: k for k, v in enumerate(target_vals)}
 
     def predict(example):
-        print([predictor(example) for predictor in predictors])
-        return mode(predictor(example) for predictor in predictors)
+        votes = [index[predictor(example)] for predictor in predictors]
+        return target_vals[np.bincount(votes, minlength=len(target_vals)).argmax()]
+
+    def predict_all(examples):
+        """Predict the target value for each of examples (a ColumnarExamples
+        or a list of examples) by the vote of all the trees."""
+        if not isinstance(examples, ColumnarExamples):
+            examples = ColumnarExamples(examples)
+        votes = np.array([[index[v] for v in predictor.predict_all(examples)]
+                          for predictor in predictors], dtype=np.intp)
+        cells = (np.arange(len(examples)) * len(target_vals) + votes).ravel()
+        counts = np.bincount(cells, minlength=len(examples) * len(target_vals))
+        winners = counts.reshape(len(examples), len(target_vals)).argmax(axis=1)
+        return [target_vals[k] for k in winners.tolist()]
+
+    predict.predict_all = predict_all
+    predict.predictors = predictors
+    return predict
 
-    predictors = [DecisionTreeLearner(DataSet(examples=data_bagging(dataset),
-                                              attrs=dataset.attrs,
-                                              attrnames=dataset.attrnames,
-                                              target=dataset.target,
-                                              inputs=feature_bagging(dataset))) for _ in range(n)]
 
-    return predict
+def grow_bagged_tree(grower, seed, p=0.7):
+    """Grow a tree with grower from a bootstrap sample of its examples,
+    keeping each input with probability p (but at least one), with all
+    the random choices, including ties between attributes, made by seed."""
+    rng = np.random.default_rng(seed)
+    rows = rng.integers(grower.n_examples, size=grower.n_examples)
+    inputs = [a for a in grower.inputs if rng.random() < p] or grower.inputs
+    state = random.getstate()
+    random.seed(seed)
+    try:
+        return grower.grow(rows, inputs)
+    finally:
+        random.setstate(state)
+
+
+forest_grower = None
+
+
+def set_forest_grower(grower):
+    """Initialize a worker process of RandomForest."""
+    global forest_grower
+    forest_grower = grower
+
+
+def grow_forest_tree(seed):
+    return grow_bagged_tree(forest_grower, seed)
 
 # ______________________________________________________________________________
 
@@ -655,11 +1722,12 @@ def DecisionListLearner(dataset):
 
 
 def NeuralNetLearner(dataset, hidden_layer_sizes=None,
-                     learning_rate=0.01, epochs=100, activation = sigmoid):
+                     learning_rate=0.01, epochs=100, activation = sigmoid, batch_size=1):
     """Layered feed-forward network.
     hidden_layer_sizes: List of number of hidden units per hidden layer
     learning_rate: Learning rate of gradient descent
     epochs: Number of passes over the dataset
+    batch_size: Number of examples per weight update (see BackPropagationLearner)
     """
 
     hidden_layer_sizes = hidden_layer_sizes or [3]  # default value
@@ -669,28 +1737,29 @@ def NeuralNetLearner(dataset, hidden_layer_sizes=None,
     # construct a network
     raw_net = network(i_units, hidden_layer_sizes, o_units, activation)
     learned_net = BackPropagationLearner(dataset, raw_net,
-                                         learning_rate, epochs, activation)
-
-    def predict(example):
-        # Input nodes
-        i_nodes = learned_net[0]
-
-        # Activate input layer
-        for v, n in zip(example, i_nodes):
-            n.value = v
+                                         learning_rate, epochs, activation, batch_size)
+    weights = network_weights(learned_net)
+    activations = [array_activation(layer[0].activation)[0] for layer in learned_net[1:]]
 
-        # Forward pass
-        for layer in learned_net[1:]:
-            for node in layer:
-                inc = [n.value for n in node.inputs]
-                in_val = dotproduct(inc, node.weights)
-                node.value = node.activation(in_val)
+    def forward(X):
+        for W, g in zip(weights, activations):
+            X = g(X @ W.T)
+        return X
 
-        # Hypothesis
-        o_nodes = learned_net[-1]
-        prediction = find_max_node(o_nodes)
-        return prediction
+    def predict(example):
+        # Activate the input layer with the first i_units values, and take
+        # the hypothesis to be the output unit with the greatest value
+        return int(np.argmax(forward(np.array(list(example)[:i_units], dtype=float))))
+
+    def predict_all(examples):
+        """Predict each of examples (a ColumnarExamples or a list) at once."""
+        if isinstance(examples, ColumnarExamples):
+            X = np.column_stack(examples.columns[:i_units])
+        else:
+            X = [list(example)[:i_units] for example in examples]
+        return np.argmax(forward(np.array(X, dtype=float)), axis=1).tolist()
 
+    predict.predict_all = predict_all
     return predict
 
 
@@ -698,113 +1767,149 @@ def random_weights(min_value, max_value, num_weights):
     return [random.uniform(min_value, max_value) for _ in range(num_weights)]
 
 
-def BackPropagationLearner(dataset, net, learning_rate, epochs, activation=sigmoid):
-    """[Figure 18.23] The back-propagation algorithm for multilayer networks"""
+def BackPropagationLearner(dataset, net, learning_rate, epochs, activation=sigmoid,
+                           batch_size=1, weights=None):
+    """[Figure 18.23] The back-propagation algorithm for multilayer networks.
+    The network is trained as a weight matrix per layer (network_weights),
+    with the forward and backward passes done by NumPy for batch_size
+    examples at once: each example moves the weights by learning_rate
+    times its own gradient, taken at the weights at the start of its batch.
+    So with batch_size=1 the weights change after every example, as in the
+    figure, while bigger batches are much faster. The trained weights are
+    put back into the units of net, which is returned.
+    With weights (one per example), each example's update is scaled by its
+    weight over the mean weight, so equal weights change nothing."""
     # Initialise weights
     for layer in net:
         for node in layer:
             node.weights = random_weights(min_value=-0.5, max_value=0.5,
                                           num_weights=len(node.weights))
 
-    examples = dataset.examples
-    '''
-    As of now dataset.target gives an int instead of list,
-    Changing dataset class will have effect on all the learners.
-    Will be taken care of later.
-    '''
-    o_nodes = net[-1]
-    i_nodes = net[0]
-    o_units = len(o_nodes)
-    idx_t = dataset.target
-    idx_i = dataset.inputs
-    n_layers = len(net)
+    o_units = len(net[-1])
+    X, T = example_matrices(dataset, o_units)
+    # The hidden layers use the derivative of activation; the output layer
+    # that of its own units' activation function
+    forward = [array_activation(layer[0].activation)[0] for layer in net[1:]]
+    derivatives = ([array_activation(activation)[1]] * (len(net) - 2) +
+                   [array_activation(net[-1][-1].activation)[1]])
+    scale = None
+    if weights is not None:
+        weights = np.asarray(weights, dtype=float)
+        scale = weights * (len(weights) / weights.sum())
+    W = network_weights(net)
+    back_propagate(W, forward, derivatives, X, T, learning_rate, epochs, batch_size, scale)
+    set_network_weights(net, W)
+    return net
 
-    inputs, targets = init_examples(examples, idx_i, idx_t, o_units)
 
+def back_propagate(weights, activations, derivatives, X, T, learning_rate, epochs,
+                   batch_size=1, scale=None):
+    """Train the weight matrices of a layered network in place, on the
+    rows of inputs X and target outputs T, by back-propagation of the
+    errors. Layer i's values are activations[i] of the previous layer's
+    values times weights[i] transposed, and derivatives[i] gives the
+    derivative of activations[i] from those values. scale, if given,
+    multiplies the update from each row."""
     for epoch in range(epochs):
-        # Iterate over each example
-        for e in range(len(examples)):
-            i_val = inputs[e]
-            t_val = targets[e]
-
-            # Activate input layer
-            for v, n in zip(i_val, i_nodes):
-                n.value = v
-
+        for start in range(0, len(X), batch_size):
             # Forward pass
-            for layer in net[1:]:
-                for node in layer:
-                    inc = [n.value for n in node.inputs]
-                    in_val = dotproduct(inc, node.weights)
-                    node.value = node.activation(in_val)
-
-            # Initialize delta
-            delta = [[] for _ in range(n_layers)]
-
-            # Compute outer layer delta
-
-            # Error for the MSE cost function
-            err = [t_val[i] - o_nodes[i].value for i in range(o_units)]
-
-            # The activation function used is relu or sigmoid function
-            if node.activation == sigmoid:
-                delta[-1] = [sigmoid_derivative(o_nodes[i].value) * err[i] for i in range(o_units)]
-            elif node.activation == relu:
-                delta[-1] = [relu_derivative(o_nodes[i].value) * err[i] for i in range(o_units)]
-            elif node.activation == tanh:
-                delta[-1] = [tanh_derivative(o_nodes[i].value) * err[i] for i in range(o_units)]
-            elif node.activation == elu:
-                delta[-1] = [elu_derivative(o_nodes[i].value) * err[i] for i in range(o_units)]
-            else:
-                delta[-1] = [leaky_relu_derivative(o_nodes[i].value) * err[i] for i in range(o_units)]
-
-
-            # Backward pass
-            h_layers = n_layers - 2
-            for i in range(h_layers, 0, -1):
-                layer = net[i]
-                h_units = len(layer)
-                nx_layer = net[i+1]
-
-                # weights from each ith layer node to each i + 1th layer node
-                w = [[node.weights[k] for node in nx_layer] for k in range(h_units)]
-
-                if activation == sigmoid:
-                    delta[i] = [sigmoid_derivative(layer[j].value) * dotproduct(w[j], delta[i+1])
-                            for j in range(h_units)]
-                elif activation == relu:
-                    delta[i] = [relu_derivative(layer[j].value) * dotproduct(w[j], delta[i+1])
-                            for j in range(h_units)]
-                elif activation == tanh:
-                    delta[i] = [tanh_derivative(layer[j].value) * dotproduct(w[j], delta[i+1])
-                            for j in range(h_units)]
-                elif activation == elu:
-                    delta[i] = [elu_derivative(layer[j].value) * dotproduct(w[j], delta[i+1])
-                            for j in range(h_units)]
-                else:
-                    delta[i] = [leaky_relu_derivative(layer[j].value) * dotproduct(w[j], delta[i+1])
-                            for j in range(h_units)]
-
-            #  Update weights
-            for i in range(1, n_layers):
-                layer = net[i]
-                inc = [node.value for node in net[i-1]]
-                units = len(layer)
-                for j in range(units):
-                    layer[j].weights = vector_add(layer[j].weights,
-                                                  scalar_vector_product(
-                                                  learning_rate * delta[i][j], inc))
-
-    return net
-
-
-def PerceptronLearner(dataset, learning_rate=0.01, epochs=100):
-    """Logistic Regression, NO hidden layer"""
+            values = [X[start:start + batch_size]]
+            for W, g in zip(weights, activations):
+                values.append(g(values[-1] @ W.T))
+
+            # Error for the MSE cost function, and the output layer delta
+            delta = derivatives[-1](values[-1]) * (T[start:start + batch_size] - values[-1])
+            if scale is not None:
+                delta *= scale[start:start + batch_size, None]
+
+            # Backward pass, updating each layer once the one below has its delta
+            for i in range(len(weights) - 1, -1, -1):
+                gradient = delta.T @ values[i]
+                if i > 0:
+                    delta = derivatives[i - 1](values[i]) * (delta @ weights[i])
+                weights[i] += learning_rate * gradient
+    return weights
+
+
+def example_matrices(dataset, o_units):
+    """Return the array of the inputs of each example of dataset, and the
+    array of its target outputs: the one-hot representation of the target
+    if o_units > 1, as init_examples makes them."""
+    X = examples_array(dataset.examples, dataset.inputs)
+    if dataset.columnar:
+        targets = dataset.examples.column_values(dataset.target)
+    else:
+        targets = [e[dataset.target] for e in dataset.examples]
+    if o_units > 1:
+        T = np.zeros((len(targets), o_units))
+        T[np.arange(len(targets)), targets] = 1
+    else:
+        T = np.array(targets, dtype=float).reshape(-1, 1)
+    return X, T
+
+
+def examples_array(examples, attrs):
+    """Return an array of floats with a row for each of examples (a
+    ColumnarExamples or a list), holding its values of the attributes attrs,
+    which must be numbers (or bools)."""
+    if isinstance(examples, ColumnarExamples):
+        if not all(examples.categories[attr] is None for attr in attrs):
+            raise ValueError('Attributes {} are not all numeric'.format(attrs))
+        columns = [examples.columns[attr] for attr in attrs]
+        return np.column_stack(columns).astype(float).reshape(len(examples), len(attrs))
+    try:
+        return np.array(examples, dtype=float)[:, attrs].reshape(len(examples), len(attrs))
+    except (ValueError, IndexError):  # non-numeric attributes, or ragged rows
+        X = [[e[attr] for attr in attrs] for e in examples]
+        return np.array(X, dtype=float).reshape(len(examples), len(attrs))
+
+
+def array_activation(activation):
+    """Return a pair of NumPy functions: activation, and its derivative as a
+    function of the activation's value (as sigmoid_derivative is). As in
+    the unit-at-a-time algorithm, any other activation function is given
+    the derivative of leaky_relu."""
+    def leaky_relu_array(x, alpha=0.01):
+        return np.where(x > 0, x, alpha * x)
+
+    def leaky_relu_derivative_array(value, alpha=0.01):
+        return np.where(value > 0, 1, alpha)
+
+    pairs = {
+        sigmoid: (lambda x: 1 / (1 + np.exp(-x)), sigmoid_derivative),
+        relu: (lambda x: np.maximum(x, 0), lambda value: (value > 0).astype(float)),
+        tanh: (np.tanh, tanh_derivative),
+        elu: (lambda x, alpha=0.01: np.where(x > 0, x, alpha * (np.exp(np.minimum(x, 0)) - 1)),
+              lambda value, alpha=0.01: np.where(value > 0, 1, alpha * np.exp(value))),
+        leaky_relu: (leaky_relu_array, leaky_relu_derivative_array)}
+    return pairs.get(activation, (np.vectorize(activation, otypes=[float]),
+                                  leaky_relu_derivative_array))
+
+
+def network_weights(net):
+    """Export the weights of a network (as made by network) as a list of
+    matrices, one per layer after the input layer, where W[j, k] is the
+    weight from unit k of the layer before to unit j of this layer."""
+    return [np.array([node.weights for node in layer], dtype=float).reshape(len(layer), len(before))
+            for before, layer in zip(net, net[1:])]
+
+
+def set_network_weights(net, weights):
+    """Put weight matrices, as network_weights gives them, into net's units."""
+    for layer, W in zip(net[1:], weights):
+        for node, row in zip(layer, W.tolist()):
+            node.weights = row
+
+
+def PerceptronLearner(dataset, learning_rate=0.01, epochs=100, weights=None):
+    """Logistic Regression, NO hidden layer.
+    weights, if given, weights the examples as for BackPropagationLearner."""
     i_units = len(dataset.inputs)
     o_units = len(dataset.values[dataset.target])
     hidden_layer_sizes = []
     raw_net = network(i_units, hidden_layer_sizes, o_units)
-    learned_net = BackPropagationLearner(dataset, raw_net, learning_rate, epochs)
+    learned_net = BackPropagationLearner(dataset, raw_net, learning_rate, epochs,
+                                         weights=weights)
 
     def predict(example):
         o_nodes = learned_net[1]
@@ -817,6 +1922,48 @@ def PerceptronLearner(dataset, learning_rate=0.01, epochs=100):
         # Hypothesis
         return find_max_node(o_nodes)
 
+    W = network_weights(learned_net)[0]
+    activation = array_activation(learned_net[1][0].activation)[0]
+
+    def predict_all(examples):
+        """Predict each of examples (a ColumnarExamples or a list) at once."""
+        outputs = activation(examples_array(examples, list(range(i_units))) @ W.T)
+        return np.argmax(outputs, axis=1).tolist()
+
+    predict.predict_all = predict_all
+    return predict
+
+
+def StreamingPerceptronLearner(chunks, classes, target=-1, inputs=None,
+                               learning_rate=0.01, epochs=1):
+    """PerceptronLearner, trained on chunks of examples as they come, so that
+    only the weights and one chunk are ever held in memory. chunks is a
+    function returning a fresh iterator of chunks for each epoch, such as
+    lambda: parse_csv_chunks(open(filename)); classes is the list of
+    target values, one output unit each. The weight updates for all the
+    examples in a chunk are worked out at once, from the weights at the
+    start of the chunk, rather than one example after another (so big
+    chunks may need a smaller learning_rate)."""
+    class_index = {c: k for k, c in enumerate(classes)}
+    W = None
+    for epoch in range(epochs):
+        for chunk in chunks():
+            if W is None:
+                target = target % len(chunk[0])
+                inputs = inputs or [attr for attr in range(len(chunk[0])) if attr != target]
+                W = np.array([random_weights(min_value=-0.5, max_value=0.5,
+                                             num_weights=len(inputs)) for _ in classes])
+            X = np.array([[e[attr] for attr in inputs] for e in chunk], dtype=float)
+            targets = np.zeros((len(chunk), len(classes)))
+            targets[np.arange(len(chunk)), [class_index[e[target]] for e in chunk]] = 1
+            outputs = 1 / (1 + np.exp(-X @ W.T))
+            delta = sigmoid_derivative(outputs) * (targets - outputs)
+            W += learning_rate * delta.T @ X
+
+    def predict(example):
+        # Hypothesis: the unit with the greatest input (and so output)
+        return classes[int(np.argmax(W @ [example[attr] for attr in inputs]))]
+
     return predict
 
 
@@ -885,41 +2032,126 @@ def find_max_node(nodes):
 # ______________________________________________________________________________
 
 
-def LinearLearner(dataset, learning_rate=0.01, epochs=100):
-    """Define with learner = LinearLearner(data); infer with learner(x)."""
+def LinearLearner(dataset, learning_rate=0.01, epochs=100, solver='sgd', batch_size=None,
+                  chunk_size=65536):
+    """Define with learner = LinearLearner(data); infer with learner(x).
+    Fits w to minimise the squared error of w[0] + w[1] * x[i1] + ... for the
+    inputs i1, ... of each example, taking dataset.examples chunk_size at
+    a time (so a columnar DataSet read through a cache is never all in
+    memory), with one of these solvers:
+
+    'sgd'     Gradient descent for the given number of epochs, from random
+              weights. With batch_size=None the weights move once per epoch
+              by the mean gradient over all the examples; otherwise once
+              per batch_size examples, taken in order (so shuffle sorted
+              examples first). learning_rate is a number, or a schedule:
+              a function of the number of updates so far, as
+              decaying_learning_rate gives.
+    'qr'      Least squares by a QR factorization, updated chunk by chunk.
+    'normal'  Least squares by the normal equations: quicker, but less
+              accurate when the inputs are nearly collinear.
+    learning_rate, epochs and batch_size only matter for 'sgd'.
+    The predictor takes a whole example (the inputs are picked out of it by
+    dataset.inputs) or just the input values, in the order of
+    dataset.inputs.
+    >>> data = DataSet(examples=[[0, 1], [1, 3], [2, 5], [3, 7]])
+    >>> round(LinearLearner(data, solver='qr')([4]), 6)
+    9.0
+    >>> round(LinearLearner(data, solver='qr')([4, None]), 6)
+    9.0
+    """
     idx_i = dataset.inputs
-    idx_t = dataset.target  # As of now, dataset.target gives only one index.
-    examples = dataset.examples
-    num_examples = len(examples)
+    if solver == 'sgd':
+        w = sgd_regression(dataset, learning_rate, epochs, batch_size, chunk_size)
+    elif solver in ('qr', 'normal'):
+        w = least_squares_regression(dataset, solver, chunk_size)
+    else:
+        raise ValueError('Unknown solver {!r}'.format(solver))
+    w = w.tolist()
 
-    # X transpose
-    X_col = [dataset.values[i] for i in idx_i]  # vertical columns of X
+    def inputs_of(example):
+        return example if len(example) == len(idx_i) else [example[i] for i in idx_i]
 
-    # Add dummy
-    ones = [1 for _ in range(len(examples))]
-    X_col = [ones] + X_col
+    def predict(example):
+        return w[0] + dotproduct(w[1:], inputs_of(example))
+
+    def predict_all(examples):
+        """Predict each of examples (a ColumnarExamples or a list, of whole
+        examples or of input values) at once."""
+        attrs = idx_i
+        if (not isinstance(examples, ColumnarExamples) and len(examples) and
+                len(examples[0]) == len(idx_i)):
+            attrs = list(range(len(idx_i)))
+        return (examples_array(examples, attrs) @ w[1:] + w[0]).tolist()
+
+    predict.predict_all = predict_all
+    return predict
 
-    # Initialize random weigts
-    num_weights = len(idx_i) + 1
-    w = random_weights(min_value=-0.5, max_value=0.5, num_weights=num_weights)
 
+def regression_chunks(dataset, chunk_size=65536):
+    """Yield a pair of arrays (X, y) for each chunk_size examples of dataset:
+    X with a row of 1 (for the intercept) and the inputs of each example,
+    and y with their targets."""
+    examples = dataset.examples
+    for start in range(0, len(examples), chunk_size):
+        chunk = examples_array(examples[start:start + chunk_size],
+                               [dataset.target] + dataset.inputs)
+        y = chunk[:, 0].copy()
+        chunk[:, 0] = 1
+        yield chunk, y
+
+
+def least_squares_regression(dataset, solver='qr', chunk_size=65536):
+    """Return the weights (intercept first) that minimise the squared error
+    of a linear function of dataset.inputs for dataset.target. For 'qr',
+    the R of the QR factorization of [X y] is updated with each chunk, as
+    R of [R; chunk] (so only R and one chunk are ever held); for 'normal',
+    the sum of [X y]^T [X y] over the chunks is."""
+    n = len(dataset.inputs) + 1
+    R = np.zeros((0 if solver == 'qr' else n + 1, n + 1))
+    for X, y in regression_chunks(dataset, chunk_size):
+        Xy = np.column_stack([X, y])
+        if solver == 'qr':
+            R = np.linalg.qr(np.vstack([R, Xy]), mode='r')
+        else:
+            R += Xy.T @ Xy
+    # R[:n, :n] w = R[:n, n] is the triangular (or normal) system; lstsq
+    # also gives an answer when inputs are collinear or examples too few
+    return np.linalg.lstsq(R[:n, :n], R[:n, n], rcond=None)[0]
+
+
+def sgd_regression(dataset, learning_rate=0.01, epochs=100, batch_size=None,
+                   chunk_size=65536):
+    """Return the weights (intercept first) of a linear function of
+    dataset.inputs for dataset.target, found by gradient descent on the
+    squared error, as for LinearLearner(solver='sgd')."""
+    rate = learning_rate if callable(learning_rate) else (lambda t: learning_rate)
+    w = np.array(random_weights(min_value=-0.5, max_value=0.5,
+                                num_weights=len(dataset.inputs) + 1))
+    if batch_size:
+        # Batches never straddle two chunks
+        chunk_size = max(1, chunk_size // batch_size) * batch_size
+    t = 0
     for epoch in range(epochs):
-        err = []
-        # Pass over all examples
-        for example in examples:
-            x = [1] + example
-            y = dotproduct(w, x)
-            t = example[idx_t]
-            err.append(t - y)
-
-        # update weights
-        for i in range(len(w)):
-            w[i] = w[i] + learning_rate * (dotproduct(err, X_col[i]) / num_examples)
+        if batch_size:
+            for X, y in regression_chunks(dataset, chunk_size):
+                for start in range(0, len(X), batch_size):
+                    Xb, yb = X[start:start + batch_size], y[start:start + batch_size]
+                    w += rate(t) * ((yb - Xb @ w) @ Xb) / len(Xb)
+                    t += 1
+        else:
+            gradient = np.zeros_like(w)
+            for X, y in regression_chunks(dataset, chunk_size):
+                gradient += (y - X @ w) @ X
+            w += rate(t) * gradient / max(len(dataset.examples), 1)
+            t += 1
+    return w
 
-    def predict(example):
-        x = [1] + example
-        return dotproduct(w, x)
-    return predict
+
+def decaying_learning_rate(learning_rate=0.01, decay=0.001):
+    """A learning-rate schedule for gradient descent: learning_rate / (1 + decay * t)
+    for the update after t others."""
+    return lambda t: learning_rate / (1 + decay * t)
 
 # ______________________________________________________________________________
 
@@ -938,26 +2170,51 @@ def EnsembleLearner(learners):
 
 
 def AdaBoost(L, K):
-    """[Figure 18.34]"""
+    """[Figure 18.34]
+    L(dataset, weights=w) learns with a weight for each example: a learner
+    that weights examples itself, such as DecisionStumpLearner,
+    NaiveBayesLearner or PerceptronLearner, or one adapted by
+    WeightedLearner. If L has a weighted_trainer, as the decision tree
+    learners do, L.weighted_trainer(dataset, examples) is called once, with
+    the examples as a ColumnarExamples, and gives a function of just the
+    weights for each round, so the work of reading the examples is shared.
+    Each round runs its hypothesis over the examples just once (all at once,
+    if it has a predict_all), and the weights are updated from that vector
+    of predictions."""
 
     def train(dataset):
         examples, target = dataset.examples, dataset.target
         N = len(examples)
         epsilon = 1/(2*N)
-        w = [1/N]*N
+        w = np.full(N, 1/N)
+        if isinstance(examples, ColumnarExamples):
+            columns, desired = examples, examples.column_values(target)
+        else:
+            columns, desired = None, [example[target] for example in examples]
+        if hasattr(L, 'weighted_trainer'):
+            if columns is None:
+                columns = ColumnarExamples(examples)
+            learn = L.weighted_trainer(dataset, columns)
+        else:
+            def learn(weights):
+                return L(dataset, weights=weights)
         h, z = [], []
         for k in range(K):
-            h_k = L(dataset, w)
+            h_k = learn(w)
             h.append(h_k)
-            error = sum(weight for example, weight in zip(examples, w)
-                        if example[target] != h_k(example))
+            if hasattr(h_k, 'predict_all'):
+                if columns is None:
+                    columns = ColumnarExamples(examples)
+                outputs = h_k.predict_all(columns)
+            else:
+                outputs = [h_k(example) for example in examples]
+            right = np.array([o == d for o, d in zip(outputs, desired)], dtype=bool)
+            error = w[~right].sum().item()
 
             # Avoid divide-by-0 from either 0% or 100% error rates:
             error = clip(error, epsilon, 1 - epsilon)
-            for j, example in enumerate(examples):
-                if example[target] == h_k(example):
-                    w[j] *= error/(1 - error)
-            w = normalize(w)
+            w[right] *= error/(1 - error)
+            w /= w.sum()
             z.append(math.log((1 - error)/error))
         return WeightedMajority(h, z)
     return train
@@ -968,6 +2225,15 @@ def WeightedMajority(predictors, weights):
     def predict(example):
         return weighted_mode((predictor(example) for predictor in predictors),
                              weights)
+
+    def predict_all(examples):
+        """Predict each of a ColumnarExamples by the weighted vote of what
+        each predictor predicts for all of them."""
+        votes = [predictor.predict_all(examples) for predictor in predictors]
+        return [weighted_mode(values, weights) for values in zip(*votes)]
+
+    if all(hasattr(predictor, 'predict_all') for predictor in predictors):
+        predict.predict_all = predict_all
     return predict
 
 
@@ -1028,6 +2294,12 @@ def err_ratio(predict, dataset, examples=None, verbose=0):
     examples = examples or dataset.examples
     if len(examples) == 0:
         return 0.0
+    if (isinstance(examples, ColumnarExamples) and hasattr(predict, 'predict_all')
+            and not verbose):
+        outputs = predict.predict_all(examples)
+        desired = examples.column_values(dataset.target)
+        right = sum(output == d for output, d in zip(outputs, desired))
+        return 1 - (right/len(examples))
     right = 0
     for example in examples:
         desired = example[dataset.target]
@@ -1058,85 +2330,163 @@ def train_test_split(dataset, start, end):
     return train, val
 
 
-def cross_validation(learner, size, dataset, k=10, trials=1):
+def cross_validation(learner, size, dataset, k=10, trials=1, processes=1, seed=None):
     """Do k-fold cross_validate and return their mean.
     That is, keep out 1/k of the examples for testing on each of k runs.
     Shuffle the examples first; if trials>1, average over several shuffles.
+    Each run trains learner(dataset, size), or learner(dataset) if size is
+    None, on a copy of dataset holding the other examples. The shuffles,
+    and the seed of the random module for each run, come from seed (or
+    if it is None, from the random module). Unless processes is 1 the runs
+    are done on a pool of processes (None means one per core), and then
+    learner must be a function defined at module level.
     Returns Training error, Validataion error"""
-    k = k or len(dataset.examples)
-    if trials > 1:
-        trial_errT = 0
-        trial_errV = 0
-        for t in range(trials):
-            errT, errV = cross_validation(learner, size, dataset,
-                                          k=10, trials=1)
-            trial_errT += errT
-            trial_errV += errV
-        return trial_errT/trials, trial_errV/trials
-    else:
-        fold_errT = 0
-        fold_errV = 0
-        n = len(dataset.examples)
-        examples = dataset.examples
+    folds = cross_validation_folds(len(dataset.examples), k, trials, seed)
+    with fold_executor(dataset, processes) as executor:
+        return mean_fold_errors(executor, dataset, learner, size, folds)
+
+
+def cross_validation_folds(n, k=10, trials=1, seed=None):
+    """Return a list of trials * k folds for the examples range(n): for each
+    trial, a shuffle of them cut into k parts. Each fold is a pair of a
+    seed for its run and the array of the row numbers held out in it."""
+    k = k or n
+    rng = np.random.default_rng(random.getrandbits(64) if seed is None else seed)
+    folds = []
+    for trial in range(trials):
+        rows = rng.permutation(n)
         for fold in range(k):
-            random.shuffle(dataset.examples)
-            train_data, val_data = train_test_split(dataset, fold * (n / k),
-                                                    (fold + 1) * (n / k))
-            dataset.examples = train_data
-            h = learner(dataset, size)
-            fold_errT += err_ratio(h, dataset, train_data)
-            fold_errV += err_ratio(h, dataset, val_data)
-
-            # Reverting back to original once test is completed
-            dataset.examples = examples
-        return fold_errT/k, fold_errV/k
-
-# TODO: The function cross_validation_wrapper needs to be fixed. (The while loop runs forever!)
-def cross_validation_wrapper(learner, dataset, k=10, trials=1):
+            folds.append((int(rng.integers(2 ** 63)),
+                          rows[fold * n // k:(fold + 1) * n // k]))
+    return folds
+
+
+def fold_executor(dataset, processes=1):
+    """Return a context manager giving a pool of processes to train folds
+    on, each with one copy of dataset (or where processes are forked,
+    sharing the parent's), which the folds only ever read; or giving None
+    if processes is 1, to train them one after another here."""
+    if processes == 1:
+        return contextlib.nullcontext()
+    return ProcessPoolExecutor(processes, initializer=set_fold_dataset, initargs=(dataset,))
+
+
+def mean_fold_errors(executor, dataset, learner, size, folds):
+    """Return the mean training and validation error of learner over folds."""
+    errors = fold_errors(executor, dataset, [(learner, size, fold) for fold in folds])
+    return tuple(np.mean(errors, axis=0).tolist()) if errors else (0.0, 0.0)
+
+
+def fold_errors(executor, dataset, runs):
+    """Return the list of (training error, validation error) of each run
+    (learner, size, fold) of cross-validation on dataset, using executor
+    as fold_executor gives it."""
+    if executor is None:
+        return [fold_error(dataset, *run) for run in runs]
+    return list(executor.map(run_fold, runs))
+
+
+def fold_error(dataset, learner, size, fold):
+    """Train learner on the examples of dataset not held out in fold, with
+    the random module seeded by fold's seed, and return its error ratio
+    on them and on the held-out examples."""
+    seed, held_out = fold
+    examples = dataset.examples
+    kept = np.ones(len(examples), dtype=bool)
+    kept[held_out] = False
+    train_data = copy.copy(dataset)
+    train_data.examples = select_examples(examples, np.flatnonzero(kept))
+    val_examples = select_examples(examples, held_out)
+    state = random.getstate()
+    random.seed(seed)
+    try:
+        h = learner(train_data) if size is None else learner(train_data, size)
+        return (err_ratio(h, train_data, train_data.examples),
+                err_ratio(h, train_data, val_examples))
+    finally:
+        random.setstate(state)
+
+
+def select_examples(examples, rows):
+    """Return the examples (a ColumnarExamples or a list) with the given
+    array of row numbers, of the same kind."""
+    if isinstance(examples, ColumnarExamples):
+        return examples[rows]
+    return [examples[i] for i in rows.tolist()]
+
+
+fold_dataset = None
+
+
+def set_fold_dataset(dataset):
+    """Initialize a worker process of fold_executor."""
+    global fold_dataset
+    fold_dataset = dataset
+
+
+def run_fold(run):
+    return fold_error(fold_dataset, *run)
+
+
+def cross_validation_wrapper(learner, dataset, k=10, trials=1, patience=3, max_size=None,
+                             processes=1, seed=None, min_size=None):
     """[Fig 18.8]
     Return the optimal value of size having minimum error
     on validation set.
     err_train: A training error array, indexed by size
     err_val: A validation error array, indexed by size
-    """
+    The size is given to learner as its second argument, as with
+    learner(dataset, size): k for NearestNeighborLearner, or max_bins for
+    DecisionTreeLearner. min_size defaults to learner.min_size where the
+    learner has one (2 for DecisionTreeLearner), else 1.
+    Sizes min_size, min_size + 1, ... are cross-validated on the same folds
+    (and pool of processes, as for cross_validation) until the training
+    error stops changing, the validation error has not improved for
+    patience sizes, or max_size is reached."""
+    if min_size is None:
+        min_size = getattr(learner, 'min_size', 1)
     err_val = []
     err_train = []
-    size = 1
-
-    while True:
-        errT, errV = cross_validation(learner, size, dataset, k)
-        # Check for convergence provided err_val is not empty
-        if (err_train and isclose(err_train[-1], errT, rel_tol=1e-6)):
-            best_size = 0
-            min_val = math.inf
-
-            i = 0
-            while i < size:
-                if err_val[i] < min_val:
-                    min_val = err_val[i]
-                    best_size = i
-                i += 1
-        err_val.append(errV)
-        err_train.append(errT)
-        print(err_val)
-        size += 1
-
+    best_size = min_size
+    folds = cross_validation_folds(len(dataset.examples), k, trials, seed)
+    with fold_executor(dataset, processes) as executor:
+        size = min_size
+        while max_size is None or size <= max_size:
+            errT, errV = mean_fold_errors(executor, dataset, learner, size, folds)
+            converged = err_train and isclose(err_train[-1], errT, rel_tol=1e-6)
+            err_val.append(errV)
+            err_train.append(errT)
+            if errV < err_val[best_size - min_size]:
+                best_size = size
+            if converged or size - best_size >= patience:
+                break
+            size += 1
+    return best_size
 
 
 def leave_one_out(learner, dataset, size=None):
     """Leave one out cross-validation over the dataset."""
     return cross_validation(learner, size, dataset, k=len(dataset.examples))
 
-# TODO learningcurve needs to fixed
-def learningcurve(learner, dataset, trials=10, sizes=None):
-    if sizes is None:
-        sizes = list(range(2, len(dataset.examples) - 10, 2))
 
-    def score(learner, size):
-        random.shuffle(dataset.examples)
-        return train_test_split(learner, dataset, 0, size)
-    return [(size, mean([score(learner, size) for t in range(trials)]))
-            for size in sizes]
+def learningcurve(learner, dataset, trials=10, sizes=None, processes=1, seed=None):
+    """Return a list of (size, accuracy) pairs: for each size, the mean over
+    trials shuffles of the proportion of the examples learner(dataset)
+    gets right, when trained on the first size examples of the shuffle
+    and tested on the rest. The runs are made as for cross_validation."""
+    n = len(dataset.examples)
+    if sizes is None:
+        sizes = list(range(2, n - 10, 2))
+    rng = np.random.default_rng(random.getrandbits(64) if seed is None else seed)
+    runs = []
+    for size in sizes:
+        for trial in range(trials):
+            rows = rng.permutation(n)
+            runs.append((learner, None, (int(rng.integers(2 ** 63)), rows[size:])))
+    with fold_executor(dataset, processes) as executor:
+        errors = fold_errors(executor, dataset, runs)
+    return [(size, 1 - mean(errV for errT, errV in errors[i * trials:(i + 1) * trials]))
+            for i, size in enumerate(sizes)]
 
 # ______________________________________________________________________________
 # The rest of this file gives datasets for machine learning problems.
@@ -1262,6 +2612,6 @@ def compare(algorithms=None,
                             Majority(7, 100), Parity(7, 100), Xor(100)]              # of datasets
 
     print_table([[a.__name__.replace('Learner', '')] +
-                 [cross_validation(a, d, k, trials) for d in datasets]
+                 [cross_validation(a, None, d, k, trials)[1] for d in datasets]
                  for a in algorithms],
-                header=[''] + [d.name[0:7] for d in datasets], numfmt='%.2f')
+                header=[''] + [d.name[0:7] for d in datasets], numfmt='{:.2f}')
@@ -4,15 +4,24 @@
 from utils import (
     product, argmax, element_wise_product, matrix_multiplication,
     vector_to_diagonal, vector_add, scalar_vector_product, inverse_matrix,
-    weighted_sample_with_replacement, isclose, probability, normalize
+    weighted_sample_with_replacement, isclose, probability, normalize,
+    print_table
 )
 from logic import extend
 from agents import Agent
 
+import bisect
+import hashlib
+import itertools
+import os
 import random
-from collections import defaultdict
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
 from functools import reduce
 
+import numpy as np
+
 # ______________________________________________________________________________
 
 
@@ -170,6 +179,7 @@ class BayesNet:
         """Nodes must be ordered with parents before children."""
         self.nodes = []
         self.variables = []
+        self.plans = {}  # Cache for query_plan
         node_specs = node_specs or []
         for node_spec in node_specs:
             self.add(node_spec)
@@ -184,6 +194,7 @@ class BayesNet:
         self.variables.append(node.variable)
         for parent in node.parents:
             self.variable_node(parent).children.append(node)
+        self.plans.clear()
 
     def variable_node(self, var):
         """Return the node for the variable named var.
@@ -198,6 +209,25 @@ class BayesNet:
         """Return the domain of var."""
         return [True, False]
 
+    def query_plan(self, X, evidence, order=None):
+        """Return a QueryPlan for P(X | evidence), where evidence is a
+        collection of variables (or a dict of evidence, whose keys are
+        used). Plans are cached on X, the evidence variables and order
+        (where a list of variables is cached as a tuple).
+        >>> plan = burglary.query_plan('Burglary', ['JohnCalls', 'MaryCalls'],
+        ...                            ['Alarm', 'Earthquake'])
+        >>> plan is burglary.query_plan('Burglary', ['MaryCalls', 'JohnCalls'],
+        ...                             ['Alarm', 'Earthquake'])
+        True
+        >>> plan(dict(JohnCalls=T, MaryCalls=T)).show_approx()
+        'False: 0.716, True: 0.284'"""
+        if isinstance(order, list):
+            order = tuple(order)
+        key = (X, frozenset(evidence), order)
+        if key not in self.plans:
+            self.plans[key] = QueryPlan(X, evidence, self, order)
+        return self.plans[key]
+
     def __repr__(self):
         return 'BayesNet({0!r})'.format(self.nodes)
 
@@ -341,6 +371,12 @@ class BayesNode:
         self.parents = parents
         self.cpt = cpt
         self.children = []
+        # The same distribution as an array with an axis for X and then one
+        # for each parent; along each axis index 0 is True and 1 is False.
+        ptrue = np.array([cpt[vs] for vs in
+                          itertools.product([True, False], repeat=len(parents))],
+                         dtype=float).reshape((2,) * len(parents))
+        self.table = np.stack([ptrue, 1 - ptrue])
 
     def p(self, value, event):
         """Return the conditional probability
@@ -361,6 +397,13 @@ class BayesNode:
         parents."""
         return probability(self.p(True, event))
 
+    def p_true(self, samples):
+        """Return an array of P(X=true | parents) for a batch of samples,
+        given as a dict mapping each parent to an array of its values."""
+        # Index 0 of an axis of table is True, so a value's index is not value
+        return self.table[(0,) + tuple((~samples[parent]).view(np.uint8)
+                                       for parent in self.parents)]
+
     def __repr__(self):
         return repr((self.variable, ' '.join(self.parents)))
 
@@ -412,12 +455,20 @@ def enumerate_all(variables, e, bn):
 # ______________________________________________________________________________
 
 
-def elimination_ask(X, e, bn):
+def elimination_ask(X, e, bn, order=None):
     """Compute bn's P(X|e) by variable elimination. [Figure 14.11]
+    Variables are eliminated in reverse order, unless order, a cost
+    function such as min_fill, is given; then the query is answered by
+    the cached QueryPlan for X and the evidence variables of e.
     >>> elimination_ask('Burglary', dict(JohnCalls=T, MaryCalls=T), burglary
     ...  ).show_approx()
+    'False: 0.716, True: 0.284'
+    >>> elimination_ask('Burglary', dict(JohnCalls=T, MaryCalls=T), burglary,
+    ...  order=min_fill).show_approx()
     'False: 0.716, True: 0.284'"""
     assert X not in e, "Query variable must be distinct from evidence"
+    if order is not None:
+        return bn.query_plan(X, e, order)(e)
     factors = []
     for var in reversed(bn.variables):
         factors.append(make_factor(var, e, bn))
@@ -436,10 +487,13 @@ def make_factor(var, e, bn):
     That is, bn's full joint distribution, projected to accord with e,
     is the pointwise product of these factors for bn's variables."""
     node = bn.variable_node(var)
-    variables = [X for X in [var] + node.parents if X not in e]
-    cpt = {event_values(e1, variables): node.p(e1[var], e1)
-           for e1 in all_events(variables, bn, e)}
-    return Factor(variables, cpt)
+    axes = [var] + node.parents
+    # Fix the axes of evidence variables at their observed values
+    index = tuple(bn.variable_values(X).index(e[X]) if X in e else slice(None)
+                  for X in axes)
+    variables = [X for X in axes if X not in e]
+    return Factor(variables, node.table[index],
+                  {X: bn.variable_values(X) for X in variables})
 
 
 def pointwise_product(factors, bn):
@@ -456,36 +510,179 @@ def sum_out(var, factors, bn):
 
 
 class Factor:
-    """A factor in a joint distribution."""
+    """A factor in a joint distribution. The table is a NumPy array with
+    one axis per variable, in the order of variables; domains gives the
+    values of each variable in the order of its axis."""
 
-    def __init__(self, variables, cpt):
+    def __init__(self, variables, table, domains):
         self.variables = variables
-        self.cpt = cpt
+        self.table = np.asarray(table, dtype=float)
+        self.domains = domains
 
     def pointwise_product(self, other, bn):
         """Multiply two factors, combining their variables."""
-        variables = list(set(self.variables) | set(other.variables))
-        cpt = {event_values(e, variables): self.p(e) * other.p(e)
-               for e in all_events(variables, bn, {})}
-        return Factor(variables, cpt)
+        variables = self.variables + [X for X in other.variables
+                                      if X not in self.variables]
+        table = self.broadcast(variables) * other.broadcast(variables)
+        return Factor(variables, table, dict(self.domains, **other.domains))
+
+    def broadcast(self, variables):
+        """Return my table with its axes rearranged to follow variables (a
+        superset of mine), and an axis of length 1 for each variable I
+        lack, ready to broadcast against another factor's."""
+        mine = sorted(self.variables, key=variables.index)
+        table = self.table.transpose([self.variables.index(X) for X in mine])
+        return table.reshape([len(self.domains[X]) if X in self.domains else 1
+                              for X in variables])
 
     def sum_out(self, var, bn):
         """Make a factor eliminating var by summing over its values."""
         variables = [X for X in self.variables if X != var]
-        cpt = {event_values(e, variables): sum(self.p(extend(e, var, val))
-                                               for val in bn.variable_values(var))
-               for e in all_events(variables, bn, {})}
-        return Factor(variables, cpt)
+        return Factor(variables, self.table.sum(axis=self.variables.index(var)),
+                      {X: self.domains[X] for X in variables})
 
     def normalize(self):
         """Return my probabilities; must be down to one variable."""
         assert len(self.variables) == 1
-        return ProbDist(self.variables[0],
-                        {k: v for ((k,), v) in self.cpt.items()})
+        var = self.variables[0]
+        return ProbDist(var, dict(zip(self.domains[var], self.table.tolist())))
+
+    @property
+    def cpt(self):
+        """My table as a dict {(v1, v2, ...): p}, keyed by the values of my
+        variables in order.
+        >>> make_factor('MaryCalls', {'Alarm': True}, burglary).cpt
+        {(True,): 0.7, (False,): 0.30000000000000004}"""
+        return dict(zip(itertools.product(*(self.domains[X] for X in self.variables)),
+                        self.table.ravel().tolist()))
 
     def p(self, e):
         """Look up my value tabulated for e."""
-        return self.cpt[event_values(e, self.variables)]
+        return self.table[tuple(self.domains[X].index(e[X])
+                                for X in self.variables)]
+
+
+# Elimination orderings. Each cost function scores eliminating var from
+# the interaction graph {var: set of variables sharing a factor with it};
+# sizes gives the number of values of each variable.
+
+
+def min_degree(graph, var, sizes):
+    """The number of variables var shares a factor with."""
+    return len(graph[var])
+
+
+def min_fill(graph, var, sizes):
+    """The number of edges eliminating var adds between its neighbors."""
+    return sum(1 for (a, b) in itertools.combinations(graph[var], 2)
+               if b not in graph[a])
+
+
+def weighted_min_fill(graph, var, sizes):
+    """The sum over the edges eliminating var adds of the product of the
+    domain sizes of their ends."""
+    return sum(sizes[a] * sizes[b]
+               for (a, b) in itertools.combinations(graph[var], 2)
+               if b not in graph[a])
+
+
+def elimination_order(scopes, hidden, sizes, cost=min_fill):
+    """Greedily order the hidden variables for elimination from factors
+    with the given scopes (lists of variables), each time taking the
+    variable of least cost, ties going to the earliest in hidden."""
+    graph = {var: set() for scope in scopes for var in scope}
+    for scope in scopes:
+        for var in scope:
+            graph[var].update(scope)
+    for var in graph:
+        graph[var].discard(var)
+    remaining = list(hidden)
+    order = []
+    while remaining:
+        var = min(remaining, key=lambda v: cost(graph, v, sizes))
+        remaining.remove(var)
+        order.append(var)
+        neighbors = graph.pop(var)
+        for a in neighbors:
+            graph[a].discard(var)
+            graph[a].update(neighbors - {a})
+    return order
+
+
+class QueryPlan:
+    """Variable elimination for P(X | e), compiled once for a fixed set
+    of evidence variables and then run for any values of them. Nodes that
+    are not ancestors of X or of the evidence are dropped, since they sum
+    out to 1. The elimination order is found with a cost function (see
+    elimination_order), or may be given as a list of variables (any that
+    were dropped are skipped). The plan then records which factors each
+    step multiplies and the axes of the result, and runs each step as one
+    numpy.einsum.
+    >>> plan = QueryPlan('Burglary', ['JohnCalls', 'MaryCalls'], burglary)
+    >>> plan(dict(JohnCalls=T, MaryCalls=T)).show_approx()
+    'False: 0.716, True: 0.284'
+    >>> plan(dict(JohnCalls=F, MaryCalls=T)).show_approx()
+    'False: 0.993, True: 0.00688'"""
+
+    def __init__(self, X, evidence, bn, order=None):
+        evidence = set(evidence)
+        assert X not in evidence, "Query variable must be distinct from evidence"
+        self.X, self.evidence, self.bn = X, evidence, bn
+        relevant, frontier = set(), [X] + list(evidence)
+        while frontier:
+            var = frontier.pop()
+            if var not in relevant:
+                relevant.add(var)
+                frontier.extend(bn.variable_node(var).parents)
+        self.nodes = [node for node in bn.nodes if node.variable in relevant]
+        axes = [[node.variable] + node.parents for node in self.nodes]
+        scopes = [[var for var in a if var not in evidence] for a in axes]
+        self.evidence_axes = [[(var, bn.variable_values(var)) if var in evidence
+                               else None for var in a] for a in axes]
+        sizes = {var: len(bn.variable_values(var)) for var in relevant}
+        hidden = [var for var in bn.variables
+                  if var in relevant and var != X and var not in evidence]
+        if isinstance(order, (list, tuple)):
+            self.order = [var for var in order if var in hidden]
+        else:
+            self.order = elimination_order(scopes, hidden, sizes,
+                                           order or min_fill)
+        # Work out the steps on scopes alone
+        self.steps = []
+        self.size = max([sizes[X]] + [product(sizes[var] for var in scope)
+                                      for scope in scopes])
+        live = list(range(len(scopes)))
+        for var in self.order + [None]:
+            inputs = [i for i in live if var is None or var in scopes[i]]
+            if var is None:  # Finally multiply what is left, down to X
+                scope = [X]
+            else:
+                scope = []
+                for i in inputs:
+                    scope += [v for v in scopes[i] if v != var and v not in scope]
+            numbers = {v: n for (n, v) in enumerate(
+                set(v for i in inputs for v in scopes[i]) | set(scope))}
+            self.steps.append((inputs, [[numbers[v] for v in scopes[i]] for i in inputs],
+                               [numbers[v] for v in scope]))
+            self.size = max(self.size, product(sizes[v] for v in scope))
+            live = [i for i in live if i not in inputs] + [len(scopes)]
+            scopes.append(scope)
+
+    def __call__(self, e):
+        """Return P(X | e); e must give a value to each evidence variable."""
+        tables = []
+        for (node, axes) in zip(self.nodes, self.evidence_axes):
+            index = tuple(slice(None) if a is None else a[1].index(e[a[0]])
+                          for a in axes)
+            tables.append(node.table[index])
+        for (inputs, subscripts, output) in self.steps:
+            operands = []
+            for (i, sub) in zip(inputs, subscripts):
+                operands += [tables[i], sub]
+                tables[i] = None  # Free each factor once it is used
+            tables.append(np.einsum(*operands, output))
+        return ProbDist(self.X, dict(zip(self.bn.variable_values(self.X),
+                                         tables[-1].tolist())))
 
 
 def all_events(variables, bn, e):
@@ -511,6 +708,65 @@ sprinkler = BayesNet([
      {(T, T): 0.99, (T, F): 0.90, (F, T): 0.90, (F, F): 0.00})])
 
 # ______________________________________________________________________________
+# Benchmarking exact inference
+
+
+def random_bayes_net(n, max_parents=3, window=10, seed=None):
+    """Return a BayesNet of n boolean variables 'X0', 'X1', ..., each with
+    up to max_parents parents picked at random among the window variables
+    before it, and random conditional probabilities."""
+    if seed is not None:
+        random.seed(seed)
+    specs = []
+    for i in range(n):
+        candidates = range(max(0, i - window), i)
+        parents = random.sample(candidates,
+                                min(len(candidates), random.randint(0, max_parents)))
+        cpt = {values: random.random()
+               for values in itertools.product([T, F], repeat=len(parents))}
+        specs.append(('X{}'.format(i), ['X{}'.format(p) for p in parents], cpt))
+    return BayesNet(specs)
+
+
+def benchmark_elimination(sizes=[16, 50, 100, 200],
+                          orders=[min_degree, min_fill, weighted_min_fill],
+                          n_evidence=5, repeats=10, max_enumerated=16, seed=None):
+    """Time exact inference on a random_bayes_net of each size. A query
+    variable and n_evidence evidence variables are chosen at random, and
+    each method answers the query for repeats random evidence values.
+    Besides a QueryPlan for each order, enumeration_ask (when there are no
+    more than max_enumerated hidden variables) and plain elimination_ask
+    are timed. Prints the time to build the plan, the mean time per query
+    and the size of the largest factor."""
+    if seed is not None:
+        random.seed(seed)
+    table = []
+    for n in sizes:
+        bn = random_bayes_net(n)
+        X, *evidence = random.sample(bn.variables, n_evidence + 1)
+        queries = [{var: random.choice([T, F]) for var in evidence}
+                   for _ in range(repeats)]
+
+        def timed(ask):
+            start = time.perf_counter()
+            for e in queries:
+                ask(e)
+            return round((time.perf_counter() - start) / repeats, 6)
+        if n - n_evidence - 1 <= max_enumerated:
+            table.append([n, 'enumeration_ask', '-',
+                          timed(lambda e: enumeration_ask(X, e, bn)), '-'])
+        table.append([n, 'elimination_ask', '-',
+                      timed(lambda e: elimination_ask(X, e, bn)), '-'])
+        for order in orders:
+            start = time.perf_counter()
+            plan = bn.query_plan(X, evidence, order)
+            compile_time = round(time.perf_counter() - start, 6)
+            table.append([n, 'QueryPlan ' + order.__name__, compile_time,
+                          timed(plan), plan.size])
+    print_table(table, ['Nodes', 'Method', 'Plan secs', 'Secs/query',
+                        'Largest factor'])
+
+# ______________________________________________________________________________
 
 
 def prior_sample(bn):
@@ -542,6 +798,39 @@ def rejection_sampling(X, e, bn, N=10000):
     return ProbDist(X, counts)
 
 
+def batched_prior_sample(bn, N, rng=None):
+    """Draw N samples from bn's full joint distribution at once, node by
+    node with NumPy. The result is a {variable: array of N values} dict.
+    rng is a numpy.random.Generator, or a seed for one."""
+    rng = np.random.default_rng(rng)
+    samples = {}
+    for node in bn.nodes:
+        samples[node.variable] = rng.random(N) < node.p_true(samples)
+    return samples
+
+
+def batched_rejection_sampling(X, e, bn, N=10000, seed=None, batch_size=10**5):
+    """Like rejection_sampling, but drawing the samples batch_size at a
+    time with batched_prior_sample; for a given seed the result is always
+    the same. Raises a ZeroDivisionError if all the N samples are
+    rejected.
+    >>> batched_rejection_sampling('Burglary', dict(JohnCalls=T, MaryCalls=T),
+    ...   burglary, 10**6, seed=47).show_approx()
+    'False: 0.723, True: 0.277'
+    """
+    rng = np.random.default_rng(seed)
+    counts = {x: 0 for x in bn.variable_values(X)}
+    for start in range(0, N, batch_size):
+        samples = batched_prior_sample(bn, min(batch_size, N - start), rng)
+        consistent = np.ones(len(samples[X]), dtype=bool)
+        for (var, val) in e.items():
+            consistent &= samples[var] == val
+        matches = int(np.count_nonzero(samples[X] & consistent))
+        counts[True] += matches
+        counts[False] += int(np.count_nonzero(consistent)) - matches
+    return ProbDist(X, counts)
+
+
 def consistent_with(event, evidence):
     """Is event consistent with the given evidence?"""
     return all(evidence.get(k, v) == v
@@ -579,6 +868,42 @@ def weighted_sample(bn, e):
             event[Xi] = node.sample(event)
     return event, w
 
+
+def batched_likelihood_weighting(X, e, bn, N=10000, seed=None, batch_size=10**5):
+    """Like likelihood_weighting, but drawing the samples batch_size at a
+    time with batched_weighted_sample; for a given seed the result is
+    always the same.
+    >>> batched_likelihood_weighting('Burglary', dict(JohnCalls=T, MaryCalls=T),
+    ...   burglary, 10**6, seed=1017).show_approx()
+    'False: 0.728, True: 0.272'
+    """
+    rng = np.random.default_rng(seed)
+    W = {x: 0 for x in bn.variable_values(X)}
+    for start in range(0, N, batch_size):
+        samples, weights = batched_weighted_sample(
+            bn, e, min(batch_size, N - start), rng)
+        W[True] += float(weights[samples[X]].sum())
+        W[False] += float(weights[~samples[X]].sum())
+    return ProbDist(X, W)
+
+
+def batched_weighted_sample(bn, e, N, rng=None):
+    """Draw N events from bn consistent with the evidence e at once, as a
+    {variable: array of N values} dict, and return it with the array of
+    their weights. rng is a numpy.random.Generator, or a seed for one."""
+    rng = np.random.default_rng(rng)
+    w = np.ones(N)
+    samples = {}
+    for node in bn.nodes:
+        Xi = node.variable
+        if Xi in e:
+            p = node.p_true(samples)
+            w *= p if e[Xi] else 1 - p
+            samples[Xi] = np.full(N, e[Xi])
+        else:
+            samples[Xi] = rng.random(N) < node.p_true(samples)
+    return samples, w
+
 # _________________________________________________________________________
 
 
@@ -612,64 +937,330 @@ def markov_blanket_sample(X, e, bn):
     # (assuming a Boolean variable here)
     return probability(Q.normalize()[True])
 
+
+class GibbsSampler:
+    """Gibbs sampling for P(X | e) with each variable's Markov blanket
+    compiled in advance. For each non-evidence variable Z we multiply the
+    factors of Z and of its children (with e fixed) into a table of
+    P(Z | markov blanket), one row per combination of values of the
+    blanket's non-evidence variables, stored as cumulative sums. A state is
+    a list holding the index of each variable's value, so resampling Z is
+    a table lookup and a bisection. The tables grow exponentially with the
+    size of the blankets."""
+
+    def __init__(self, X, e, bn):
+        assert X not in e, "Query variable must be distinct from evidence"
+        self.X, self.e = X, e
+        self.Z = [var for var in bn.variables if var not in e]
+        position = {var: i for (i, var) in enumerate(self.Z)}
+        self.x = position[X]
+        self.domains = [bn.variable_values(var) for var in self.Z]
+        self.blankets = []  # (positions, strides, cumulative table) per Z
+        for var in self.Z:
+            node = bn.variable_node(var)
+            factor = pointwise_product(
+                [make_factor(Y, e, bn)
+                 for Y in [var] + [child.variable for child in node.children]], bn)
+            blanket = [Y for Y in factor.variables if Y != var]
+            table = factor.broadcast(blanket + [var]).reshape(-1, len(factor.domains[var]))
+            totals = table.sum(axis=1, keepdims=True)
+            # Give impossible blanket values a uniform row rather than 0/0
+            table = np.where(totals > 0, table / np.where(totals > 0, totals, 1),
+                             1 / table.shape[1])
+            sizes = [len(factor.domains[Y]) for Y in blanket]
+            strides = [int(np.prod(sizes[i + 1:])) for i in range(len(sizes))]
+            self.blankets.append(([position[Y] for Y in blanket], strides,
+                                  np.cumsum(table, axis=1).tolist()))
+
+    def initial_state(self, rng=random):
+        """A random value index for each non-evidence variable."""
+        return [rng.randrange(len(values)) for values in self.domains]
+
+    def run(self, state, sweeps, rng=random, thin=1, start=0):
+        """Resample every variable of state (in place) sweeps times, and
+        return the list of X's value index after every thin-th sweep,
+        counting on from start sweeps already run (so that a run split into
+        several calls keeps the same samples)."""
+        blankets, trace = self.blankets, []
+        for sweep in range(start + 1, start + sweeps + 1):
+            for (i, (positions, strides, cumulative)) in enumerate(blankets):
+                row = cumulative[sum(state[p] * s for (p, s) in zip(positions, strides))]
+                state[i] = min(bisect.bisect(row, rng.random() * row[-1]),
+                               len(row) - 1)
+            if sweep % thin == 0:
+                trace.append(state[self.x])
+        return trace
+
+
+def run_gibbs_chain(sampler, state, seed, sweeps, thin=1, start=0):
+    """Run one chain of sampler from state (a new random one if None) for
+    the given number of sweeps, with its own random.Random(seed), as
+    sampler.run. Return the final state and the trace of X; used by
+    gibbs_chains_ask to run chains in worker processes."""
+    rng = random.Random(seed)
+    if state is None:
+        state = sampler.initial_state(rng)
+    trace = sampler.run(state, sweeps, rng, thin, start)
+    return state, trace
+
+
+def gelman_rubin(chains):
+    """The potential scale reduction factor R-hat of a (chains, samples)
+    array: near 1 when the chains agree with each other, larger when the
+    variance between them exceeds the variance within them. It takes at
+    least two chains (and two samples); with fewer it is nan.
+    >>> gelman_rubin([[0, 1, 0, 1]])
+    nan"""
+    chains = np.asarray(chains, dtype=float)
+    m, n = chains.shape
+    if m < 2 or n < 2:
+        return float('nan')
+    W = chains.var(axis=1, ddof=1).mean()
+    B = n * chains.mean(axis=1).var(ddof=1)
+    if W == 0:
+        return 1.0 if B == 0 else float('inf')
+    return float(np.sqrt(((n - 1) / n * W + B / n) / W))
+
+
+def effective_sample_size(chains):
+    """The effective sample size of a (chains, samples) array, from the
+    autocorrelations of the chains, summed in pairs until a pair is
+    negative (Geyer's initial positive sequence)."""
+    chains = np.asarray(chains, dtype=float)
+    m, n = chains.shape
+    W = chains.var(axis=1, ddof=1).mean()
+    B = n * chains.mean(axis=1).var(ddof=1) if m > 1 else 0.0
+    var_plus = (n - 1) / n * W + B / n
+    if var_plus == 0:
+        return float(m * n)
+    rho = []
+    for lag in range(n):
+        variogram = ((chains[:, lag:] - chains[:, :n - lag]) ** 2).mean() if lag else 0.0
+        rho.append(1 - variogram / (2 * var_plus))
+        if lag % 2 == 1 and rho[-2] + rho[-1] < 0:
+            rho = rho[:-2]
+            break
+    tau = -1 + 2 * sum(rho)
+    return float(m * n / max(tau, 1 / (m * n)))
+
+
+def gibbs_chains_ask(X, e, bn, N=1000, chains=4, burn_in=100, thin=1,
+                     processes=1, rhat_target=None, check_every=100, seed=None):
+    """Estimate P(X | e) with several independent Gibbs chains of a
+    GibbsSampler. Each chain first runs burn_in sweeps, whose samples are
+    dropped, then up to N sweeps keeping every thin-th value of X. With
+    rhat_target (e.g. 1.01) the chains are checked every check_every sweeps
+    and stop early once the R-hat of every value of X is below it (which
+    takes two or more chains: with one, R-hat is nan). Chains
+    run on a pool of processes (None means one per core) unless processes
+    is 1. Return the distribution and a dict of diagnostics: the largest
+    R-hat over the values of X, the effective sample size (the smallest
+    over the values), the number of sweeps per chain run after burn-in
+    and the number of samples per chain kept (one every thin sweeps).
+    >>> P, diagnostics = gibbs_chains_ask('Burglary', dict(JohnCalls=T, MaryCalls=T),
+    ...   burglary, N=2000, seed=5)
+    >>> P.show_approx()
+    'False: 0.722, True: 0.278'
+    >>> gibbs_chains_ask('Burglary', dict(JohnCalls=T), burglary, N=250, thin=3,
+    ...                  rhat_target=0.5, check_every=100, seed=5)[1]['samples']
+    83"""
+    sampler = GibbsSampler(X, e, bn)
+    master = random.Random(seed)
+    states = [None] * chains
+    traces = [[] for _ in range(chains)]
+    executor = ProcessPoolExecutor(processes) if processes != 1 else None
+
+    def advance(sweeps, keep, start=0):
+        seeds = [master.random() for _ in range(chains)]
+        if executor is None:
+            results = [run_gibbs_chain(sampler, states[k], seeds[k], sweeps, thin, start)
+                       for k in range(chains)]
+        else:
+            results = list(executor.map(run_gibbs_chain, [sampler] * chains, states,
+                                        seeds, [sweeps] * chains, [thin] * chains,
+                                        [start] * chains))
+        for k, (state, trace) in enumerate(results):
+            states[k] = state
+            if keep:
+                traces[k] += trace
+
+    def indicators():
+        samples = np.array(traces)
+        return [samples == i for i in range(len(bn.variable_values(X)))]
+    try:
+        if burn_in:
+            advance(burn_in, keep=False)
+        done = 0
+        while done < N:
+            step = min(N - done, check_every if rhat_target else N)
+            advance(step, keep=True, start=done)
+            done += step
+            if (rhat_target and len(traces[0]) > 1 and
+                    max(gelman_rubin(c) for c in indicators()) < rhat_target):
+                break
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    counts = np.array(traces).ravel()
+    P = ProbDist(X, {x: int(np.count_nonzero(counts == i))
+                     for (i, x) in enumerate(bn.variable_values(X))})
+    diagnostics = {'rhat': max(gelman_rubin(c) for c in indicators()),
+                   'ess': min(effective_sample_size(c) for c in indicators()),
+                   'sweeps': done, 'samples': len(traces[0])}
+    return P, diagnostics
+
 # _________________________________________________________________________
 
 
 class HiddenMarkovModel:
-    """A Hidden markov model which takes Transition model and Sensor model as inputs"""
+    """A Hidden markov model which takes Transition model and Sensor model as inputs.
+    With N states and M observation symbols, transition_model[i][j] is
+    P(X_t = j | X_t-1 = i) and sensor_model[k][i] is P(E_t = k | X_t = i),
+    one row per symbol. Observations are symbol numbers, except that True
+    and False stand for symbols 0 and 1, as in the umbrella world. The
+    models are also kept as NumPy arrays, T (N x N) and O (M x N)."""
 
     def __init__(self, transition_model, sensor_model, prior=None):
         self.transition_model = transition_model
         self.sensor_model = sensor_model
-        self.prior = prior or [0.5, 0.5]
+        self.T = np.array(transition_model, dtype=float)
+        self.O = np.array(sensor_model, dtype=float)
+        self.prior = prior or [1 / len(self.T)] * len(self.T)
+
+    def symbol(self, ev):
+        """The row of sensor_model for the observation ev: 0 for True and 1
+        for False (NumPy bools included), else ev itself."""
+        if isinstance(ev, (bool, np.bool_)):
+            return 0 if ev else 1
+        return ev
+
+    def symbols(self, ev):
+        """An array of the symbols for a sequence of observations.
+        >>> umbrella = HiddenMarkovModel([[0.7, 0.3], [0.3, 0.7]], [[0.9, 0.2], [0.1, 0.8]])
+        >>> umbrella.symbols(np.array([T, T, F])).tolist()
+        [0, 0, 1]"""
+        if isinstance(ev, np.ndarray):
+            if ev.dtype == bool:
+                return 1 - ev.astype(np.intp)
+            return ev.astype(np.intp)
+        return np.array([self.symbol(e) for e in ev], dtype=np.intp)
 
     def sensor_dist(self, ev):
-        if ev is True:
-            return self.sensor_model[0]
-        else:
-            return self.sensor_model[1]
+        return self.sensor_model[self.symbol(ev)]
 
 
 def forward(HMM, fv, ev):
-    prediction = vector_add(scalar_vector_product(fv[0], HMM.transition_model[0]),
-                            scalar_vector_product(fv[1], HMM.transition_model[1]))
-    sensor_dist = HMM.sensor_dist(ev)
+    prediction = np.dot(fv, HMM.T)
+    sensor_dist = HMM.O[HMM.symbol(ev)]
 
-    return normalize(element_wise_product(sensor_dist, prediction))
+    return normalize((sensor_dist * prediction).tolist())
 
 
 def backward(HMM, b, ev):
-    sensor_dist = HMM.sensor_dist(ev)
-    prediction = element_wise_product(sensor_dist, b)
+    sensor_dist = HMM.O[HMM.symbol(ev)]
+    prediction = sensor_dist * np.asarray(b, dtype=float)
 
-    return normalize(vector_add(scalar_vector_product(prediction[0], HMM.transition_model[0]),
-                                scalar_vector_product(prediction[1], HMM.transition_model[1])))
+    return normalize(np.dot(HMM.T, prediction).tolist())
 
 
 def forward_backward(HMM, ev, prior):
     """[Figure 15.4]
     Forward-Backward algorithm for smoothing. Computes posterior probabilities
-    of a sequence of states given a sequence of observations."""
-    t = len(ev)
-    ev.insert(0, None)  # to make the code look similar to pseudo code
-
-    fv = [[0.0, 0.0] for _ in range(len(ev))]
-    b = [1.0, 1.0]
-    bv = [b]    # we don't need bv; but we will have a list of all backward messages here
-    sv = [[0, 0] for _ in range(len(ev))]
-
-    fv[0] = prior
-
-    for i in range(1, t + 1):
-        fv[i] = forward(HMM, fv[i - 1], ev[i])
-    for i in range(t, -1, -1):
-        sv[i - 1] = normalize(element_wise_product(fv[i], b))
-        b = backward(HMM, b, ev[i])
-        bv.append(b)
-
-    sv = sv[::-1]
-
-    return sv
+    of a sequence of states given a sequence of observations: a list with
+    P(X_k | ev) for each time step k from 0 to len(ev). ev is not changed.
+    >>> umbrella = HiddenMarkovModel([[0.7, 0.3], [0.3, 0.7]], [[0.9, 0.2], [0.1, 0.8]])
+    >>> [round(p[0], 3) for p in forward_backward(umbrella, [T, T, F], [0.5, 0.5])]
+    [0.645, 0.862, 0.799, 0.191]"""
+    return smooth(HMM, ev, prior).tolist()
+
+
+def forward_filter(HMM, ev, prior=None):
+    """Run the forward algorithm over the observations ev, rescaling the
+    message to sum to 1 at each step so that long sequences do not
+    underflow. Return an array whose row k is P(X_k | e_1:k), for k from 0
+    to len(ev), and the log likelihood log P(ev) (the sum of the logs of
+    the scale factors)."""
+    symbols = HMM.symbols(ev)
+    f = np.empty((len(symbols) + 1, len(HMM.T)))
+    f[0] = HMM.prior if prior is None else prior
+    scale = np.empty(len(symbols))
+    # TO[e][i, j] = P(X_k = j | X_k-1 = i) P(e | X_k = j)
+    TO = HMM.T[None, :, :] * HMM.O[:, None, :]
+    fk = f[0]
+    for (k, e) in enumerate(symbols.tolist(), 1):
+        fk = fk.dot(TO[e])
+        scale[k - 1] = c = fk.sum()
+        fk /= c
+        f[k] = fk
+    return f, float(np.log(scale).sum())
+
+
+def smooth(HMM, ev, prior=None):
+    """Forward-backward smoothing with scaled messages: return an array
+    whose row k is P(X_k | ev) for k from 0 to len(ev). Time and memory are
+    linear in len(ev)."""
+    symbols = HMM.symbols(ev)
+    f, _ = forward_filter(HMM, symbols, prior)
+    b = np.empty_like(f)
+    b[-1] = 1
+    TO = HMM.T[None, :, :] * HMM.O[:, None, :]
+    bk = b[-1]
+    for k in range(len(symbols) - 1, -1, -1):
+        bk = TO[symbols[k]].dot(bk)
+        bk /= bk.sum()
+        b[k] = bk
+    s = f * b
+    return s / s.sum(axis=1, keepdims=True)
+
+
+def viterbi(HMM, ev, prior=None):
+    """[Figure 15.5]
+    Return the most likely sequence of states (as state numbers) for times
+    1 to len(ev) given the observations, and its log probability jointly
+    with ev. Works in log space, so long sequences do not underflow.
+    >>> umbrella = HiddenMarkovModel([[0.7, 0.3], [0.3, 0.7]], [[0.9, 0.2], [0.1, 0.8]])
+    >>> viterbi(umbrella, [T, T, F, T, T])[0]
+    [0, 0, 1, 0, 0]"""
+    symbols = HMM.symbols(ev).tolist()
+    if not symbols:
+        return [], 0.0
+    prior = np.asarray(HMM.prior if prior is None else prior, dtype=float)
+    states = np.arange(len(HMM.T))
+    with np.errstate(divide='ignore'):
+        log_T, log_O = np.log(HMM.T), np.log(HMM.O)
+        # X_0 is summed out, as in the first forward message
+        m = np.log(prior.dot(HMM.T)) + log_O[symbols[0]]
+    back = np.empty((len(symbols), len(states)), dtype=np.intp)
+    for (k, e) in enumerate(symbols[1:], 1):
+        scores = m[:, None] + log_T  # scores[i, j]: best path to i, then to j
+        back[k] = best = scores.argmax(axis=0)
+        m = scores[best, states] + log_O[e]
+    path = [int(m.argmax())]
+    for k in range(len(symbols) - 1, 0, -1):
+        path.append(int(back[k][path[-1]]))
+    return path[::-1], float(m.max())
+
+
+def log_likelihoods(HMM, sequences, prior=None):
+    """Return an array of log P(ev) for each sequence of observations in
+    sequences, running the scaled forward algorithm on all of them at once
+    (a matrix product per time step rather than one per sequence). The
+    sequences may have different lengths."""
+    sequences = [HMM.symbols(ev) for ev in sequences]
+    lengths = np.array([len(ev) for ev in sequences])
+    padded = np.zeros((len(sequences), max(lengths, default=0)), dtype=np.intp)
+    for (i, ev) in enumerate(sequences):
+        padded[i, :len(ev)] = ev
+    f = np.tile(np.asarray(HMM.prior if prior is None else prior, dtype=float),
+                (len(sequences), 1))
+    log_likelihood = np.zeros(len(sequences))
+    for k in range(padded.shape[1]):
+        live = lengths > k
+        fk = np.dot(f[live], HMM.T) * HMM.O[padded[live, k]]
+        c = fk.sum(axis=1)
+        f[live] = fk / c[:, None]
+        log_likelihood[live] += np.log(c)
+    return log_likelihood
 
 # _________________________________________________________________________
 
@@ -679,7 +1270,7 @@ def fixed_lag_smoothing(e_t, HMM, d, ev, t):
     Smoothing algorithm with a fixed time lag of 'd' steps.
     Online algorithm that outputs the new smoothed estimate if observation
     for new time step is given."""
-    ev.insert(0, None)
+    ev = [None] + list(ev)
 
     T_model = HMM.transition_model
     f = HMM.prior
@@ -702,6 +1293,88 @@ def fixed_lag_smoothing(e_t, HMM, d, ev, t):
     else:
         return None
 
+
+class FixedLagSmoother:
+    """Online smoothing with a fixed lag of d steps [Figure 15.6], kept as
+    state between observations. Give it the observations one at a time
+    (observe) or as a stream (smooth_stream, or smooth_async for an async
+    iterable); once t > d, each observation e_t yields P(X_t-d | e_1:t).
+    The smoother keeps the last d + 1 observations, the forward message
+    f = P(X_t-d | e_1:t-d) and the factors T O_k of the matrix B for k from
+    t-d+1 to t, so memory does not grow with the stream. Rather than
+    dropping the oldest factor of B by multiplying by (T O_t-d)^-1, as in
+    the figure (which needs T to be invertible, and lets rounding errors
+    grow), the factors are kept as a queue made of two stacks with running
+    products: each step then costs a constant number of S x S matrix
+    products on average, and no inverse.
+    >>> umbrella = HiddenMarkovModel([[0.7, 0.3], [0.3, 0.7]], [[0.9, 0.2], [0.1, 0.8]])
+    >>> smoother = FixedLagSmoother(umbrella, 2)
+    >>> [None if p is None else round(float(p[0]), 3)
+    ...  for p in smoother.smooth_stream([T, T, F, T, T])]
+    [None, None, 0.862, 0.816, 0.307]
+    """
+
+    def __init__(self, HMM, d, prior=None):
+        self.HMM, self.d = HMM, d
+        self.f = np.array(HMM.prior if prior is None else prior, dtype=float)
+        self.evidence = deque(maxlen=d + 1)  # Symbols e_t-d ... e_t
+        self.t = 0
+        # B is the product of the older factors (front, where front[-1] is
+        # the product of all of them, oldest first) times the newer ones
+        # (back, whose product is back_product)
+        self.front = []
+        self.back = []
+        self.back_product = np.eye(len(HMM.T))
+
+    def observe(self, e):
+        """Take the observation e_t and return P(X_t-d | e_1:t) as an array,
+        or None while t <= d."""
+        HMM = self.HMM
+        symbol = HMM.symbol(e)
+        self.t += 1
+        self.evidence.append(symbol)
+        if self.d:
+            self.push(HMM.T * HMM.O[symbol])  # T times the diagonal O_t
+        if self.t <= self.d:
+            return None
+        self.f = np.dot(self.f, HMM.T) * HMM.O[self.evidence[0]]
+        self.f /= self.f.sum()
+        if self.d:
+            self.pop()
+        b = np.dot(self.back_product, np.ones(len(HMM.T)))
+        if self.front:
+            b = np.dot(self.front[-1], b)
+        s = self.f * b
+        return s / s.sum()
+
+    def push(self, factor):
+        """Add a factor at the new end of B."""
+        self.back.append(factor)
+        product = np.dot(self.back_product, factor)
+        self.back_product = product / product.sum()  # Only its direction matters
+
+    def pop(self):
+        """Remove the factor at the old end of B."""
+        if not self.front:
+            product = np.eye(len(self.HMM.T))
+            for factor in reversed(self.back):
+                product = np.dot(factor, product)
+                product /= product.sum()
+                self.front.append(product)
+            self.back = []
+            self.back_product = np.eye(len(self.HMM.T))
+        self.front.pop()
+
+    def smooth_stream(self, observations):
+        """Yield observe(e) for each e of an iterable (possibly endless)."""
+        for e in observations:
+            yield self.observe(e)
+
+    async def smooth_async(self, observations):
+        """Like smooth_stream, for an async iterable of observations."""
+        async for e in observations:
+            yield self.observe(e)
+
 # _________________________________________________________________________
 
 
@@ -729,32 +1402,225 @@ def particle_filtering(e, N, HMM):
         w_tot += w_i
 
     # Normalize all the weights
-    for i in range(N):
-        w[i] = w[i] / w_tot
-
-    # Limit weights to 4 digits
-    for i in range(N):
-        w[i] = float("{0:.4f}".format(w[i]))
+    w = np.array(w) / w_tot
 
     # STEP 2
-
-    s = weighted_sample_with_replacement(N, s, w)
+    rng = np.random.default_rng(random.getrandbits(64))
+    s = [s[i] for i in systematic_resample(w, rng)]
 
     return s
 
+
+def systematic_resample(weights, rng=None, out=None):
+    """Return the indices of len(weights) particles drawn in proportion to
+    the (normalized) weights, using one random offset for N evenly spaced
+    points, so each particle i is drawn floor(N w_i) or ceil(N w_i) times.
+    rng is a numpy.random.Generator, or a seed for one; out, if given, is
+    an integer array to put the indices in. (That does not save memory:
+    the positions, cumulative weights and indices are still made afresh.)"""
+    rng = np.random.default_rng(rng)
+    N = len(weights)
+    return resample_at((rng.random() + np.arange(N)) / N, weights, out)
+
+
+def stratified_resample(weights, rng=None, out=None):
+    """Like systematic_resample, but with a separate random offset in each
+    of the N strata of [0, 1)."""
+    rng = np.random.default_rng(rng)
+    N = len(weights)
+    return resample_at((rng.random(N) + np.arange(N)) / N, weights, out)
+
+
+def resample_at(positions, weights, out=None):
+    """Return, for each of the increasing positions in [0, 1), the index of
+    the particle whose slice of the cumulative weights contains it (copied
+    into out, if given)."""
+    cumulative = np.cumsum(weights)
+    cumulative /= cumulative[-1]
+    indices = np.searchsorted(cumulative, positions, side='right')
+    np.minimum(indices, len(weights) - 1, out=indices)  # In case of rounding
+    if out is None:
+        return indices
+    out[:] = indices
+    return out
+
+
+class ParticleFilter:
+    """A particle filter over NumPy arrays of particles (one row, or one
+    element, per particle), for any model given as two functions:
+        transition_sample(particles, rng)   Return particles moved one step
+                                            on by sampling the transition
+                                            model (may work in place)
+        sensor_likelihood(e, particles)     Return the array of P(e | x)
+                                            for each particle x
+    Particles keep weights from step to step, and are resampled (with
+    resample, e.g. systematic_resample or stratified_resample) only when
+    the effective sample size 1 / sum(w^2) falls below ess_threshold * N.
+    Resampling gathers into a second particle array, and the two swap; the
+    resample function itself makes a few temporary arrays of N numbers.
+    Steps between resamplings allocate no per-particle arrays unless the
+    model's functions do; hmm_particle_filter's work in buffers made once.
+    >>> umbrella = HiddenMarkovModel([[0.7, 0.3], [0.3, 0.7]], [[0.9, 0.2], [0.1, 0.8]])
+    >>> pf = hmm_particle_filter(umbrella, 100000, rng=0)
+    >>> for e in [T, T]:
+    ...     pf.step(e)
+    >>> round(float(np.mean(pf.resampled() == 0)), 2)
+    0.88
+    """
+
+    def __init__(self, particles, transition_sample, sensor_likelihood,
+                 resample=systematic_resample, ess_threshold=0.5, rng=None):
+        self.particles = np.asarray(particles)
+        self.spare = np.empty_like(self.particles)
+        N = len(self.particles)
+        self.weights = np.full(N, 1 / N)
+        self.indices = np.empty(N, dtype=np.intp)
+        self.transition_sample = transition_sample
+        self.sensor_likelihood = sensor_likelihood
+        self.resample = resample
+        self.ess_threshold = ess_threshold
+        self.rng = np.random.default_rng(rng)
+
+    def step(self, e):
+        """Move the particles on one step and weight them by evidence e,
+        resampling first if too few of them carry the weight."""
+        if self.effective_sample_size() < self.ess_threshold * len(self.weights):
+            self.resample_particles()
+        self.particles = self.transition_sample(self.particles, self.rng)
+        self.weights *= self.sensor_likelihood(e, self.particles)
+        total = self.weights.sum()
+        if total == 0:  # Every particle is impossible; start again evenly
+            self.weights.fill(1 / len(self.weights))
+        else:
+            self.weights /= total
+
+    def effective_sample_size(self):
+        return 1 / np.dot(self.weights, self.weights)
+
+    def resample_particles(self):
+        """Replace the particles by an equally weighted resample of them."""
+        self.resample(self.weights, self.rng, out=self.indices)
+        np.take(self.particles, self.indices, axis=0, out=self.spare)
+        self.particles, self.spare = self.spare, self.particles
+        self.weights.fill(1 / len(self.weights))
+
+    def resampled(self):
+        """Return an equally weighted resample of the particles (as a new
+        array), as particle_filtering returns."""
+        return self.particles[self.resample(self.weights, self.rng)]
+
+    def mean(self):
+        """The weighted mean of the particles."""
+        return np.average(self.particles, axis=0, weights=self.weights)
+
+
+def hmm_particle_filter(HMM, N, rng=None, **kwargs):
+    """A ParticleFilter for an HMM, with each particle a state number,
+    starting from N samples of HMM.prior. The transition samples the
+    particles in place, and both model functions work in buffers
+    allocated here."""
+    rng = np.random.default_rng(rng)
+    cumulative = np.cumsum(HMM.T, axis=1)
+    S = len(cumulative)
+    u = np.empty(N)
+    rows = np.empty((N, S))
+    beyond = np.empty((N, S), dtype=bool)
+    likelihood = np.empty(N)
+
+    def transition_sample(particles, rng):
+        rng.random(out=u)
+        np.take(cumulative, particles, axis=0, out=rows, mode='clip')
+        np.greater(u[:, None], rows, out=beyond)
+        beyond.sum(axis=1, out=particles)
+        return np.minimum(particles, S - 1, out=particles)
+
+    def sensor_likelihood(e, particles):
+        return np.take(HMM.O[HMM.symbol(e)], particles, out=likelihood, mode='clip')
+
+    particles = rng.choice(S, size=N, p=HMM.prior)
+    return ParticleFilter(particles, transition_sample, sensor_likelihood,
+                          rng=rng, **kwargs)
+
 # _________________________________________________________________________
 ## TODO: Implement continuous map for MonteCarlo similar to Fig25.10 from the book
 
 
 class MCLmap:
     """Map which provides probability distributions and sensor readings.
-    Consists of discrete cells which are either an obstacle or empty"""
-    def __init__(self, m):
+    Consists of discrete cells which are either an obstacle or empty.
+    The range a sensor reads from each cell in each of the four directions
+    is worked out once, into ranges; if filename is given the table is
+    saved there (as a .npy file, with a .key file holding a hash of the
+    map), and read back memory-mapped when the same map is next made."""
+    def __init__(self, m, filename=None):
         self.m = m
         self.nrows = len(m)
         self.ncols = len(m[0])
         # list of empty spaces in the map
         self.empty = [(i, j) for i in range(self.nrows) for j in range(self.ncols) if not m[i][j]]
+        self.ranges = self.range_table(filename)
+
+    def range_table(self, filename=None):
+        """Return an array with ranges[d, i, j] the distance from cell (i, j)
+        to the nearest obstacle or map boundary in direction d (0N 1E 2S 3W),
+        counting the cell itself; 0 for an obstacle."""
+        n_directions = 4
+        shape = (n_directions, self.nrows, self.ncols)
+        free = ~np.array(self.m, dtype=bool)
+        if filename is not None:
+            if not filename.endswith('.npy'):
+                filename += '.npy'
+            digest = hashlib.sha256(np.packbits(free).tobytes())
+            digest.update(repr((n_directions,) + free.shape).encode())
+            key = digest.hexdigest()
+            try:
+                with open(filename + '.key') as f:
+                    if f.read() == key:
+                        return np.load(filename, mmap_mode='r')
+            except FileNotFoundError:
+                pass
+        dtype = np.uint16 if max(self.nrows, self.ncols) < 2 ** 16 else np.uint32
+        ranges = np.zeros(shape, dtype=dtype)
+        north, east, south, west = ranges
+        north[0] = free[0]
+        for i in range(1, self.nrows):
+            north[i] = (north[i - 1] + 1) * free[i]
+        south[-1] = free[-1]
+        for i in range(self.nrows - 2, -1, -1):
+            south[i] = (south[i + 1] + 1) * free[i]
+        west[:, 0] = free[:, 0]
+        for j in range(1, self.ncols):
+            west[:, j] = (west[:, j - 1] + 1) * free[:, j]
+        east[:, -1] = free[:, -1]
+        for j in range(self.ncols - 2, -1, -1):
+            east[:, j] = (east[:, j + 1] + 1) * free[:, j]
+        if filename is not None:
+            np.save(filename, ranges)
+            with open(filename + '.key', 'w') as f:
+                f.write(key)
+            return np.load(filename, mmap_mode='r')
+        return ranges
+
+    def sample_states(self, N, rng=None):
+        """Return an (N, 3) array of random kinematic states in the map."""
+        rng = np.random.default_rng(rng)
+        empty = np.array(self.empty)
+        states = np.empty((N, 3), dtype=np.intp)
+        states[:, :2] = empty[rng.integers(len(empty), size=N)]
+        states[:, 2] = rng.integers(4, size=N)
+        return states
+
+    def ray_casts(self, states, M=4):
+        """Return an (N, M) array of the readings of sensors 0..M-1 from each
+        of the kinematic states, looked up in the ranges table; 0 for
+        states off the map."""
+        rows, cols, orients = states[:, 0], states[:, 1], states[:, 2]
+        inside = (0 <= rows) & (rows < self.nrows) & (0 <= cols) & (cols < self.ncols)
+        rows, cols = np.where(inside, rows, 0), np.where(inside, cols, 0)
+        directions = (np.arange(M) + orients[:, None]) % 4
+        readings = self.ranges[directions, rows[:, None], cols[:, None]]
+        readings[~inside] = 0
+        return readings
 
     def sample(self):
         """Returns a random kinematic state possible in the map"""
@@ -773,14 +1639,11 @@ class MCLmap:
         # 3R1
         #  2
         delta = ((sensor_num % 2 == 0)*(sensor_num - 1), (sensor_num % 2 == 1)*(2 - sensor_num))
-        # sensor direction changes based on orientation
-        for _ in range(orient):
-            delta = (delta[1], -delta[0])
-        range_count = 0
-        while (0 <= pos[0] < self.nrows) and (0 <= pos[1] < self.nrows) and (not self.m[pos[0]][pos[1]]):
-            pos = vector_add(pos, delta)
-            range_count += 1
-        return range_count
+        # sensor direction changes based on orientation, which is to say
+        # it points in direction (sensor_num + orient) % 4 of ranges
+        if 0 <= pos[0] < self.nrows and 0 <= pos[1] < self.ncols:
+            return int(self.ranges[(sensor_num + orient) % 4, pos[0], pos[1]])
+        return 0
 
 
 def monte_carlo_localization(a, z, N, P_motion_sample, P_sensor, m, S=None):
@@ -808,3 +1671,22 @@ def monte_carlo_localization(a, z, N, P_motion_sample, P_sensor, m, S=None):
 
     S = weighted_sample_with_replacement(N, S_, W_)
     return S
+
+
+def batched_monte_carlo_localization(a, z, N, motion_sample, P_sensor, m, S=None, rng=None):
+    """monte_carlo_localization over an (N, 3) array S of kinematic states,
+    as made by m.sample_states. motion_sample(S, v, w, rng) moves all the
+    states at once; P_sensor is as for monte_carlo_localization, and is
+    only called to tabulate P_sensor(z[j], r) for each possible range r,
+    so that the weights are gathered from the table by the ray_casts."""
+    rng = np.random.default_rng(rng)
+    if S is None:
+        S = m.sample_states(N, rng)
+    S_ = motion_sample(S, a['v'], a['w'], rng)
+    max_range = max(m.nrows, m.ncols)
+    likelihood = np.array([[P_sensor(z_j, r) for r in range(max_range + 1)] for z_j in z])
+    readings = m.ray_casts(S_, len(z))
+    W_ = likelihood[np.arange(len(z)), readings].prod(axis=1)
+    if not W_.any():  # No state fits z; leave them all in play
+        return S_
+    return S_[systematic_resample(W_, rng)]
@@ -6,17 +6,30 @@ functions."""
 
 from utils import (
     is_in, argmin, argmax, argmax_random_tie, probability, weighted_sampler,
-    memoize, print_table, open_data, PriorityQueue, name,
+    memoize, print_table, open_data, PriorityQueue, name, PeakMemory,
     distance, vector_add
 )
 
 from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from array import array
 import math
 import random
+import signal
 import sys
+import time
 import bisect
+import mmap
+import struct
 from operator import itemgetter
 
+import numpy as np
+
+try:  # resource is only available on Unix
+    import resource
+except ImportError:
+    resource = None
+
 
 infinity = float('inf')
 
@@ -141,6 +154,135 @@ class Node:
 # ______________________________________________________________________________
 
 
+class NodePool:
+
+    """Compact storage for the nodes of a search tree, for searches that
+    expand too many nodes to give each one its own object. The path cost,
+    f and h values, depth and parent of every node live in parallel typed
+    arrays; only states and actions, which can be arbitrary objects, are
+    kept in lists. Nodes are handed out as PooledNode views onto the pool,
+    so a node that is no longer on the frontier costs a few dozen bytes.
+    The slots of discarded leaf nodes are reused. Path costs are stored as
+    floats."""
+
+    def __init__(self):
+        self.free = []  # Indices of discarded nodes, ready for reuse
+        self.states = []
+        self.actions = []
+        self.parents = array('q')  # Index of the parent; -1 for the root
+        self.depths = array('q')
+        self.path_costs = array('d')
+        self.fs = array('d')  # nan until an f value is stored
+        self.hs = array('d')  # nan until an h value is stored
+
+    def add(self, state, parent=-1, action=None, path_cost=0):
+        """Store a node (with the index of its parent) and return a view."""
+        depth = self.depths[parent] + 1 if parent >= 0 else 0
+        if self.free:
+            index = self.free.pop()
+            self.states[index] = state
+            self.actions[index] = action
+            self.parents[index] = parent
+            self.depths[index] = depth
+            self.path_costs[index] = path_cost
+            self.fs[index] = self.hs[index] = math.nan
+        else:
+            index = len(self.states)
+            self.states.append(state)
+            self.actions.append(action)
+            self.parents.append(parent)
+            self.depths.append(depth)
+            self.path_costs.append(path_cost)
+            self.fs.append(math.nan)
+            self.hs.append(math.nan)
+        return PooledNode(self, index)
+
+    def discard(self, node):
+        """Free the slot of a node that no other node has as its parent."""
+        self.states[node.index] = self.actions[node.index] = None
+        self.free.append(node.index)
+
+    def __len__(self):
+        """The number of nodes stored."""
+        return len(self.states) - len(self.free)
+
+
+class PooledNode:
+
+    """A search tree Node whose data lives in a NodePool. It behaves like a
+    Node, including the f and h slots used by memoize, but only holds the
+    pool and its index in it."""
+
+    __slots__ = ('pool', 'index')
+
+    def __init__(self, pool, index):
+        self.pool = pool
+        self.index = index
+
+    @property
+    def state(self):
+        return self.pool.states[self.index]
+
+    @property
+    def action(self):
+        return self.pool.actions[self.index]
+
+    @property
+    def parent(self):
+        parent = self.pool.parents[self.index]
+        return PooledNode(self.pool, parent) if parent >= 0 else None
+
+    @property
+    def path_cost(self):
+        return self.pool.path_costs[self.index]
+
+    @property
+    def depth(self):
+        return self.pool.depths[self.index]
+
+    @property
+    def f(self):
+        f = self.pool.fs[self.index]
+        if math.isnan(f):
+            raise AttributeError('f')
+        return f
+
+    @f.setter
+    def f(self, value):
+        self.pool.fs[self.index] = value
+
+    @property
+    def h(self):
+        h = self.pool.hs[self.index]
+        if math.isnan(h):
+            raise AttributeError('h')
+        return h
+
+    @h.setter
+    def h(self, value):
+        self.pool.hs[self.index] = value
+
+    def child_node(self, problem, action):
+        next_state = problem.result(self.state, action)
+        return self.pool.add(next_state, self.index, action,
+                             problem.path_cost(self.path_cost, self.state,
+                                               action, next_state))
+
+    __repr__ = Node.__repr__
+    __lt__ = Node.__lt__
+    expand = Node.expand
+    solution = Node.solution
+    path = Node.path
+
+    def __eq__(self, other):
+        return isinstance(other, PooledNode) and self.state == other.state
+
+    def __hash__(self):
+        return hash(self.state)
+
+# ______________________________________________________________________________
+
+
 class SimpleProblemSolvingAgentProgram:
 
     """Abstract framework for a problem-solving agent. [Figure 3.1]"""
@@ -219,15 +361,19 @@ def depth_first_graph_search(problem):
         Does not get trapped by loops.
         If two paths reach a state, only use the first one. [Figure 3.7]"""
     frontier = [(Node(problem.initial))]  # Stack
+    frontier_states = {problem.initial}  # Index of frontier, for O(1) lookup
     explored = set()
     while frontier:
         node = frontier.pop()
+        frontier_states.discard(node.state)
         if problem.goal_test(node.state):
             return node
         explored.add(node.state)
-        frontier.extend(child for child in node.expand(problem)
-                        if child.state not in explored and
-                        child not in frontier)
+        for child in node.expand(problem):
+            if child.state not in explored and \
+                    child.state not in frontier_states:
+                frontier.append(child)
+                frontier_states.add(child.state)
     return None
 
 
@@ -241,29 +387,39 @@ def breadth_first_graph_search(problem):
     if problem.goal_test(node.state):
         return node
     frontier = deque([node])
+    frontier_states = {node.state}  # Index of frontier, for O(1) lookup
     explored = set()
     while frontier:
         node = frontier.popleft()
+        frontier_states.discard(node.state)
         explored.add(node.state)
         for child in node.expand(problem):
-            if child.state not in explored and child not in frontier:
+            if child.state not in explored and \
+                    child.state not in frontier_states:
                 if problem.goal_test(child.state):
                     return child
                 frontier.append(child)
+                frontier_states.add(child.state)
     return None
 
 
-def best_first_graph_search(problem, f):
+def best_first_graph_search(problem, f, node_pool=False):
     """Search the nodes with the lowest f scores first.
     You specify the function f(node) that you want to minimize; for example,
     if f is a heuristic estimate to the goal, then we have greedy best
     first search; if f is node.depth then we have breadth-first search.
     There is a subtlety: the line "f = memoize(f, 'f')" means that the f
     values will be cached on the nodes as they are computed. So after doing
-    a best first search you can examine the f values of the path returned."""
+    a best first search you can examine the f values of the path returned.
+    The frontier is an indexed PriorityQueue, so checking whether a state is
+    on the frontier and replacing it with a cheaper node are both cheap.
+    With node_pool=True the search tree is kept in a compact NodePool, for
+    searches that would otherwise run out of memory."""
     f = memoize(f, 'f')
-    node = Node(problem.initial)
-    frontier = PriorityQueue('min', f)
+    pool = NodePool() if node_pool else None
+    node = pool.add(problem.initial) if node_pool else Node(problem.initial)
+    # A replaced node is a leaf, so its slot is freed once the queue drops it
+    frontier = PriorityQueue('min', f, release=pool.discard if node_pool else None)
     frontier.append(node)
     explored = set()
     while frontier:
@@ -279,12 +435,17 @@ def best_first_graph_search(problem, f):
                 if f(child) < f(incumbent):
                     del frontier[incumbent]
                     frontier.append(child)
+                elif node_pool:
+                    pool.discard(child)
+            elif node_pool:
+                pool.discard(child)
     return None
 
 
-def uniform_cost_search(problem):
+def uniform_cost_search(problem, node_pool=False):
     """[Figure 3.14]"""
-    return best_first_graph_search(problem, lambda node: node.path_cost)
+    return best_first_graph_search(problem, lambda node: node.path_cost,
+                                   node_pool)
 
 
 def depth_limited_search(problem, limit=50):
@@ -402,12 +563,13 @@ greedy_best_first_graph_search = best_first_graph_search
 # Greedy best-first search is accomplished by specifying f(n) = h(n).
 
 
-def astar_search(problem, h=None):
+def astar_search(problem, h=None, node_pool=False):
     """A* search is best-first graph search with f(n) = g(n)+h(n).
     You need to specify the h function when you call astar_search, or
     else in your Problem subclass."""
     h = memoize(h or problem.h, 'h')
-    return best_first_graph_search(problem, lambda n: n.path_cost + h(n))
+    return best_first_graph_search(problem, lambda n: n.path_cost + h(n),
+                                   node_pool)
 
 # ______________________________________________________________________________
 # A* heuristics 
@@ -484,6 +646,231 @@ class EightPuzzle(Problem):
 
         return sum(s != g for (s, g) in zip(node.state, self.goal))
 
+class SlidingPuzzle(Problem):
+
+    """The NxN generalization of the EightPuzzle: tiles numbered from 1 to
+    N*N-1 on an NxN board, where one of the squares is a blank. A state is a
+    tuple of length N*N, where element i is the tile at index i (0 for the
+    blank), and the actions name the direction in which the blank moves.
+    SlidingPuzzle(state) with a state of length 16 is the 15-puzzle."""
+
+    def __init__(self, initial, goal=None):
+        """ Define goal state and initialize a problem """
+        self.width = exact_sqrt(len(initial))
+        if goal is None:
+            goal = tuple(range(1, len(initial))) + (0,)
+        Problem.__init__(self, initial, goal)
+        # distances[tile][i]: Manhattan distance of tile at i from its goal
+        self.distances = [[0] * len(goal) for _ in goal]
+        for target, tile in enumerate(goal):
+            for i in range(len(goal)):
+                self.distances[tile][i] = (
+                    abs(i // self.width - target // self.width) +
+                    abs(i % self.width - target % self.width))
+
+    def actions(self, state):
+        """ Return the directions in which the blank can move """
+        blank = state.index(0)
+        possible_actions = []
+        if blank >= self.width:
+            possible_actions.append('UP')
+        if blank < len(state) - self.width:
+            possible_actions.append('DOWN')
+        if blank % self.width > 0:
+            possible_actions.append('LEFT')
+        if blank % self.width < self.width - 1:
+            possible_actions.append('RIGHT')
+        return possible_actions
+
+    def result(self, state, action):
+        """ Given state and action, return a new state that is the result of the action.
+        Action is assumed to be a valid action in the state """
+        blank = state.index(0)
+        delta = {'UP': -self.width, 'DOWN': self.width, 'LEFT': -1, 'RIGHT': 1}
+        neighbor = blank + delta[action]
+        new_state = list(state)
+        new_state[blank], new_state[neighbor] = new_state[neighbor], new_state[blank]
+        return tuple(new_state)
+
+    def check_solvability(self, state):
+        """ Checks if the given state can reach the default goal, using the
+        parity of the tile inversions (and for even widths, of the row of
+        the blank counted from the bottom) """
+        tiles = [tile for tile in state if tile != 0]
+        inversions = sum(tiles[i] > tiles[j]
+                         for i in range(len(tiles))
+                         for j in range(i + 1, len(tiles)))
+        if self.width % 2 == 1:
+            return inversions % 2 == 0
+        blank_row_from_bottom = self.width - state.index(0) // self.width
+        return (inversions + blank_row_from_bottom) % 2 == 1
+
+    def h(self, node):
+        """ Return the sum of the Manhattan distances of the tiles from their
+        goal squares, read from the table built in the constructor """
+        distances = self.distances
+        return sum(distances[tile][i] for (i, tile) in enumerate(node.state)
+                   if tile != 0)
+
+# ______________________________________________________________________________
+# Additive pattern databases for sliding-tile puzzles
+#
+# A pattern database stores, for one group of tiles, the fewest moves of
+# those tiles needed to bring them from any placement to their goal
+# squares, ignoring the other tiles' identities. If only moves of the
+# group's own tiles are counted, the values for disjoint groups can be added
+# and still never overestimate, which makes the sum an admissible heuristic
+# much stronger than Manhattan distance.
+#
+# The table for a group of k tiles on an S-square board is indexed by
+# code = sum(position[tile_i] * S**i), one byte per entry (255 when a
+# placement cannot occur). On disk, a database is
+#     b'AIMAPDB1', width (byte), number of groups (byte), goal (S bytes),
+# then for each group: k (byte), its k tiles (bytes), its S**k table bytes.
+# Loading memory-maps the file, so tables are paged in only as needed.
+
+PDB_MAGIC = b'AIMAPDB1'
+
+
+class PatternDatabase:
+
+    """An additive pattern database heuristic for sliding-tile puzzles with
+    the given goal. Call it on a node (or state) to get the sum over its
+    groups of tiles of the stored distance, e.g.
+        pdb = build_pattern_database(EightPuzzle(state).goal)
+        astar_search(EightPuzzle(state), h=pdb)
+    Use build_pattern_database to build one, and save/load_pattern_database
+    to keep it on disk."""
+
+    def __init__(self, goal, groups, tables):
+        self.goal = tuple(goal)
+        self.width = exact_sqrt(len(goal))
+        self.groups = [tuple(tiles) for tiles in groups]
+        self.tables = tables  # Anything indexable by code, giving an int
+        size = len(goal)
+        self.weights = [[size ** i for i in range(len(tiles))]
+                        for tiles in self.groups]
+
+    def __call__(self, node):
+        state = getattr(node, 'state', node)
+        where = [0] * len(state)
+        for (i, tile) in enumerate(state):
+            where[tile] = i
+        return sum(table[sum(where[tile] * weight
+                             for (tile, weight) in zip(tiles, weights))]
+                   for (tiles, weights, table)
+                   in zip(self.groups, self.weights, self.tables))
+
+    def save(self, filename):
+        """Write the database in the binary format described above."""
+        with open(filename, 'wb') as f:
+            f.write(struct.pack('<8sBB', PDB_MAGIC, self.width, len(self.groups)))
+            f.write(bytes(self.goal))
+            for tiles, table in zip(self.groups, self.tables):
+                f.write(struct.pack('<B', len(tiles)))
+                f.write(bytes(tiles))
+                f.write(table)
+
+
+def default_tile_groups(goal, max_group_size=5):
+    """Split the tiles of goal in numerical order into as few groups of at
+    most max_group_size tiles as possible, with sizes as even as possible:
+    (1..4), (5..8) for the 8-puzzle and three groups of 5 for the 15-puzzle."""
+    tiles = sorted(tile for tile in goal if tile != 0)
+    ngroups = -(-len(tiles) // max_group_size)
+    return [tiles[i * len(tiles) // ngroups:(i + 1) * len(tiles) // ngroups]
+            for i in range(ngroups)]
+
+
+def build_pattern_database(goal, groups=None):
+    """Build an additive PatternDatabase for the puzzle with the given goal
+    and disjoint groups of tiles (by default, default_tile_groups)."""
+    groups = groups or default_tile_groups(goal)
+    tiles = [tile for group in groups for tile in group]
+    assert len(tiles) == len(set(tiles)) and 0 not in tiles, \
+        'groups must be disjoint and leave out the blank'
+    return PatternDatabase(goal, groups,
+                           [pattern_table(goal, group) for group in groups])
+
+
+def pattern_table(goal, tiles):
+    """Return the table of one group of tiles as bytes, by breadth-first
+    search backwards from the goal over states (placement of tiles, blank
+    square), one whole level of states at a time with NumPy. A move of one
+    of the group's tiles costs 1; any other move just moves the blank, costs
+    0, and is explored within the current level."""
+    size = len(goal)
+    width = exact_sqrt(size)
+    k = len(tiles)
+    weights = np.array([size ** i for i in range(k)], dtype=np.int64)
+    dist = np.full(size ** (k + 1), 255, dtype=np.uint8)  # id: code*size+blank
+
+    def successors(ids):
+        """Return the (cost 0, cost 1) successors of an array of state ids."""
+        codes, blanks = np.divmod(ids, size)
+        places = [(codes // w) % size for w in weights]
+        free, moved = [], []
+        for delta, ok in ((-width, blanks >= width),
+                          (width, blanks < size - width),
+                          (-1, blanks % width > 0),
+                          (1, blanks % width < width - 1)):
+            code, blank = codes[ok], blanks[ok]
+            neighbor = blank + delta
+            hit = np.zeros(len(code), dtype=bool)
+            new_code = code.copy()
+            for place, w in zip(places, weights):
+                at = place[ok] == neighbor
+                new_code[at] += (blank[at] - neighbor[at]) * w
+                hit |= at
+            free.append(code[~hit] * size + neighbor[~hit])
+            moved.append(new_code[hit] * size + neighbor[hit])
+        return np.concatenate(free), np.concatenate(moved)
+
+    def unseen(ids):
+        return np.unique(ids[dist[ids] == 255])
+
+    start = sum(goal.index(tile) * size ** i for (i, tile) in enumerate(tiles))
+    frontier = np.array([start * size + goal.index(0)], dtype=np.int64)
+    depth = 0
+    while frontier.size:
+        dist[frontier] = depth
+        level, new = [frontier], frontier
+        while new.size:  # Close the level under free moves of the blank
+            new = unseen(successors(new)[0])
+            dist[new] = depth
+            level.append(new)
+        frontier = unseen(successors(np.concatenate(level))[1])
+        depth += 1
+    # The distance of a placement is its best over the squares of the blank
+    return dist.reshape(size ** k, size).min(axis=1).tobytes()
+
+
+def save_pattern_database(pdb, filename):
+    """Write pdb to filename."""
+    pdb.save(filename)
+
+
+def load_pattern_database(filename):
+    """Return the PatternDatabase stored in filename, with its tables
+    memory-mapped rather than read into memory."""
+    with open(filename, 'rb') as f:
+        data = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+    magic, width, ngroups = struct.unpack_from('<8sBB', data)
+    if magic != PDB_MAGIC:
+        raise ValueError('Not a pattern database file', filename)
+    size = width * width
+    offset = struct.calcsize('<8sBB')
+    goal = tuple(data[offset:offset + size])
+    offset += size
+    groups, tables = [], []
+    for _ in range(ngroups):
+        k = data[offset]
+        groups.append(tuple(data[offset + 1:offset + 1 + k]))
+        offset += 1 + k
+        tables.append(data[offset:offset + size ** k])
+        offset += size ** k
+    return PatternDatabase(goal, groups, tables)
+
 # ______________________________________________________________________________
 
 
@@ -1056,12 +1443,47 @@ def RandomGraph(nodes=list(range(10)), min_links=2, width=400, height=300,
     Then each node is connected to the min_links nearest neighbors.
     Because inverse links are added, some nodes will have more connections.
     The distance between nodes is the hypotenuse times curvature(),
-    where curvature() defaults to a random number between 1.1 and 1.5."""
+    where curvature() defaults to a random number between 1.1 and 1.5.
+    Nearest neighbors are looked up in a grid of square cells laid over the
+    rectangle, so graphs with 10^5 nodes can be built in seconds."""
     g = UndirectedGraph()
     g.locations = {}
     # Build the cities
     for node in nodes:
         g.locations[node] = (random.randrange(width), random.randrange(height))
+    # Drop the cities into cells holding about one city each
+    cell = max(1, int(math.sqrt(width * height / max(1, len(nodes)))))
+    cells = defaultdict(list)
+    for i, node in enumerate(nodes):
+        x, y = g.locations[node]
+        cells[x // cell, y // cell].append((i, node))
+    max_ring = max(width, height) // cell + 1
+
+    def ring_cells(cx, cy, r):
+        """The cells at exactly Chebyshev distance r from cell (cx, cy)."""
+        if r == 0:
+            return [(cx, cy)]
+        return ([(cx + dx, cy + dy) for dx in range(-r, r + 1) for dy in (-r, r)] +
+                [(cx + dx, cy + dy) for dy in range(1 - r, r) for dx in (-r, r)])
+
+    def nearest_neighbor(node, here):
+        """The nearest city not yet linked to node, ties going to the one
+        listed first in nodes (just as argmin over nodes would choose)."""
+        cx, cy = here[0] // cell, here[1] // cell
+        best_d, best_i, best = infinity, 0, None
+        for r in range(max_ring + 1):
+            for c in ring_cells(cx, cy, r):
+                for i, n in cells.get(c, ()):
+                    if n is node or g.get(node, n):
+                        continue
+                    d = distance(g.locations[n], here)
+                    if (d, i) < (best_d, best_i):
+                        best_d, best_i, best = d, i, n
+            # Cities in cells beyond ring r are more than r * cell away
+            if best_d <= r * cell:
+                break
+        return best
+
     # Build roads from each city to at least min_links nearest neighbors.
     for i in range(min_links):
         for node in nodes:
@@ -1072,7 +1494,9 @@ def RandomGraph(nodes=list(range(10)), min_links=2, width=400, height=300,
                     if n is node or g.get(node, n):
                         return infinity
                     return distance(g.locations[n], here)
-                neighbor = argmin(nodes, key=distance_to_node)
+                neighbor = nearest_neighbor(node, here)
+                if neighbor is None:
+                    neighbor = argmin(nodes, key=distance_to_node)
                 d = distance(g.locations[neighbor], here) * curvature()
                 g.connect(node, neighbor, int(d))
     return g
@@ -1222,11 +1646,14 @@ class GraphProblemStochastic(GraphProblem):
 
 class NQueensProblem(Problem):
 
-    """The problem of placing N queens on an NxN board with none attacking
+    r"""The problem of placing N queens on an NxN board with none attacking
     each other.  A state is represented as an N-element array, where
     a value of r in the c-th entry means there is a queen at column c,
     row r, and a value of -1 means that the c-th column has not been
     filled in yet.  We fill in columns left to right.
+    Attacks are checked on bitboards: an integer per direction whose bit i
+    is set when a queen occupies row i, \ diagonal i or / diagonal i. Then
+    all the free rows of a column can be found in a few integer operations.
     >>> depth_first_tree_search(NQueensProblem(8))
     <Node (7, 3, 0, 2, 5, 1, 6, 4)>
     """
@@ -1238,12 +1665,17 @@ class NQueensProblem(Problem):
 
     def actions(self, state):
         """In the leftmost empty column, try all non-conflicting rows."""
-        if state[-1] is not -1:
+        if state[-1] != -1:
             return []  # All columns filled; no successors
         else:
             col = state.index(-1)
-            return [row for row in range(self.N)
-                    if not self.conflicted(state, row, col)]
+            free = self.free_rows(state, col)
+            rows = []
+            while free:
+                lowest = free & -free
+                rows.append(lowest.bit_length() - 1)
+                free ^= lowest
+            return rows
 
     def result(self, state, row):
         """Place the next queen at the given row."""
@@ -1252,10 +1684,28 @@ class NQueensProblem(Problem):
         new[col] = row
         return tuple(new)
 
+    def bitboards(self, state, ncols):
+        r"""Return the (rows, downs, ups) bitboards of the queens in the first
+        ncols columns. Bit r + c of downs marks the \ diagonal through
+        (r, c), and bit r - c + N - 1 of ups marks the / diagonal."""
+        rows = downs = ups = 0
+        for c in range(ncols):
+            r = state[c]
+            rows |= 1 << r
+            downs |= 1 << (r + c)
+            ups |= 1 << (r - c + self.N - 1)
+        return rows, downs, ups
+
+    def free_rows(self, state, col):
+        """Return a bitmask of the rows in column col that no queen in the
+        columns to its left attacks."""
+        rows, downs, ups = self.bitboards(state, col)
+        attacked = rows | (downs >> col) | (ups >> (self.N - 1 - col))
+        return ~attacked & ((1 << self.N) - 1)
+
     def conflicted(self, state, row, col):
         """Would placing a queen at (row, col) conflict with anything?"""
-        return any(self.conflict(row, col, state[c], c)
-                   for c in range(col))
+        return not self.free_rows(state, col) >> row & 1
 
     def conflict(self, row1, col1, row2, col2):
         """Would putting two queens in (row1, col1) and (row2, col2) conflict?"""
@@ -1266,20 +1716,22 @@ class NQueensProblem(Problem):
 
     def goal_test(self, state):
         """Check if all columns filled, no conflicts."""
-        if state[-1] is -1:
+        if -1 in state:
             return False
-        return not any(self.conflicted(state, state[col], col)
-                       for col in range(len(state)))
+        # With no two queens sharing a line, each bitboard has N bits set
+        return all(bin(board).count('1') == self.N
+                   for board in self.bitboards(state, self.N))
 
     def h(self, node):
         """Return number of conflicting queens for a given node"""
-        num_conflicts = 0
-        for (r1, c1) in enumerate(node.state):
-            for (r2, c2) in enumerate(node.state):
-                if (r1, c1) != (r2, c2):
-                    num_conflicts += self.conflict(r1, c1, r2, c2)
-
-        return num_conflicts
+        # Each pair of queens sharing a line is counted twice, as (a, b) and
+        # (b, a); unfilled columns count as queens in row -1.
+        lines = defaultdict(int)
+        for (c, r) in enumerate(node.state):
+            lines['row', r] += 1
+            lines['down', r + c] += 1
+            lines['up', r - c] += 1
+        return sum(k * (k - 1) for k in lines.values())
 
 # ______________________________________________________________________________
 # Inverse Boggle: Search for a high-scoring Boggle board. A good domain for
@@ -1506,6 +1958,8 @@ class InstrumentedProblem(Problem):
         self.problem = problem
         self.succs = self.goal_tests = self.states = 0
         self.found = None
+        self.peak_memory = None
+        self.solution = self.cost = None  # Of the node a search returned
 
     def actions(self, state):
         self.succs += 1
@@ -1532,22 +1986,101 @@ class InstrumentedProblem(Problem):
         return getattr(self.problem, attr)
 
     def __repr__(self):
+        if self.peak_memory is not None:
+            return '<{:4d}/{:4d}/{:4d}/{}/{}K>'.format(
+                self.succs, self.goal_tests, self.states,
+                str(self.found)[:4], self.peak_memory)
         return '<{:4d}/{:4d}/{:4d}/{}>'.format(self.succs, self.goal_tests,
                                                self.states, str(self.found)[:4])
 
 
+class SearchTimeout(Exception):
+    """Raised inside a search that has run out of time."""
+
+
+def _raise_search_timeout(signum, frame):
+    raise SearchTimeout()
+
+
+def instrumented_search(searcher, problem, timeout=None, max_memory=None):
+    """Run searcher on an InstrumentedProblem wrapping problem, and return
+    its statistics as (succs, goal_tests, states, found, peak_memory,
+    solution, cost), where peak_memory is the most memory, in kilobytes, the
+    search itself held (see PeakMemory), and solution and cost are the
+    actions and path cost of the node it returned (None if it returned no
+    node). A search that runs for more than timeout seconds, or
+    would grow the process beyond max_memory bytes of address space, is
+    stopped with found set to 'TIMEOUT' or 'MEMORY'. The limits need Unix;
+    elsewhere they are ignored."""
+    p = InstrumentedProblem(problem)
+    timed = timeout and hasattr(signal, 'setitimer')
+    capped = max_memory and resource is not None
+    if timed:
+        old_handler = signal.signal(signal.SIGALRM, _raise_search_timeout)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    if capped:
+        old_limit = resource.getrlimit(resource.RLIMIT_AS)
+        resource.setrlimit(resource.RLIMIT_AS, (max_memory, old_limit[1]))
+    memory = PeakMemory()
+    try:
+        with memory:
+            node = searcher(p)
+        if hasattr(node, 'solution'):
+            p.solution, p.cost = node.solution(), node.path_cost
+    except SearchTimeout:
+        p.found = 'TIMEOUT'
+    except MemoryError:
+        p.found = 'MEMORY'
+    finally:
+        if timed:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, old_handler)
+        if capped:
+            resource.setrlimit(resource.RLIMIT_AS, old_limit)
+    p.peak_memory = memory.kilobytes
+    return p.succs, p.goal_tests, p.states, p.found, p.peak_memory, p.solution, p.cost
+
+
+def run_searchers(problems, searchers, processes=1, timeout=None,
+                  max_memory=None):
+    """Run each searcher on each problem, with the limits of
+    instrumented_search, and return a table with one row per searcher:
+    its name followed by an InstrumentedProblem per problem. With processes
+    other than 1 the (searcher, problem) pairs are fanned out over a pool of
+    that many worker processes (None means one per core); the searchers and
+    problems must then be picklable, so no lambdas."""
+    tasks = [(s, p) for s in searchers for p in problems]
+    if processes == 1:
+        results = [instrumented_search(s, p, timeout, max_memory)
+                   for (s, p) in tasks]
+    else:
+        with ProcessPoolExecutor(processes) as executor:
+            futures = [executor.submit(instrumented_search, s, p,
+                                       timeout, max_memory)
+                       for (s, p) in tasks]
+            results = [future.result() for future in futures]
+    instrumented = []
+    for (s, problem), result in zip(tasks, results):
+        p = InstrumentedProblem(problem)
+        (p.succs, p.goal_tests, p.states, p.found, p.peak_memory,
+         p.solution, p.cost) = result
+        instrumented.append(p)
+    n = len(problems)
+    return [[name(s)] + instrumented[i * n:(i + 1) * n]
+            for i, s in enumerate(searchers)]
+
+
 def compare_searchers(problems, header,
                       searchers=[breadth_first_tree_search,
                                  breadth_first_graph_search,
                                  depth_first_graph_search,
                                  iterative_deepening_search,
                                  depth_limited_search,
-                                 recursive_best_first_search]):
-    def do(searcher, problem):
-        p = InstrumentedProblem(problem)
-        searcher(p)
-        return p
-    table = [[name(s)] + [do(s, p) for p in problems] for s in searchers]
+                                 recursive_best_first_search],
+                      processes=1, timeout=None, max_memory=None):
+    """Print a table of search statistics for each searcher on each problem.
+    See run_searchers for running them in parallel and with limits."""
+    table = run_searchers(problems, searchers, processes, timeout, max_memory)
     print_table(table, header)
 
 
@@ -1559,3 +2092,42 @@ def compare_graph_searchers():
                       header=['Searcher', 'romania_map(Arad, Bucharest)',
                               'romania_map(Oradea, Neamt)', 'australia_map'])
 
+
+def benchmark_graph_searchers(n=10**5, min_links=4,
+                              searchers=[uniform_cost_search, astar_search],
+                              seed=None):
+    """Time searchers on a RandomGraph with n nodes, routing from a random
+    city to the city the most links away from it, and print the times along
+    with the search statistics. The peak memory of each search is measured
+    in a second, untimed run, since tracing allocations slows the search.
+    The rectangle the cities are laid out on
+    grows with sqrt(n), so that few cities share a spot, since those are
+    joined by a 0 (infinite cost) link."""
+    if seed is not None:
+        random.seed(seed)
+    scale = math.sqrt(n)
+    graph = RandomGraph(list(range(n)), min_links,
+                        width=int(400 * scale), height=int(300 * scale))
+    initial = goal = random.randrange(n)
+    reached, frontier = {initial}, deque([initial])
+    while frontier:
+        goal = frontier.popleft()
+        for city in graph.get(goal):
+            if city not in reached:
+                reached.add(city)
+                frontier.append(city)
+    problem = GraphProblem(initial, goal, graph)
+
+    def do(searcher):
+        p = InstrumentedProblem(problem)
+        start = time.perf_counter()
+        node = searcher(p)
+        elapsed = time.perf_counter() - start
+        with PeakMemory() as memory:
+            searcher(problem)
+        p.peak_memory = memory.kilobytes
+        assert node is None or node.path_cost < infinity, 'path through a 0 link'
+        return [name(searcher), p, node and node.path_cost, elapsed]
+    table = [do(s) for s in searchers]
+    print_table(table, ['Searcher', 'succs/goal_tests/states/found/peak memory',
+                        'Path cost', 'Seconds'], numfmt='{:.3f}')
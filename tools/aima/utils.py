@@ -9,6 +9,7 @@ import os.path
 import random
 import math
 import functools
+import tracemalloc
 import numpy as np
 from itertools import chain, combinations
 
@@ -441,6 +442,34 @@ def name(obj):
             str(obj))
 
 
+class PeakMemory:
+    """A context manager measuring the most memory, in kilobytes, that Python
+    held in the block beyond what it held on entering it: its kilobytes
+    field, set on exit. Allocations are traced by tracemalloc (which slows
+    the block down), so only memory from Python's allocators counts.
+    >>> with PeakMemory() as memory:
+    ...     data = list(range(100000))
+    ...     del data
+    >>> memory.kilobytes > 500
+    True
+    """
+
+    def __enter__(self):
+        self.tracing = tracemalloc.is_tracing()
+        if not self.tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        self.start = tracemalloc.get_traced_memory()[0]
+        self.kilobytes = None
+        return self
+
+    def __exit__(self, *exc):
+        self.kilobytes = (tracemalloc.get_traced_memory()[1] - self.start) // 1024
+        if not self.tracing:
+            tracemalloc.stop()
+        return False
+
+
 def isnumber(x):
     """Is x a number?"""
     return hasattr(x, '__int__')
@@ -740,10 +769,19 @@ class PriorityQueue:
     order) is returned first.
     If order is 'min', the item with minimum f(x) is
     returned first; if order is 'max', then it is the item with maximum f(x).
-    Also supports dict-like lookup."""
-
-    def __init__(self, order='min', f=lambda x: x):
+    Also supports dict-like lookup.
+    Items are indexed by value, so membership tests and lookups are O(1) and
+    deletion is O(1) plus an O(log n) pop later on: a deleted entry is only
+    marked dead and is discarded when it reaches the top of the heap. Items
+    must therefore be hashable; if an item is appended more than once, lookups
+    see the most recent copy. release, if given, is called with each deleted
+    item when its dead entry is finally dropped from the heap."""
+
+    def __init__(self, order='min', f=lambda x: x, release=None):
         self.heap = []
+        self.entries = {}
+        self.size = 0
+        self.release = release
 
         if order == 'min':
             self.f = f
@@ -754,7 +792,10 @@ class PriorityQueue:
 
     def append(self, item):
         """Insert item at its correct position."""
-        heapq.heappush(self.heap, (self.f(item), item))
+        entry = [self.f(item), item, True]  # [priority, item, alive]
+        self.entries[item] = entry
+        heapq.heappush(self.heap, entry)
+        self.size += 1
 
     def extend(self, items):
         """Insert each item in items at its correct position."""
@@ -764,28 +805,36 @@ class PriorityQueue:
     def pop(self):
         """Pop and return the item (with min or max f(x) value
         depending on the order."""
-        if self.heap:
-            return heapq.heappop(self.heap)[1]
-        else:
-            raise Exception('Trying to pop from empty PriorityQueue.')
+        while self.heap:
+            entry = heapq.heappop(self.heap)
+            if entry[2]:
+                item = entry[1]
+                if self.entries.get(item) is entry:
+                    del self.entries[item]
+                self.size -= 1
+                return item
+            if self.release is not None:
+                self.release(entry[1])
+        raise Exception('Trying to pop from empty PriorityQueue.')
 
     def __len__(self):
         """Return current capacity of PriorityQueue."""
-        return len(self.heap)
+        return self.size
 
     def __contains__(self, item):
         """Return True if item in PriorityQueue."""
-        return (self.f(item), item) in self.heap
+        return item in self.entries
 
     def __getitem__(self, key):
-        for _, item in self.heap:
-            if item == key:
-                return item
+        entry = self.entries.get(key)
+        if entry is not None:
+            return entry[1]
 
     def __delitem__(self, key):
-        """Delete the first occurrence of key."""
-        self.heap.remove((self.f(key), key))
-        heapq.heapify(self.heap)
+        """Delete the most recent occurrence of key."""
+        entry = self.entries.pop(key)
+        entry[2] = False
+        self.size -= 1
 
 
 # ______________________________________________________________________________
@@ -16,6 +16,13 @@ class EightPuzzle(Problem):
     def __init__(self, initial, goal):
         self.initial = initial
         self.goal = goal
+        # distances[tile][i] is the manhattan distance from square i to the
+        # goal square of tile, so h() need not search the goal for each tile.
+        self.distances = {}
+        for target, tile in enumerate(goal):
+            self.distances[tile] = [abs(target % 3 - i % 3) +
+                                    abs(target // 3 - i // 3)
+                                    for i in range(9)]
         
     def actions(self, state):
         actions = []
@@ -71,10 +78,9 @@ class EightPuzzle(Problem):
         tile from its desired location.
         """
         distance = 0
-        for i in range(1,9):
-            target = self.goal.find(str(i))
-            current = node.state.find(str(i))
-            distance += abs((target % 3) - (current % 3)) + abs((target / 3) - (current / 3)) 
+        for i, tile in enumerate(node.state):
+            if tile != '0':
+                distance += self.distances[tile][i]
         return distance
     
     def swap(self, state, x, y):
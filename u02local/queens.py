@@ -7,7 +7,7 @@ to support a complete-state, value-maximization formulation.
 @version 19dec2012
 """
 from search import Problem, hill_climbing, simulated_annealing, exp_schedule
-import itertools
+import collections
 import math
 
 
@@ -42,9 +42,17 @@ class NQueens(Problem):
         return new_state
 
     def goal_test(self, state):
-        """Check to see if there are no conflicts."""
-        return not any(self.conflicted(state, state[col], col)
-                       for col in range(len(state)))
+        """Check to see if there are no conflicts. The rows and diagonals
+        holding queens are collected as bits of an int each (bitboards); with
+        no conflicts, every queen sets a distinct bit on each of them.
+        """
+        rows = downs = ups = 0
+        for col, row in enumerate(state):
+            rows |= 1 << row
+            downs |= 1 << (row + col)
+            ups |= 1 << (row - col + self.n - 1)
+        return all(bin(bits).count('1') == len(state)
+                   for bits in (rows, downs, ups))
 
     def conflicted(self, state, row, col):
         """Check to see if placing a queen at (row, col) would conflict with
@@ -73,11 +81,17 @@ class NQueens(Problem):
         # Start with the highest possible score (n combined 2).
         value = math.factorial(self.n) / (2 * math.factorial(self.n - 2))
 
-        # Loop through all pairs, subtracting one for every conflicted pair.
-        for pair in itertools.combinations(range(self.n), 2):
-            if self.conflict(state[pair[0]], pair[0], state[pair[1]], pair[1]):
-                value -= 1
-                
+        # Count the queens on each row and diagonal, then subtract one for
+        # every pair sharing a line (k queens on a line make k(k-1)/2 pairs).
+        # Two queens in different columns share at most one line.
+        lines = collections.Counter()
+        for col, row in enumerate(state):
+            lines['row', row] += 1
+            lines['down', row + col] += 1
+            lines['up', row - col] += 1
+        for k in lines.values():
+            value -= k * (k - 1) // 2
+
         return value
 
 
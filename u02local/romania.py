@@ -11,8 +11,8 @@ from numpy import math
 
 from tools.aima.search import UndirectedGraph, GraphProblem, depth_first_graph_search, \
     breadth_first_tree_search, uniform_cost_search, iterative_deepening_search, \
-    astar_search, greedy_best_first_graph_search, best_first_graph_search
-from tools.aima.utils import name, print_table
+    astar_search, greedy_best_first_graph_search, best_first_graph_search, run_searchers
+from tools.aima.utils import print_table
 
 
 romania = UndirectedGraph(dict(
@@ -53,11 +53,13 @@ romania.locations = dict(
     zerind=(108, 531))
 
 
-def compare_searchers(problem, searchers):
-   def apply_search(problem, searcher):
-       result = searcher(problem)
-       return [name(searcher), str(result.solution()), str(result.path_cost)]
-   print_table([apply_search(problem, s) for s in searchers])
+def compare_searchers(problem, searchers, processes=1, timeout=None, max_memory=None):
+   """Print each searcher's solution and its cost. The searchers are run by
+   run_searchers, so in this process unless processes is not 1, and within
+   its timeout and max_memory limits."""
+   table = run_searchers([problem], searchers, processes, timeout, max_memory)
+   print_table([[searcher, str(p.solution) if p.solution is not None else p.found, str(p.cost)]
+                for searcher, p in table])
 
 
 if __name__ == '__main__':